@@ -0,0 +1,327 @@
+import csv
+import json
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from sumoOutputs import iter_chunks
+
+'''
+Headless batch runs of traffic.py over many scenarios, to compare controllers.
+
+A job file (json) lists the jobs, each one a scenario and the controller of its junction:
+
+    [
+        {"net": "sumo-files/small-map-double-lane.net.xml", "demand": {"demand_profile": "rush_hour"}, "controller": "models/policy.npz", "seed": 1},
+        {"net": "sumo-files/small-map-double-lane.net.xml", "routes": "sumo-files/small-map-double-lane.rou.xml", "controller": "models/ppo.zip", "seed": 2}
+    ]
+
+The routes are a route file, or a demand given to routeFileCache.cached_routefile (with the seed of the job).
+The controller is a numpy export of a policy (.npz), a stable baselines3 model, or "fixed-time" for the
+tlLogic of the network. Unless disabled, every scenario is also run with the fixed-time controller as the baseline.
+junction (default: the one of the small map the net is, see JUNCTION_WITH_LIGHTS, or the only traffic light
+of any other net, which must be given when there are several), duration and
+decision_interval can also be given for a job. The duration of a demand defaults to its number_of_timesteps
+(the seconds of departures of its route file), and every job stops earlier once all its vehicles arrived,
+so that empty seconds don't dilute the throughput and the queue length.
+
+The jobs run on a pool of processes, each one driving its own headless sumo. SUMO writes the tripinfo and
+summary outputs of every job, which are parsed in a streaming way (see sumoOutputs.py) once it ends, and the KPIs of all the jobs
+(waiting time, time loss, throughput, queue length) are written as one table (csv).
+'''
+
+FIXED_TIME_CONTROLLER = "fixed-time"
+EMPTY_CHECK_INTERVAL = 60   # seconds the fixed-time controller runs between two checks of the vehicles left
+OUTPUT_DIRECTORY = Path(str(ROOT) + "/batch-runs").resolve()
+
+RESULT_COLUMNS = [
+    "name", "net", "routes", "controller", "seed", "status", "seconds",
+    "vehicles", "arrived", "throughput_per_hour", "mean_waiting_time", "mean_time_loss", "mean_travel_time",
+    "mean_queue", "max_queue", "error",
+]
+
+
+def read_jobs(path):
+    with open(path) as jobs_file:
+        jobs = json.load(jobs_file)
+
+    for index, job in enumerate(jobs):
+        if "net" not in job or ("routes" not in job and "demand" not in job) or "controller" not in job:
+            raise ValueError("Job {} needs a net, routes or a demand, and a controller: {}".format(index, job))
+        job.setdefault("seed", 0)
+
+    return jobs
+
+
+def scenario_of(job):
+    return (job["net"], job.get("routes"), json.dumps(job.get("demand"), sort_keys=True), job["seed"])
+
+
+def with_baseline(jobs):
+    '''
+    Adds a fixed-time job for every scenario which doesn't have one
+    '''
+    scenarios_with_baseline = {scenario_of(job) for job in jobs if job["controller"] == FIXED_TIME_CONTROLLER}
+
+    baselines = []
+    for job in jobs:
+        scenario = scenario_of(job)
+        if scenario not in scenarios_with_baseline:
+            scenarios_with_baseline.add(scenario)
+            baselines.append(dict(job, controller=FIXED_TIME_CONTROLLER, name=None))
+
+    return jobs + baselines
+
+
+def prepare_jobs(jobs):
+    '''
+    Names the jobs and generates (or takes from the cache) the route files of the demands.
+    Done before the jobs are dispatched, so that two workers never generate the same route file.
+    A job whose demand is invalid gets the error instead of its route file, it isn't run and only this job fails
+    '''
+    from generateRouteFile import DEFAULT_NUMBER_OF_TIMESTEPS
+    from routeFileCache import cached_routefile
+
+    prepared = []
+    for index, job in enumerate(jobs):
+        job = dict(job)
+        if not job.get("name"):
+            job["name"] = "{:04d}-{}-{}-{}".format(index, Path(job["net"]).name.split(".")[0], Path(str(job["controller"])).stem, job["seed"])
+        if job.get("routes") is None:
+            try:
+                job["routes"] = str(cached_routefile(seed=job["seed"], **job["demand"]))
+            except Exception:
+                job["error"] = traceback.format_exc(limit=3)
+                prepared.append(job)
+                continue
+            job.setdefault("duration", job["demand"].get("number_of_timesteps", DEFAULT_NUMBER_OF_TIMESTEPS))
+        prepared.append(job)
+
+    return prepared
+
+
+def parse_tripinfo(path):
+    '''
+    Streams the tripinfo output, see sumoOutputs.py
+    '''
+    kpis = {"vehicles": 0, "arrived": 0, "waiting_time": 0.0, "time_loss": 0.0, "travel_time": 0.0}
+
+    for chunk in iter_chunks(path, "tripinfo"):
+        kpis["vehicles"] += len(chunk["arrival"])
+        # unfinished trips (written with --tripinfo-output.write-unfinished) have a negative arrival
+        kpis["arrived"] += int(numpy.count_nonzero(chunk["arrival"] >= 0))
+        kpis["waiting_time"] += float(chunk["waiting_time"].sum())
+        kpis["time_loss"] += float(chunk["time_loss"].sum())
+        kpis["travel_time"] += float(chunk["duration"].sum())
+
+    return kpis
+
+
+def parse_summary(path):
+    '''
+    Queue length is the number of halting vehicles of the network at every step of the summary output
+    '''
+    number_of_steps = 0
+    total_halting = 0.0
+    max_halting = 0.0
+    end_time = 0.0
+
+    for chunk in iter_chunks(path, "summary"):
+        number_of_steps += len(chunk["halting"])
+        total_halting += float(chunk["halting"].sum())
+        max_halting = max(max_halting, float(chunk["halting"].max()))
+        end_time = float(chunk["time"][-1])
+
+    return {"mean_queue": total_halting / max(number_of_steps, 1), "max_queue": max_halting, "end_time": end_time}
+
+
+def run_fixed_time(connection, duration, check_interval=EMPTY_CHECK_INTERVAL):
+    '''
+    The tlLogic of the network runs the junction until duration, or until all the vehicles arrived
+    '''
+    simulation_time = 0.0
+    while simulation_time < duration:
+        simulation_time = min(simulation_time + check_interval, float(duration))
+        connection.simulationStep(simulation_time)
+        if connection.simulation.getMinExpectedNumber() == 0:
+            break
+
+
+def junction_of(job):
+    '''
+    The junction given with the job, the one of the small map the net is, or the only traffic light of the net
+    '''
+    from custom_gym.envs.custom_env_dir.IntersectionTopology import netName, trafficLightJunction
+    from custom_gym.envs.custom_env_dir.TrafficIntersectionEnvSumo import JUNCTION_WITH_LIGHTS
+
+    if job.get("junction"):
+        return job["junction"]
+
+    for intersection_type, junction in JUNCTION_WITH_LIGHTS.items():
+        if netName(job["net"]) == "small-map-{}-lane".format(intersection_type):
+            return junction
+
+    return trafficLightJunction(job["net"])
+
+
+# policies already loaded by the worker process
+loaded_controllers = {}
+
+def load_controller(controller):
+    '''
+    None for the fixed-time controller, the policies are loaded once per worker process
+    '''
+    if controller == FIXED_TIME_CONTROLLER:
+        return None
+
+    if controller not in loaded_controllers:
+        if str(controller).endswith(".npz"):
+            from numpyPolicy import NumpyPolicy
+            loaded_controllers[controller] = NumpyPolicy.load(controller)
+        else:
+            from stable_baselines3 import PPO
+            loaded_controllers[controller] = PPO.load(controller)
+
+    return loaded_controllers[controller]
+
+
+def run_job(job, output_directory, fast_forward=True):
+    '''
+    Runs one job in a process of the pool, returns its row of the results table
+    '''
+    job_directory = Path(output_directory) / job["name"]
+    job_directory.mkdir(parents=True, exist_ok=True)
+    tripinfo_path = job_directory / "tripinfo.xml"
+    summary_path = job_directory / "summary.xml"
+
+    row = {column: job.get(column) for column in ("name", "net", "routes", "controller", "seed")}
+    start = time.perf_counter()
+    try:
+        # traffic.py checks SUMO_HOME when imported (and exits without it), only the workers need it
+        import traffic
+        from custom_gym.envs.custom_env_dir.IntersectionTopology import IntersectionTopology
+
+        duration = job.get("duration", traffic.TOTAL_TIMESTEPS)
+        model = load_controller(job["controller"])
+
+        traffic.traci.start([traffic.sumolib.checkBinary("sumo"),
+            "-n", job["net"],
+            "-r", job["routes"],
+            "--seed", str(job["seed"]),
+            "--time-to-teleport", traffic.time_to_teleport,
+            "--no-step-log", "true",
+            "--no-warnings", "true",
+            "--tripinfo-output", str(tripinfo_path),
+            "--tripinfo-output.write-unfinished", "true",
+            "--summary-output", str(summary_path)], label=job["name"])
+        connection = traffic.traci.getConnection(job["name"])
+
+        try:
+            if model is None:
+                run_fixed_time(connection, duration)
+            else:
+                topology = IntersectionTopology.load(job["net"], junction_of(job))
+                traffic.run(model, fast_forward=fast_forward, decision_interval=job.get("decision_interval", traffic.DECISION_INTERVAL), connection=connection, topology=topology, total_timesteps=duration, until_empty=True)
+        finally:
+            # sumo writes the end of its outputs when it is closed
+            connection.close()
+
+        trips = parse_tripinfo(tripinfo_path)
+        summary = parse_summary(summary_path)
+
+        vehicles = max(trips["vehicles"], 1)
+        row.update({
+            "status": "complete",
+            "vehicles": trips["vehicles"],
+            "arrived": trips["arrived"],
+            "throughput_per_hour": trips["arrived"] * 3600 / max(summary["end_time"], 1),
+            "mean_waiting_time": trips["waiting_time"] / vehicles,
+            "mean_time_loss": trips["time_loss"] / vehicles,
+            "mean_travel_time": trips["travel_time"] / vehicles,
+            "mean_queue": summary["mean_queue"],
+            "max_queue": summary["max_queue"],
+        })
+    except (Exception, SystemExit):
+        row.update({"status": "failed", "error": traceback.format_exc(limit=3)})
+
+    row["seconds"] = time.perf_counter() - start
+
+    return row
+
+
+def run_jobs(jobs, output_directory=OUTPUT_DIRECTORY, number_of_workers=None, baseline=True, fast_forward=True):
+    '''
+    Runs all the jobs on number_of_workers processes (one per core by default), returns the rows of the results table
+    '''
+    if baseline:
+        jobs = with_baseline(jobs)
+    jobs = prepare_jobs(jobs)
+
+    rows = []
+    for job in jobs:
+        if "error" in job:
+            row = {column: job.get(column) for column in ("name", "net", "routes", "controller", "seed", "error")}
+            row.update({"status": "failed", "seconds": 0.0})
+            rows.append(row)
+            print("{}: failed, invalid demand".format(row["name"]))
+
+    jobs_to_run = [job for job in jobs if "error" not in job]
+    number_of_workers = min(number_of_workers or os.cpu_count(), max(len(jobs_to_run), 1))
+
+    with ProcessPoolExecutor(number_of_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(run_job, job, str(output_directory), fast_forward) for job in jobs_to_run]
+
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print("{}: {} in {:.1f} s".format(row["name"], row["status"], row["seconds"]))
+
+    # same order as the jobs
+    order = {job["name"]: index for index, job in enumerate(jobs)}
+
+    return sorted(rows, key=lambda row: order[row["name"]])
+
+
+def write_table(rows, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w", newline="") as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--jobs", help="json file listing the jobs")
+    optParser.add_option("--output", default=str(OUTPUT_DIRECTORY / "results.csv"), help="csv file of the results table")
+    optParser.add_option("--output-directory", default=str(OUTPUT_DIRECTORY), help="directory of the sumo outputs of the jobs")
+    optParser.add_option("--workers", type="int", default=None, help="sumo instances running at the same time, one per core if not given")
+    optParser.add_option("--no-baseline", action="store_false", dest="baseline", default=True, help="don't add the fixed-time controller for every scenario")
+    optParser.add_option("--no-fast-forward", action="store_false", dest="fast_forward", default=True, help="advance sumo one second per traci call")
+    options, args = optParser.parse_args()
+    if options.jobs is None:
+        optParser.error("--jobs is required")
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    rows = run_jobs(read_jobs(options.jobs), options.output_directory, options.workers, options.baseline, options.fast_forward)
+    write_table(rows, options.output)
+
+    print("results written to {}".format(options.output))
@@ -0,0 +1,73 @@
+import warnings
+
+import numpy
+import torch
+
+'''
+Behavior cloning warm start of a stable baselines3 policy.
+
+The action distribution of the policy is fitted to the actions of a replay dataset (see replayDataset.py)
+by maximizing their log likelihood, so that the online training starts from the recorded controller
+instead of a random policy. The shared layers and the action head are trained, the value head is left
+as it is and learns from the first rollouts. A separate optimizer is used, the one of the model
+(and its Adam state) is left untouched for the online training.
+'''
+
+PRETRAIN_EPOCHS = 5
+PRETRAIN_LEARNING_RATE = 1e-3
+
+
+def check_compatible(dataset, lanes, green_phases):
+    '''
+    The recorded observations and actions must be the ones of the env of the policy, same lanes and same green phases
+    in the same order, otherwise the policy would learn a permuted controller
+    '''
+    for name, recorded, expected in (("lanes", dataset.lanes, lanes), ("green phases", dataset.green_phases, green_phases)):
+        if recorded is None or expected is None:
+            warnings.warn("The {} of the recorded trajectories or of the env aren't known, they can't be checked".format(name))
+        elif list(recorded) != list(expected):
+            raise ValueError("The trajectories were recorded with the {} {}, the env of the policy has {}".format(name, list(recorded), list(expected)))
+
+
+def pretrain_policy(model, dataset, epochs=PRETRAIN_EPOCHS, learning_rate=PRETRAIN_LEARNING_RATE, lanes=None, green_phases=None):
+    '''
+    lanes, green_phases: the ones of the env of the policy (observed_lanes and green_phases of the envs), checked against the recorded ones
+    Returns the mean negative log likelihood and the accuracy of the deterministic action of every epoch
+    '''
+    policy = model.policy
+    if dataset.observation_shape != tuple(model.observation_space.shape):
+        raise ValueError("The recorded observations have the shape {}, the policy expects {}".format(dataset.observation_shape, model.observation_space.shape))
+    check_compatible(dataset, lanes, green_phases)
+
+    optimizer = torch.optim.Adam(policy.parameters(), lr=learning_rate)
+
+    history = []
+    policy.set_training_mode(True)
+    try:
+        for epoch in range(epochs):
+            total_loss = 0.0
+            correct = 0
+            seen = 0
+
+            for observations, actions in dataset:
+                observations = torch.as_tensor(numpy.asarray(observations, dtype=numpy.float32), device=policy.device)
+                actions = torch.as_tensor(actions, device=policy.device)
+
+                distribution = policy.get_distribution(observations)
+                loss = -distribution.log_prob(actions).mean()
+
+                optimizer.zero_grad()
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(policy.parameters(), model.max_grad_norm)
+                optimizer.step()
+
+                total_loss += loss.item() * len(actions)
+                correct += (distribution.mode() == actions).sum().item()
+                seen += len(actions)
+
+            history.append({"epoch": epoch, "loss": total_loss / max(seen, 1), "accuracy": correct / max(seen, 1)})
+            print("behavior cloning epoch {}: loss {:.4f}, accuracy {:.3f}".format(epoch, history[-1]["loss"], history[-1]["accuracy"]))
+    finally:
+        policy.set_training_mode(False)
+
+    return history
@@ -0,0 +1,230 @@
+import json
+import optparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+import gym
+import custom_gym.envs  # registers the environments
+
+'''
+Throughput benchmark of the registered traffic intersection environments.
+
+For each registered environment, alone and vectorized, measures:
+- steps per second (and environment steps per second, steps times the number of environments)
+- cost of a reset
+- memory allocated per step, with tracemalloc (net blocks and bytes still allocated after the steps,
+  and the mean peak of the bytes allocated during a step)
+The timings are taken without tracemalloc, which slows everything down.
+The SUMO environment is only measured if a sumo binary is found.
+Results are written as json, e.g. python benchmarkEnvs.py --output benchmarks/$(git rev-parse --short HEAD).json
+'''
+
+ENV_ID_PREFIX = "TrafficIntersectionEnv"
+SUMO_ENV_ID = "TrafficIntersectionEnvSumo-v1"
+
+NUMBER_OF_STEPS = 20000
+NUMBER_OF_SUMO_STEPS = 200
+NUMBER_OF_RESETS = 100
+NUMBER_OF_ALLOCATION_STEPS = 1000
+NUMBER_OF_VECTORIZED_ENVS = 64
+
+# also measured stepped by worker processes over shared memory (SharedMemoryVecEnv)
+SHARED_MEMORY_ENV_IDS = ["TrafficIntersectionEnvDoubleLane-v1", "TrafficIntersectionEnvSingleLane-v1"]
+
+
+def registered_env_ids():
+    # gym < 0.22 keeps the specs in registry.env_specs, later versions use a dict
+    specs = getattr(gym.envs.registry, "env_specs", gym.envs.registry)
+    return sorted(env_id for env_id in specs if env_id.startswith(ENV_ID_PREFIX))
+
+
+def sumo_available():
+    from envs.custom_env_dir.sumoLibraries import sumolib
+
+    if sumolib is None:
+        return False
+    return shutil.which(sumolib.checkBinary("sumo")) is not None
+
+
+def make_vectorized_env(env_id, num_envs, configuration="vectorized"):
+    '''
+    The batched implementation if there is one, otherwise the environments in a DummyVecEnv.
+    The "shared-memory" configuration runs the environments in a SharedMemoryVecEnv.
+    '''
+    if configuration == "shared-memory":
+        from custom_gym.envs.custom_env_dir import SharedMemoryVecEnv
+        return SharedMemoryVecEnv(num_envs, env_class=type(gym.make(env_id).unwrapped), seed=0)
+
+    if env_id == "TrafficIntersectionEnvDoubleLane-v1":
+        from custom_gym.envs.custom_env_dir import VecTrafficIntersectionEnvDoubleLane
+        return VecTrafficIntersectionEnvDoubleLane(num_envs, seed=0)
+
+    if env_id == SUMO_ENV_ID:
+        from custom_gym.envs.custom_env_dir import SumoWorkerPool
+        return SumoWorkerPool(num_envs)
+
+    from stable_baselines3.common.vec_env import DummyVecEnv
+    return DummyVecEnv([lambda: gym.make(env_id) for _ in range(num_envs)])
+
+
+def random_actions(action_space, number_of_steps, num_envs=None, seed=0):
+    '''
+    Drawn before the measure, so that sampling isn't measured
+    '''
+    shape = (number_of_steps, ) if num_envs is None else (number_of_steps, num_envs)
+
+    # one action per junction for the corridor env
+    if isinstance(action_space, gym.spaces.MultiDiscrete):
+        return numpy.random.default_rng(seed).integers(action_space.nvec, size=shape + action_space.nvec.shape)
+
+    return numpy.random.default_rng(seed).integers(action_space.n, size=shape)
+
+
+def run_steps(env, actions, vectorized):
+    if vectorized:
+        for action in actions:
+            env.step(action)
+        return
+
+    for action in actions:
+        _observation, _reward, done, _info = env.step(action)
+        if done:
+            env.reset()
+
+
+def benchmark_env(env, number_of_steps, number_of_resets, number_of_allocation_steps, vectorized):
+    num_envs = env.num_envs if vectorized else 1
+
+    start = time.perf_counter()
+    for _ in range(number_of_resets):
+        env.reset()
+    reset_seconds = (time.perf_counter() - start) / number_of_resets
+
+    actions = random_actions(env.action_space, number_of_steps, num_envs if vectorized else None)
+    start = time.perf_counter()
+    run_steps(env, actions, vectorized)
+    step_seconds = time.perf_counter() - start
+
+    # allocations, after the timed steps so that one time allocations (caches, buffers) are already done
+    actions = random_actions(env.action_space, number_of_allocation_steps, num_envs if vectorized else None, seed=1)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    # preallocated, so that the measure itself doesn't allocate during the steps
+    peaks = numpy.zeros(number_of_allocation_steps)
+    for index, action in enumerate(actions):
+        current, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run_steps(env, [action], vectorized)
+        peaks[index] = tracemalloc.get_traced_memory()[1] - current
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    differences = after.compare_to(before, "filename")
+
+    return {
+        "num_envs": num_envs,
+        "steps": number_of_steps,
+        "steps_per_second": number_of_steps / step_seconds,
+        "env_steps_per_second": number_of_steps * num_envs / step_seconds,
+        "seconds_per_step": step_seconds / number_of_steps,
+        "reset_seconds": reset_seconds,
+        "net_allocated_blocks_per_step": sum(difference.count_diff for difference in differences) / number_of_allocation_steps,
+        "net_allocated_bytes_per_step": sum(difference.size_diff for difference in differences) / number_of_allocation_steps,
+        "peak_allocated_bytes_per_step": float(peaks.mean()),
+    }
+
+
+def run_benchmarks(env_ids=None, number_of_steps=NUMBER_OF_STEPS, number_of_sumo_steps=NUMBER_OF_SUMO_STEPS, number_of_resets=NUMBER_OF_RESETS, number_of_allocation_steps=NUMBER_OF_ALLOCATION_STEPS, num_envs=NUMBER_OF_VECTORIZED_ENVS, vectorized=True, num_sumo_workers=None):
+    '''
+    num_sumo_workers: sumo processes of the vectorized SUMO environment, at most one per core if not given
+    '''
+    env_ids = registered_env_ids() if env_ids is None else env_ids
+    with_sumo = sumo_available()
+    num_sumo_workers = num_sumo_workers or min(num_envs, os.cpu_count())
+
+    results = []
+    for env_id in env_ids:
+        # every env of the vectorized SUMO environment is a sumo process
+        configurations = [("single", None)] + ([("vectorized", num_sumo_workers if env_id == SUMO_ENV_ID else num_envs)] if vectorized else [])
+        if vectorized and env_id in SHARED_MEMORY_ENV_IDS:
+            configurations.append(("shared-memory", num_envs))
+
+        for configuration, configuration_num_envs in configurations:
+            if env_id == SUMO_ENV_ID and not with_sumo:
+                results.append({"env_id": env_id, "configuration": configuration, "skipped": "sumo binary not found"})
+                print("{:45} {:13} skipped, sumo binary not found".format(env_id, configuration))
+                continue
+
+            # sumo steps are simulated seconds, a lot slower than the analytic models
+            if env_id == SUMO_ENV_ID:
+                steps, resets, allocation_steps = number_of_sumo_steps, min(number_of_resets, 5), min(number_of_allocation_steps, number_of_sumo_steps)
+            else:
+                steps, resets, allocation_steps = number_of_steps, number_of_resets, number_of_allocation_steps
+
+            env = gym.make(env_id) if configuration_num_envs is None else make_vectorized_env(env_id, configuration_num_envs, configuration)
+            try:
+                result = benchmark_env(env, steps, resets, allocation_steps, vectorized=configuration_num_envs is not None)
+            finally:
+                env.close()
+
+            result.update(env_id=env_id, configuration=configuration)
+            results.append(result)
+            print("{:45} {:13} {:>12.0f} env steps/s {:>10.1f} us/reset {:>8.1f} blocks/step".format(env_id, configuration, result["env_steps_per_second"], result["reset_seconds"] * 1e6, result["net_allocated_blocks_per_step"]))
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--output", default="env-benchmark.json", help="json file the results are written to")
+    optParser.add_option("--env-id", action="append", dest="env_ids", default=None, help="environment to measure, all the registered ones if not given, can be repeated")
+    optParser.add_option("--steps", type="int", default=NUMBER_OF_STEPS, help="steps measured for each environment")
+    optParser.add_option("--sumo-steps", type="int", default=NUMBER_OF_SUMO_STEPS, help="steps measured for the SUMO environment")
+    optParser.add_option("--num-envs", type="int", default=NUMBER_OF_VECTORIZED_ENVS, help="environments of the vectorized configuration")
+    optParser.add_option("--sumo-workers", type="int", default=None, help="sumo processes of the vectorized SUMO environment, one per core (at most --num-envs) if not given")
+    optParser.add_option("--no-vectorized", action="store_false", dest="vectorized", default=True, help="only measure the environments alone")
+    options, args = optParser.parse_args()
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    results = run_benchmarks(options.env_ids, number_of_steps=options.steps, number_of_sumo_steps=options.sumo_steps, num_envs=options.num_envs, vectorized=options.vectorized, num_sumo_workers=options.sumo_workers)
+
+    report = {
+        "date": datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "gym": gym.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+    output = Path(options.output)
+    if output.parent != Path("."):
+        output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=4)
@@ -0,0 +1,173 @@
+import copy
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+
+from stable_baselines3.common.save_util import save_to_zip_file
+
+'''
+Checkpoints of a model written in the background.
+
+save() only takes a copy of the parameters, of the optimizer state and of the other saved attributes
+of the model (the same ones as model.save), which is done in memory, then the training goes on while
+a background thread serializes the copy to disk. Every checkpoint is written under a temporary name
+and moved in place, so a crash never leaves a half written checkpoint, and the list of checkpoints
+(checkpoints.json) is replaced the same way.
+Only the last keep_last checkpoints and the keep_best ones with the highest evaluation reward are kept,
+latest() gives the checkpoint to resume from, PPO.load restores the optimizer state and the timestep counter.
+'''
+
+MANIFEST_NAME = "checkpoints.json"
+MAX_PENDING_CHECKPOINTS = 2     # save() blocks when the disk is this many checkpoints behind
+
+
+def snapshotModel(model):
+    '''
+    Copy of what model.save writes, taken so that the training can go on while it is serialized
+    '''
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for torch_variable in state_dicts_names + torch_variable_names:
+        exclude.add(torch_variable.split(".")[0])
+
+    for name in exclude:
+        data.pop(name, None)
+
+    pytorch_variables = {}
+    for name in torch_variable_names:
+        attribute = model
+        for part in name.split("."):
+            attribute = getattr(attribute, part)
+        pytorch_variables[name] = attribute
+
+    # the copies are detached from the tensors and arrays the training keeps updating
+    return copy.deepcopy(data), copy.deepcopy(model.get_parameters()), copy.deepcopy(pytorch_variables)
+
+
+def writeAtomically(path, write):
+    path = Path(path)
+    temporary_path = path.with_name("{}.tmp-{}".format(path.name, os.getpid()))
+
+    with open(temporary_path, "wb") as temporary_file:
+        write(temporary_file)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+class CheckpointManager:
+
+    def __init__(self, directory, keep_last=3, keep_best=3):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+
+        # checkpoints already written, from previous runs too
+        self.checkpoints = self.readManifest()
+
+        self.pending = queue.Queue(maxsize=MAX_PENDING_CHECKPOINTS)
+        self.error = None
+        self.writer = threading.Thread(target=self.writeCheckpoints, daemon=True)
+        self.writer.start()
+
+    def readManifest(self):
+        manifest = self.directory / MANIFEST_NAME
+        if not manifest.exists():
+            return []
+
+        with open(manifest) as manifest_file:
+            checkpoints = json.load(manifest_file)
+
+        # checkpoints removed by hand are forgotten
+        return [checkpoint for checkpoint in checkpoints if (self.directory / checkpoint["file"]).exists()]
+
+    def writeManifest(self):
+        writeAtomically(self.directory / MANIFEST_NAME, lambda manifest_file: manifest_file.write(json.dumps(self.checkpoints, indent=4).encode()))
+
+    def save(self, model, reward=None):
+        '''
+        Takes the checkpoint of the model at its current timestep, reward is the evaluation reward used to keep the best checkpoints
+        '''
+        self.raiseWriterError()
+
+        data, params, pytorch_variables = snapshotModel(model)
+        checkpoint = {"file": "checkpoint-{}.zip".format(model.num_timesteps), "timesteps": model.num_timesteps, "reward": reward}
+
+        self.pending.put((checkpoint, data, params, pytorch_variables))
+
+    def writeCheckpoints(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+
+                checkpoint, data, params, pytorch_variables = item
+                writeAtomically(self.directory / checkpoint["file"], lambda checkpoint_file: save_to_zip_file(checkpoint_file, data=data, params=params, pytorch_variables=pytorch_variables))
+
+                self.checkpoints = [existing for existing in self.checkpoints if existing["file"] != checkpoint["file"]] + [checkpoint]
+                self.prune()
+                self.writeManifest()
+            except Exception as error:
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def prune(self):
+        '''
+        Removes the checkpoints which are neither among the last ones nor among the best ones.
+        The manifest is written after the files are removed, so it never lists a missing checkpoint for long.
+        '''
+        by_timesteps = sorted(self.checkpoints, key=lambda checkpoint: checkpoint["timesteps"])
+        evaluated = [checkpoint for checkpoint in self.checkpoints if checkpoint["reward"] is not None]
+        by_reward = sorted(evaluated, key=lambda checkpoint: checkpoint["reward"], reverse=True)
+
+        kept = {checkpoint["file"] for checkpoint in by_timesteps[-self.keep_last:] if self.keep_last > 0}
+        kept |= {checkpoint["file"] for checkpoint in by_reward[:self.keep_best]}
+
+        for checkpoint in self.checkpoints:
+            if checkpoint["file"] not in kept:
+                (self.directory / checkpoint["file"]).unlink(missing_ok=True)
+
+        self.checkpoints = [checkpoint for checkpoint in by_timesteps if checkpoint["file"] in kept]
+
+    def latest(self):
+        '''
+        Path of the checkpoint with the most timesteps, None if there is none
+        '''
+        self.wait()
+        if not self.checkpoints:
+            return None
+
+        return self.directory / max(self.checkpoints, key=lambda checkpoint: checkpoint["timesteps"])["file"]
+
+    def best(self):
+        self.wait()
+        evaluated = [checkpoint for checkpoint in self.checkpoints if checkpoint["reward"] is not None]
+        if not evaluated:
+            return None
+
+        return self.directory / max(evaluated, key=lambda checkpoint: checkpoint["reward"])["file"]
+
+    def wait(self):
+        '''
+        Blocks until all the checkpoints taken are on disk
+        '''
+        self.pending.join()
+        self.raiseWriterError()
+
+    def raiseWriterError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.wait()
+        self.pending.put(None)
+        self.writer.join()
@@ -7,4 +7,12 @@ register(id='TrafficIntersectionEnvDoubleLane-v1',
 
 register(id='TrafficIntersectionEnvSingleLane-v1',
     entry_point='envs.custom_env_dir:TrafficIntersectionEnvSingleLane'
+)
+
+register(id='TrafficIntersectionEnvSumo-v1',
+    entry_point='envs.custom_env_dir:TrafficIntersectionEnvSumo'
+)
+
+register(id='TrafficIntersectionEnvCorridor-v1',
+    entry_point='envs.custom_env_dir:TrafficIntersectionEnvCorridor'
 )
\ No newline at end of file
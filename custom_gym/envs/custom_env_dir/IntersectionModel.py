@@ -0,0 +1,106 @@
+import json
+import numpy
+
+'''
+Discharge tables of the analytic intersection models.
+
+For a traffic light configuration, how many vehicles can leave each lane in one green time only depends on
+the lane speeds, the lengths of the intersection and the green time, so it is computed once when the model
+is built instead of on every step. Vehicles of a lane are split into movements (turning, going straight, ...),
+each movement gets a share of the vehicles of the lane and can't discharge more than its capacity.
+'''
+
+
+class IntersectionModel:
+
+    def __init__(self, release_fractions, capacities, vehicles_added_in_each_lane, lanes_capacity, min_green_time, whole_vehicles=False):
+        '''
+        release_fractions: (configurations, lanes, movements) share of the vehicles of a lane released in each movement
+        capacities: (configurations, lanes, movements) maximum number of vehicles of each movement passing in one green time
+        vehicles_added_in_each_lane: (lanes, ) vehicles arriving in each lane in one green time
+        lanes_capacity: (lanes, ) capacity of the lanes
+        whole_vehicles: if set, the vehicles passing from a lane are rounded down to whole vehicles
+        '''
+        self.release_fractions = self._readOnly(release_fractions)
+        self.capacities = self._readOnly(capacities)
+
+        if self.release_fractions.shape != self.capacities.shape or self.release_fractions.ndim != 3:
+            raise ValueError("release fractions and capacities must both have shape (configurations, lanes, movements)")
+
+        self.release_masks = self._readOnly(numpy.any(self.release_fractions > 0, axis=-1))
+        # tables of each configuration, taken once so that discharge with buffers doesn't even create views
+        self.release_fractions_of_configurations = tuple(self.release_fractions)
+        self.capacities_of_configurations = tuple(self.capacities)
+        self.vehicles_added_in_each_lane = self._readOnly(vehicles_added_in_each_lane)
+        self.lanes_capacity = self._readOnly(lanes_capacity)
+        self.min_green_time = min_green_time
+        self.whole_vehicles = whole_vehicles
+
+    @property
+    def number_of_configurations(self):
+        return self.release_fractions.shape[0]
+
+    @property
+    def number_of_lanes(self):
+        return self.release_fractions.shape[1]
+
+    @property
+    def number_of_movements(self):
+        return self.release_fractions.shape[2]
+
+    def discharge(self, lanes, configuration, out=None, work=None):
+        '''
+        Number of vehicles leaving each lane during one green time of the given configuration.
+        Works for the lanes of one intersection with a single configuration as well as for
+        (N, lanes) intersections with (N, ) configurations.
+        out (lanes, ) and work (lanes, movements) can be given to compute everything in these buffers without
+        allocating any array, for N intersections out is (N, lanes) and work (2, N, lanes, movements).
+        '''
+        if work is not None and isinstance(configuration, numpy.ndarray):
+            # the tables of the configurations are gathered in the buffers, fancy indexing would allocate them
+            release_fractions, capacities = work
+            numpy.take(self.release_fractions, configuration, axis=0, out=release_fractions, mode="clip")
+            numpy.take(self.capacities, configuration, axis=0, out=capacities, mode="clip")
+            numpy.multiply(release_fractions, lanes[..., None], out=release_fractions)
+            numpy.minimum(release_fractions, capacities, out=release_fractions)
+            vehicles_removed_in_each_lane = release_fractions.sum(axis=-1, out=out)
+        elif work is not None:
+            numpy.multiply(self.release_fractions_of_configurations[configuration], lanes[..., None], out=work)
+            numpy.minimum(work, self.capacities_of_configurations[configuration], out=work)
+            vehicles_removed_in_each_lane = work.sum(axis=-1, out=out)
+        else:
+            vehicles_removed_in_each_lane = numpy.minimum(self.release_fractions[configuration] * lanes[..., None], self.capacities[configuration]).sum(axis=-1, out=out)
+
+        if self.whole_vehicles:
+            numpy.floor(vehicles_removed_in_each_lane, out=vehicles_removed_in_each_lane)
+
+        return vehicles_removed_in_each_lane
+
+    @staticmethod
+    def _readOnly(values):
+        array = numpy.array(values, dtype=numpy.float64)
+        array.setflags(write=False)
+        return array
+
+
+def loadIntersectionParameters(config=None, defaults=None):
+    '''
+    Returns the intersection parameters with the values of config replacing the defaults.
+    config can be None, a dictionary or the path of a json file.
+    '''
+    parameters = dict(defaults or {})
+
+    if config is None:
+        return parameters
+
+    if not isinstance(config, dict):
+        with open(config) as config_file:
+            config = json.load(config_file)
+
+    unknown_parameters = set(config) - set(parameters)
+    if defaults is not None and unknown_parameters:
+        raise KeyError("Unknown intersection parameters: {}".format(", ".join(sorted(unknown_parameters))))
+
+    parameters.update(config)
+
+    return parameters
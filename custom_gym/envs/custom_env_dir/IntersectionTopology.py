@@ -0,0 +1,173 @@
+import json
+import os
+from pathlib import Path
+
+from envs.custom_env_dir.sumoLibraries import requireSumo, sumolib
+
+'''
+Topology of a signalized junction read from a SUMO network.
+
+The incoming lanes of the junction, the phases of its traffic light program and which yellow phase
+follows each green phase are extracted once with sumolib and saved as a small json index next to the
+network file, later loads only read the index as long as the network file isn't modified.
+The observation and action spaces of the SUMO env and of traffic.py are built from it, so any
+map works without lane ids or phase numbers in the code.
+'''
+
+TOPOLOGY_VERSION = 3
+
+# observed lanes of the maps in sumo-files, in the order the models were trained with (the one of traffic.py),
+# which isn't the order of the links. The observations and the actions of these models keep their meaning,
+# action i of the single lane map releases lane i. E8 of traffic.py is -E8 on the double lane map, E8 leaves J11.
+TRAINED_LANE_ORDER = {
+    ("small-map-single-lane", "J9"): ["-E8_0", "-E9_0", "-E10_0", "E7_0"],
+    ("small-map-double-lane", "J11"): ["E9_0", "E9_1", "-E8_0", "-E8_1", "-E10_0", "-E10_1", "-E11_0", "-E11_1"],
+}
+
+
+class IntersectionTopology:
+
+    def __init__(self, junction_id, program_id, incoming_lanes, phase_states, phase_durations, green_phases, yellow_after_green):
+        self.junction_id = junction_id
+        self.program_id = program_id
+        # incoming lanes in the order of the links they control, or in TRAINED_LANE_ORDER for the maps of sumo-files
+        self.incoming_lanes = list(incoming_lanes)
+        self.phase_states = list(phase_states)
+        self.phase_durations = list(phase_durations)
+        # green phase of each traffic light configuration, the actions
+        self.green_phases = list(green_phases)
+        # yellow phase following each green phase, if any
+        self.yellow_after_green = {int(green): yellow for green, yellow in dict(yellow_after_green).items()}
+
+    @property
+    def number_of_configurations(self):
+        return len(self.green_phases)
+
+    def greenPhase(self, configuration):
+        return self.green_phases[int(configuration)]
+
+    def yellowPhase(self, configuration):
+        return self.yellow_after_green.get(self.greenPhase(configuration))
+
+    def yellowTime(self, configuration):
+        yellow_phase = self.yellowPhase(configuration)
+        return 0 if yellow_phase is None else self.phase_durations[yellow_phase]
+
+    def configurationOfPhase(self, phase):
+        '''
+        Configuration active during the phase, a yellow phase belongs to the green phase before it.
+        Returns None for phases which don't belong to any configuration.
+        '''
+        if phase in self.green_phases:
+            return self.green_phases.index(phase)
+
+        for green, yellow in self.yellow_after_green.items():
+            if yellow == phase:
+                return self.green_phases.index(green)
+
+        return None
+
+    def toDict(self):
+        return {
+            "version": TOPOLOGY_VERSION,
+            "junction_id": self.junction_id,
+            "program_id": self.program_id,
+            "incoming_lanes": self.incoming_lanes,
+            "phase_states": self.phase_states,
+            "phase_durations": self.phase_durations,
+            "green_phases": self.green_phases,
+            "yellow_after_green": self.yellow_after_green,
+        }
+
+    @classmethod
+    def fromDict(cls, topology):
+        return cls(topology["junction_id"], topology["program_id"], topology["incoming_lanes"], topology["phase_states"], topology["phase_durations"], topology["green_phases"], topology["yellow_after_green"])
+
+    @classmethod
+    def fromNet(cls, net_file, junction_id):
+        '''
+        Parses the network, slow for big networks
+        '''
+        requireSumo()
+
+        net = sumolib.net.readNet(str(net_file), withPrograms=True)
+        traffic_light = net.getTLS(junction_id)
+
+        incoming_lanes = []
+        for incoming_lane, _outgoing_lane, _link_index in sorted(traffic_light.getConnections(), key=lambda connection: connection[2]):
+            if incoming_lane.getID() not in incoming_lanes:
+                incoming_lanes.append(incoming_lane.getID())
+
+        trained_lane_order = TRAINED_LANE_ORDER.get((netName(net_file), junction_id))
+        if trained_lane_order is not None:
+            if sorted(trained_lane_order) != sorted(incoming_lanes):
+                raise ValueError("The incoming lanes {} of {} in {} aren't the lanes the models were trained with {}".format(incoming_lanes, junction_id, net_file, trained_lane_order))
+            incoming_lanes = list(trained_lane_order)
+
+        # the first program of the traffic light is the one running when the simulation starts
+        program_id, program = list(traffic_light.getPrograms().items())[0]
+        phases = program.getPhases()
+        phase_states = [phase.state for phase in phases]
+        phase_durations = [phase.duration for phase in phases]
+
+        green_phases = []
+        yellow_after_green = {}
+        for index, state in enumerate(phase_states):
+            if "y" not in state.lower() and ("G" in state or "g" in state):
+                green_phases.append(index)
+
+                next_phase = (index + 1) % len(phase_states)
+                if "y" in phase_states[next_phase].lower():
+                    yellow_after_green[index] = next_phase
+
+        return cls(junction_id, program_id, incoming_lanes, phase_states, phase_durations, green_phases, yellow_after_green)
+
+    @classmethod
+    def load(cls, net_file, junction_id):
+        '''
+        Loads the topology from the index next to the network file, the network is only parsed
+        if the index doesn't exist yet or is older than the network file
+        '''
+        net_file = Path(net_file)
+        index_file = topologyIndexFile(net_file, junction_id)
+
+        if index_file.exists() and index_file.stat().st_mtime >= net_file.stat().st_mtime:
+            with open(index_file) as index:
+                topology = json.load(index)
+            if topology.get("version") == TOPOLOGY_VERSION:
+                return cls.fromDict(topology)
+
+        topology = cls.fromNet(net_file, junction_id)
+
+        # written under another name and moved in place, so parallel workers never read a half written index
+        temporary_file = index_file.with_name("{}.{}".format(index_file.name, os.getpid()))
+        with open(temporary_file, "w") as index:
+            json.dump(topology.toDict(), index)
+        os.replace(temporary_file, index_file)
+
+        return topology
+
+
+def trafficLightJunction(net_file):
+    '''
+    The junction of the only traffic light of the network, the network is parsed
+    '''
+    requireSumo()
+
+    net = sumolib.net.readNet(str(net_file), withPrograms=True)
+    traffic_lights = sorted(traffic_light.getID() for traffic_light in net.getTrafficLights())
+    if len(traffic_lights) != 1:
+        raise ValueError("{} has the traffic lights {}, the junction to control must be given".format(net_file, traffic_lights))
+
+    return traffic_lights[0]
+
+
+def netName(net_file):
+    net_file = Path(net_file)
+    return net_file.name[:-len(".net.xml")] if net_file.name.endswith(".net.xml") else net_file.stem
+
+
+def topologyIndexFile(net_file, junction_id):
+    net_file = Path(net_file)
+
+    return net_file.with_name("{}.{}.topology.json".format(netName(net_file), junction_id))
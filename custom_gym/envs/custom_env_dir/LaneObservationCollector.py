@@ -0,0 +1,98 @@
+import numpy
+
+from envs.custom_env_dir.sumoLibraries import requireSumo, tc
+
+'''
+Collects the observation of a junction from TraCI subscriptions.
+
+Polling every lane with getLastStepVehicleNumber costs one socket round trip per lane and per value.
+Here the lanes, the traffic light and the simulation are subscribed once, SUMO then sends all the
+subscribed values together with the answer of every simulationStep, and reading them is only a lookup
+in the results already received. Halting count, mean speed and waiting time of the lanes therefore
+come without any extra round trip.
+'''
+
+# features of a lane which can be collected and the corresponding traci variables
+LANE_FEATURES = {
+    "vehicle_count": "LAST_STEP_VEHICLE_NUMBER",
+    "halting_count": "LAST_STEP_VEHICLE_HALTING_NUMBER",
+    "mean_speed": "LAST_STEP_MEAN_SPEED",
+    "waiting_time": "VAR_WAITING_TIME",
+}
+
+class LaneObservationCollector:
+
+    def __init__(self, connection, lanes, junction_with_lights, features=("vehicle_count", )):
+        '''
+        connection: a traci connection, or the traci module itself for the default connection
+        lanes: ids of the lanes to observe
+        features: names of the lane features to collect, see LANE_FEATURES
+        '''
+        requireSumo()
+
+        self.connection = connection
+        self.lanes = list(lanes)
+        self.junction_with_lights = junction_with_lights
+        self.features = list(features)
+        self.lane_variables = [getattr(tc, LANE_FEATURES[feature]) for feature in self.features]
+        self.simulation_variables = [tc.VAR_TIME, tc.VAR_ARRIVED_VEHICLES_NUMBER, tc.VAR_MIN_EXPECTED_VEHICLES]
+
+        # one row for each feature, one column for each lane
+        self.buffer = numpy.zeros((len(self.features), len(self.lanes)))
+
+        self.phase = 0
+        self.simulation_time = 0
+        self.arrived_vehicles = 0
+        self.min_expected_vehicles = 0
+
+        self.subscribe()
+
+    def subscribe(self):
+        '''
+        Registers the subscriptions, needs to be called again after SUMO reloads the simulation
+        '''
+        for lane in self.lanes:
+            self.connection.lane.subscribe(lane, self.lane_variables)
+        self.connection.trafficlight.subscribe(self.junction_with_lights, [tc.TL_CURRENT_PHASE])
+        self.connection.simulation.subscribe(self.simulation_variables)
+
+        self.collect()
+
+    def collect(self):
+        '''
+        Copies the values received with the last simulation step into the buffer and returns it
+        '''
+        lane_results = self.connection.lane.getAllSubscriptionResults()
+        for column, lane in enumerate(self.lanes):
+            values = lane_results[lane]
+            for row, variable in enumerate(self.lane_variables):
+                self.buffer[row, column] = values[variable]
+
+        self.phase = self.connection.trafficlight.getSubscriptionResults(self.junction_with_lights)[tc.TL_CURRENT_PHASE]
+
+        self.collectSimulation()
+
+        return self.buffer
+
+    def collectSimulation(self):
+        '''
+        Only reads the simulation values, cheap enough to be done after every simulation step
+        '''
+        simulation_results = self.connection.simulation.getSubscriptionResults()
+        self.simulation_time = simulation_results[tc.VAR_TIME]
+        self.arrived_vehicles = simulation_results[tc.VAR_ARRIVED_VEHICLES_NUMBER]
+        self.min_expected_vehicles = simulation_results[tc.VAR_MIN_EXPECTED_VEHICLES]
+
+    def totalArrivedVehicles(self):
+        '''
+        Vehicles which arrived since the beginning of the simulation. The arrived vehicles subscription only
+        counts the last simulation step, this is used when several seconds are simulated in one step.
+        '''
+        inserted = float(self.connection.simulation.getParameter("", "stats.vehicles.inserted"))
+        running = float(self.connection.simulation.getParameter("", "stats.vehicles.running"))
+
+        return inserted - running
+
+    def feature(self, name):
+        # view of the row of the buffer, changes with the next collect
+        return self.buffer[self.features.index(name)]
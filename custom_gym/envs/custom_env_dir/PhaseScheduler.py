@@ -0,0 +1,117 @@
+import numpy
+
+'''
+Phase transitions of signalized junctions.
+
+Changing the configuration of a junction means running the yellow phase of the current green,
+optionally an all-red interval, and only then the green of the new configuration. Setting the new
+green right after the yellow overwrites the yellow, so each junction is a small state machine
+(GREEN -> YELLOW -> ALL_RED -> GREEN) whose transitions are due at given simulation times.
+Nothing blocks: requests only start the yellow, update() is called with the current simulation time
+(known from the subscriptions, no TraCI reads) and applies the transitions which are due.
+All the junctions are kept in numpy arrays, so finding the due transitions costs the same for many
+junctions and only the junctions which change phase send TraCI commands.
+'''
+
+GREEN = 0
+YELLOW = 1
+ALL_RED = 2
+
+# phases set by the scheduler are held until the scheduler changes them, SUMO must not advance them on its own
+HOLD_DURATION = 1e6
+
+
+class PhaseScheduler:
+
+    def __init__(self, connection, topologies, initial_configurations, simulation_time=0, all_red_time=0, yellow_time=None):
+        '''
+        connection: a traci connection, or the traci module itself for the default connection
+        topologies: IntersectionTopology of each junction
+        initial_configurations: configuration of each junction set right away
+        yellow_time: duration of the yellow phases, the ones of the traffic light programs are used if not given
+        all_red_time: duration of the all-red interval after the yellow phase, no all-red if 0
+        '''
+        self.connection = connection
+        self.topologies = list(topologies)
+        self.all_red_time = all_red_time
+        self.yellow_time = yellow_time
+
+        number_of_junctions = len(self.topologies)
+        self.state = numpy.full(number_of_junctions, GREEN)
+        self.current_configuration = numpy.array(initial_configurations, dtype=numpy.int64).reshape(number_of_junctions)
+        self.target_configuration = self.current_configuration.copy()
+        # simulation time at which the yellow or all-red interval of each junction ends
+        self.transition_end_time = numpy.full(number_of_junctions, numpy.inf)
+
+        for junction in range(number_of_junctions):
+            self.applyGreen(junction)
+
+    @property
+    def next_transition_time(self):
+        '''
+        Earliest time at which a junction changes phase, inf if no transition is running
+        '''
+        return self.transition_end_time.min()
+
+    def request(self, configurations, simulation_time, junctions=None):
+        '''
+        Asks the junctions (all of them by default) to move to the given configurations.
+        A junction in green starts its yellow phase, a junction already changing only gets a new target.
+        '''
+        junctions = numpy.arange(len(self.topologies)) if junctions is None else numpy.asarray(junctions, dtype=numpy.int64).reshape(-1)
+        self.target_configuration[junctions] = configurations
+
+        starting = junctions[(self.state[junctions] == GREEN) & (self.target_configuration[junctions] != self.current_configuration[junctions])]
+        for junction in starting:
+            self.startTransition(junction, simulation_time)
+
+    def update(self, simulation_time):
+        '''
+        Applies the transitions which are due at the simulation time
+        '''
+        if simulation_time < self.next_transition_time:
+            return
+
+        for junction in numpy.flatnonzero(self.transition_end_time <= simulation_time):
+            if self.state[junction] == YELLOW and self.all_red_time > 0:
+                self.applyAllRed(junction, self.transition_end_time[junction])
+            else:
+                self.applyGreen(junction)
+
+    def startTransition(self, junction, simulation_time):
+        topology = self.topologies[junction]
+        yellow_phase = topology.yellowPhase(self.current_configuration[junction])
+        yellow_time = topology.yellowTime(self.current_configuration[junction]) if self.yellow_time is None else self.yellow_time
+
+        if yellow_phase is None or yellow_time <= 0:
+            if self.all_red_time > 0:
+                self.applyAllRed(junction, simulation_time)
+            else:
+                self.applyGreen(junction)
+            return
+
+        self.connection.trafficlight.setPhase(topology.junction_id, yellow_phase)
+        self.connection.trafficlight.setPhaseDuration(topology.junction_id, HOLD_DURATION)
+        self.state[junction] = YELLOW
+        self.transition_end_time[junction] = simulation_time + yellow_time
+
+    def applyAllRed(self, junction, simulation_time):
+        topology = self.topologies[junction]
+
+        # there is no all-red phase in the programs, the red state is set directly
+        self.connection.trafficlight.setRedYellowGreenState(topology.junction_id, "r" * len(topology.phase_states[0]))
+        self.state[junction] = ALL_RED
+        self.transition_end_time[junction] = simulation_time + self.all_red_time
+
+    def applyGreen(self, junction):
+        topology = self.topologies[junction]
+
+        if self.state[junction] == ALL_RED:
+            # back from the red state to the program of the junction
+            self.connection.trafficlight.setProgram(topology.junction_id, topology.program_id)
+
+        self.connection.trafficlight.setPhase(topology.junction_id, topology.greenPhase(self.target_configuration[junction]))
+        self.connection.trafficlight.setPhaseDuration(topology.junction_id, HOLD_DURATION)
+        self.state[junction] = GREEN
+        self.current_configuration[junction] = self.target_configuration[junction]
+        self.transition_end_time[junction] = numpy.inf
@@ -0,0 +1,222 @@
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+
+import numpy
+
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import TrafficIntersectionEnvDoubleLane
+
+'''
+Analytic intersection envs stepped by worker processes through shared memory.
+
+With SubprocVecEnv every step pickles the actions and the observations and sends them through pipes,
+which costs more than stepping these envs. Here the actions, observations, rewards, dones and the
+terminal observations of all the envs live in one shared memory block. Each worker steps its slice of
+the envs and writes the results in place, the main process and the workers only meet at a barrier
+when a step starts and when it ends, and nothing is pickled. The observations, rewards and dones are
+copied out of the block once a step ends, what a step returns is never changed by the next steps and
+stays valid after close() (PPO keeps the last observations and saves them with the model).
+The envs (TrafficIntersectionEnvDoubleLane or TrafficIntersectionEnvSingleLane) reset themselves at
+the end of an episode, their terminal_observation (the lanes they ended the episode with) is given in the infos.
+'''
+
+# commands sent to the workers
+STEP = 0
+RESET = 1
+SEED = 2
+CLOSE = 3
+
+ALIGNMENT = 64
+
+
+def sharedArraysLayout(num_envs, observation_shape):
+    '''
+    (name, shape, dtype) of the arrays kept in the shared memory block
+    '''
+    return [
+        ("command", (1, ), numpy.int64),
+        ("actions", (num_envs, ), numpy.int64),
+        ("seeds", (num_envs, ), numpy.int64),
+        ("observations", (num_envs, ) + tuple(observation_shape), numpy.float64),
+        ("rewards", (num_envs, ), numpy.float64),
+        ("dones", (num_envs, ), numpy.bool_),
+        ("terminal_observations", (num_envs, ) + tuple(observation_shape), numpy.float64),
+        ("vehicles_passed", (num_envs, ), numpy.float64),
+    ]
+
+
+def sharedArraysSize(layout):
+    size = 0
+    for _name, shape, dtype in layout:
+        size += -size % ALIGNMENT
+        size += int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+    return size
+
+
+def sharedArrays(buffer, layout):
+    '''
+    Numpy views of the arrays in the shared memory buffer
+    '''
+    arrays = {}
+    offset = 0
+    for name, shape, dtype in layout:
+        offset += -offset % ALIGNMENT
+        arrays[name] = numpy.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+
+def runWorker(memory_name, layout, barrier, env_class, env_kwargs, start, stop, seed):
+    # the workers share the resource tracker of the main process, the block is only unlinked by close()
+    block = shared_memory.SharedMemory(name=memory_name)
+    arrays = sharedArrays(block.buf, layout)
+    command, actions, seeds = arrays["command"], arrays["actions"], arrays["seeds"]
+    observations, rewards, dones = arrays["observations"], arrays["rewards"], arrays["dones"]
+    terminal_observations, vehicles_passed = arrays["terminal_observations"], arrays["vehicles_passed"]
+
+    try:
+        envs = [env_class(seed=None if seed is None else seed + index, **env_kwargs) for index in range(start, stop)]
+
+        while True:
+            barrier.wait()
+            operation = int(command[0])
+
+            if operation == CLOSE:
+                break
+
+            if operation == STEP:
+                for index, env in enumerate(envs, start):
+                    observation, reward, done, info = env.step(actions[index])
+                    rewards[index] = reward
+                    dones[index] = done
+                    vehicles_passed[index] = info.get("vehicles_passed", 0)
+                    if done:
+                        terminal_observations[index] = env.terminal_observation
+                    observations[index] = observation
+            elif operation == RESET:
+                for index, env in enumerate(envs, start):
+                    observations[index] = env.reset()
+            elif operation == SEED:
+                for index, env in enumerate(envs, start):
+                    env.seed(int(seeds[index]))
+
+            barrier.wait()
+    except Exception:
+        # the main process gets a BrokenBarrierError instead of waiting forever
+        barrier.abort()
+        raise
+    finally:
+        del observations, rewards, dones, terminal_observations, vehicles_passed, command, actions, seeds, arrays
+        block.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+
+    def __init__(self, num_envs, env_class=TrafficIntersectionEnvDoubleLane, number_of_workers=None, seed=None, start_method=None, **env_kwargs):
+        '''
+        env_class: TrafficIntersectionEnvDoubleLane or TrafficIntersectionEnvSingleLane, created with env_kwargs in the workers
+        number_of_workers: processes stepping the envs, one per core if not given
+        seed: env i is seeded with seed + i
+        '''
+        # the spaces are taken from an env of this process, these envs are cheap to create
+        probe = env_class(**env_kwargs)
+        super().__init__(num_envs, probe.observation_space, probe.action_space)
+
+        number_of_workers = min(number_of_workers or os.cpu_count(), num_envs)
+
+        self.layout = sharedArraysLayout(num_envs, self.observation_space.shape)
+        self.memory = shared_memory.SharedMemory(create=True, size=sharedArraysSize(self.layout))
+        self.arrays = sharedArrays(self.memory.buf, self.layout)
+
+        context = multiprocessing.get_context(start_method)
+        self.barrier = context.Barrier(number_of_workers + 1)
+
+        self.workers = []
+        bounds = numpy.linspace(0, num_envs, number_of_workers + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            worker = context.Process(target=runWorker, args=(self.memory.name, self.layout, self.barrier, env_class, env_kwargs, int(start), int(stop), seed), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        self.waiting = False
+        self.closed = False
+
+    def command(self, operation):
+        '''
+        Starts the command in the workers, wait() waits for its end
+        '''
+        self.arrays["command"][0] = operation
+        self.wait()
+
+    def wait(self):
+        try:
+            self.barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("A worker of the SharedMemoryVecEnv failed, see its traceback above")
+
+    def reset(self):
+        self.command(RESET)
+        self.wait()
+
+        return self.arrays["observations"].copy()
+
+    def step_async(self, actions):
+        self.arrays["actions"][:] = numpy.asarray(actions).reshape(self.num_envs)
+        self.command(STEP)
+        self.waiting = True
+
+    def step_wait(self):
+        self.wait()
+        self.waiting = False
+
+        dones = self.arrays["dones"].copy()
+        infos = [{"vehicles_passed": vehicles_passed} for vehicles_passed in self.arrays["vehicles_passed"].tolist()]
+        for i in numpy.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self.arrays["terminal_observations"][i].copy()
+
+        return self.arrays["observations"].copy(), self.arrays["rewards"].copy(), dones, infos
+
+    def seed(self, seed=None):
+        if seed is None:
+            return [None for _ in range(self.num_envs)]
+
+        seeds = seed + numpy.arange(self.num_envs)
+        self.arrays["seeds"][:] = seeds
+        self.command(SEED)
+        self.wait()
+
+        return seeds.tolist()
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self.waiting:
+                self.wait()
+            self.command(CLOSE)
+        except RuntimeError:
+            # the workers already stopped after one of them failed
+            pass
+        for worker in self.workers:
+            worker.join()
+
+        self.arrays = None
+        self.memory.close()
+        self.memory.unlink()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        raise NotImplementedError("The envs live in the worker processes, {} can't be read".format(attr_name))
+
+    def set_attr(self, attr_name, value, indices=None):
+        raise NotImplementedError("The envs live in the worker processes, {} can't be set".format(attr_name))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise NotImplementedError("The envs live in the worker processes, {} can't be called".format(method_name))
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,51 @@
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+from envs.custom_env_dir.TrafficIntersectionEnvSumo import TrafficIntersectionEnvSumo
+
+'''
+Pool of SUMO workers used as a single vectorized environment.
+
+Every worker is a TrafficIntersectionEnvSumo living in its own process (SubprocVecEnv), with its own
+headless SUMO, traci connection label, port and route files, so the workers never share a simulation
+and all the cores can be used for rollouts. Unless route files are given, the workers of the double lane map
+drive their own generated route file (seed route_seed + i, taken from the route file cache) so that their
+rollouts aren't the same traffic. A worker whose SUMO process dies ends its episode and
+starts a new SUMO on its own, the number of restarts can be read with get_attr("number_of_restarts").
+'''
+
+def makeSumoWorker(index, intersection_type, route_files, port, env_kwargs, wrapper_class=None):
+
+    def makeEnv():
+        env = TrafficIntersectionEnvSumo(intersection_type=intersection_type, route_files=route_files, gui=False, label="sumo-worker-{}".format(index), port=port, **env_kwargs)
+        return env if wrapper_class is None else wrapper_class(env)
+
+    return makeEnv
+
+
+class SumoWorkerPool(SubprocVecEnv):
+
+    def __init__(self, number_of_workers, intersection_type="double", route_files_of_workers=None, route_seed=0, base_port=None, start_method=None, wrapper_class=None, **env_kwargs):
+        '''
+        route_files_of_workers: one route file (or list of route files) for each worker. If not given, worker i gets the
+            route file generated with the seed route_seed + i on the double lane map, the default route file otherwise
+        base_port: worker i uses port base_port + i, free ports are picked if not given
+        wrapper_class: applied to the env of each worker, in the worker process
+        '''
+        if route_files_of_workers is None and intersection_type == "double" and route_seed is not None:
+            # generated once here (or taken from the cache), the workers only get the paths
+            from routeFileCache import cached_routefile
+            route_files_of_workers = [cached_routefile(seed=route_seed + index) for index in range(number_of_workers)]
+        elif route_files_of_workers is None:
+            route_files_of_workers = [None] * number_of_workers
+        elif len(route_files_of_workers) != number_of_workers:
+            raise ValueError("{} route files given for {} workers".format(len(route_files_of_workers), number_of_workers))
+
+        env_fns = []
+        for index in range(number_of_workers):
+            port = None if base_port is None else base_port + index
+            env_fns.append(makeSumoWorker(index, intersection_type, route_files_of_workers[index], port, env_kwargs, wrapper_class))
+
+        super().__init__(env_fns, start_method=start_method)
+
+    def numberOfRestarts(self):
+        return sum(self.get_attr("number_of_restarts"))
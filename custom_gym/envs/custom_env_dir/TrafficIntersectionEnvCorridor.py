@@ -0,0 +1,209 @@
+import gym
+import gym.spaces
+import numpy
+
+from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import NUMBER_OF_LANES_TO_OBSERVE, POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, buildIntersectionModel
+
+'''
+Grid (or corridor, a grid of one row) of double lane intersections stepped together.
+
+Every junction is the analytic model of TrafficIntersectionEnvDoubleLane: 8 incoming lanes, 2 for each
+approach, and 4 traffic light configurations. The lanes of all the junctions are kept in one (junctions, 8)
+array and moved forward with whole-array numpy operations, so one step costs about the same for a few
+junctions as for hundreds of them.
+Vehicles discharged by a junction drive towards one of its 4 neighbours: the first lane of an approach
+goes straight, the second one turns left or right. They are queued in the lanes of the approach of that
+neighbour they arrive at. Vehicles driving off the edge of the grid leave the network, and the approaches
+at the edge get the arrivals of the scalar env instead.
+
+The observation is the (junctions, 8) lane counts, the action one configuration per junction (MultiDiscrete).
+Every row of the observation has the layout of the observation of TrafficIntersectionEnvDoubleLane, so one
+policy trained on single junctions (or shared by all the junctions) gives the actions of all of them
+from a single batched predict on the observation.
+'''
+
+NUMBER_OF_APPROACHES = 4
+# approach a holds the vehicles driving in direction a (0: east, 1: south, 2: west, 3: north), in lanes 2a and 2a + 1
+LANES_OF_APPROACH = [[0, 1], [2, 3], [4, 5], [6, 7]]
+SHARE_OF_APPROACH_LANES = [0.5, 0.5]    # share of the vehicles entering an approach queued in each of its lanes
+
+# direction taken by the vehicles discharged from the first (straight) and the second (turning) lane of an approach, relative to the approach
+TURNS_OF_APPROACH_LANES = [
+    {0: 1.0},               # straight
+    {1: 0.5, 3: 0.5},       # half turn right, half turn left
+]
+
+# (row, column) offset of the neighbour in each direction
+DIRECTION_OFFSETS = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+NUMBER_OF_ROWS = 1
+NUMBER_OF_COLUMNS = 10
+ONE_TRAINING_TIME = 60 * 60     # Train for the equivalent of one hour
+
+
+def buildRoutingMatrix():
+    '''
+    (lanes, directions) share of the vehicles discharged from each lane driving in each direction
+    '''
+    routing = numpy.zeros((int(NUMBER_OF_LANES_TO_OBSERVE), NUMBER_OF_APPROACHES))
+    for approach, lanes in enumerate(LANES_OF_APPROACH):
+        for lane, turns in zip(lanes, TURNS_OF_APPROACH_LANES):
+            for turn, share in turns.items():
+                routing[lane, (approach + turn) % NUMBER_OF_APPROACHES] += share
+
+    return routing
+
+
+def buildGridLinks(rows, columns):
+    '''
+    Flat indices into the (junctions, directions) outflows and the (junctions, approaches) inflows,
+    vehicles leaving junction j in direction d reach approach d of the neighbour of j in that direction.
+    Also returns the (junctions, approaches) mask of the approaches at the edge of the grid.
+    '''
+    sources = []
+    targets = []
+    boundary = numpy.ones((rows * columns, NUMBER_OF_APPROACHES), dtype=bool)
+
+    for row in range(rows):
+        for column in range(columns):
+            junction = row * columns + column
+            for direction, (row_offset, column_offset) in enumerate(DIRECTION_OFFSETS):
+                neighbour_row, neighbour_column = row + row_offset, column + column_offset
+                if 0 <= neighbour_row < rows and 0 <= neighbour_column < columns:
+                    neighbour = neighbour_row * columns + neighbour_column
+                    sources.append(junction * NUMBER_OF_APPROACHES + direction)
+                    targets.append(neighbour * NUMBER_OF_APPROACHES + direction)
+                    boundary[neighbour, direction] = False
+
+    return numpy.array(sources, dtype=numpy.int64), numpy.array(targets, dtype=numpy.int64), boundary
+
+
+class TrafficIntersectionEnvCorridor(gym.Env):
+
+    def __init__(self, rows=NUMBER_OF_ROWS, columns=NUMBER_OF_COLUMNS, intersection_config=None, seed=None, episode_length=ONE_TRAINING_TIME):
+
+        self.rows = rows
+        self.columns = columns
+        self.number_of_junctions = rows * columns
+        self.episode_length = episode_length
+
+        number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+
+        '''
+        action space
+        One traffic light configuration for every junction
+        '''
+        self.action_space = gym.spaces.MultiDiscrete([POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION] * self.number_of_junctions)
+
+        # observation space
+        # vehicle count of the incoming lanes of every junction
+        self.observation_space = gym.spaces.Box(low=0, high=1000, shape=(self.number_of_junctions, number_of_lanes), dtype=numpy.float64)
+
+        # discharge tables of the intersection, shared by all the junctions
+        self.model = buildIntersectionModel(intersection_config)
+
+        self.routing = buildRoutingMatrix()
+        self.link_sources, self.link_targets, boundary = buildGridLinks(rows, columns)
+        self.approach_of_lane = numpy.array([approach for approach, lanes in enumerate(LANES_OF_APPROACH) for _ in lanes])
+        self.share_of_lane = numpy.tile(SHARE_OF_APPROACH_LANES, NUMBER_OF_APPROACHES)
+
+        # only the approaches at the edge of the grid get vehicles from outside
+        self.vehicles_added_in_each_lane = boundary[:, self.approach_of_lane] * self.model.vehicles_added_in_each_lane
+
+        # state and buffers reused by every step, no array is allocated while stepping
+        self.lanes = numpy.zeros((self.number_of_junctions, number_of_lanes))
+        self.vehicles_removed = numpy.zeros((self.number_of_junctions, number_of_lanes))
+        self.discharge_work = numpy.zeros((2, self.number_of_junctions, number_of_lanes, self.model.number_of_movements))
+        self.outflows = numpy.zeros((self.number_of_junctions, NUMBER_OF_APPROACHES))
+        self.inflows = numpy.zeros((self.number_of_junctions, NUMBER_OF_APPROACHES))
+        self.linked_outflows = numpy.zeros(len(self.link_sources))
+        self.arrivals = numpy.zeros((self.number_of_junctions, number_of_lanes))
+        self.vehicles_passed = numpy.zeros(self.number_of_junctions)
+        self.junction_rewards = numpy.zeros(self.number_of_junctions)
+        self.actions = numpy.zeros(self.number_of_junctions, dtype=numpy.int64)
+
+        self.seed(seed)
+        self.reset()
+
+    def seed(self, seed=None):
+        self.np_random = numpy.random.default_rng(seed)
+        return [seed]
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        # random vehicle count in lanes, same range as TrafficIntersectionEnvDoubleLane
+        low = (0.3 * self.model.lanes_capacity).astype(numpy.int64)
+        high = self.model.lanes_capacity.astype(numpy.int64) + 1
+        self.lanes[:] = self.np_random.integers(low, high, size=self.lanes.shape)
+
+        self.remaining_time = self.episode_length
+
+        return self.lanes.copy()
+
+    def step(self, action):
+        '''
+        All the junctions switch to their configuration and are simulated for one green time together
+        '''
+        done, vehicles_left_network = self.advance(action)
+
+        # the reward is the mean of the rewards of the junctions
+        reward = float(self.junction_rewards.mean())
+
+        info = {
+            "vehicles_passed": float(self.vehicles_passed.sum()),
+            "vehicles_left_network": vehicles_left_network,
+            "junction_rewards": self.junction_rewards.copy(),
+        }
+
+        # like the other analytic envs, a finished episode is reset right away
+        if done:
+            self.reset()
+
+        return self.lanes.copy(), reward, done, info
+
+    def advance(self, action):
+        '''
+        Simulates one green time and computes the reward of every junction (in junction_rewards),
+        the finished episode isn't reset. Returns done and the number of vehicles which drove off the grid.
+        '''
+        self.actions[:] = numpy.asarray(action).reshape(self.number_of_junctions)
+
+        self.remaining_time -= self.model.min_green_time
+
+        vehicles_left_network = self.simulateTraffic(self.actions)
+
+        # vehicles which passed each junction minus the mean queue left in its lanes
+        numpy.mean(self.lanes, axis=1, out=self.junction_rewards)
+        numpy.subtract(self.vehicles_passed, self.junction_rewards, out=self.junction_rewards)
+
+        done = self.remaining_time < self.model.min_green_time
+
+        return done, vehicles_left_network
+
+    def simulateTraffic(self, actions):
+        '''
+        Discharges every junction, routes the discharged vehicles to the neighbours and adds the vehicles
+        arriving from outside. Returns the number of vehicles which drove off the grid.
+        '''
+        self.model.discharge(self.lanes, actions, out=self.vehicles_removed, work=self.discharge_work)
+        self.lanes -= self.vehicles_removed
+        numpy.sum(self.vehicles_removed, axis=1, out=self.vehicles_passed)
+
+        # vehicles leaving each junction in each direction
+        numpy.matmul(self.vehicles_removed, self.routing, out=self.outflows)
+
+        # the ones with a neighbour in that direction arrive at its approach, the others leave the network
+        numpy.take(self.outflows, self.link_sources, out=self.linked_outflows)
+        vehicles_left_network = float(self.outflows.sum() - self.linked_outflows.sum())
+        self.inflows.fill(0)
+        self.inflows.ravel()[self.link_targets] = self.linked_outflows
+
+        # split between the lanes of the approach
+        numpy.take(self.inflows, self.approach_of_lane, axis=1, out=self.arrivals)
+        self.arrivals *= self.share_of_lane
+        self.lanes += self.arrivals
+        self.lanes += self.vehicles_added_in_each_lane
+
+        return vehicles_left_network
@@ -1,12 +1,12 @@
 from cmath import sqrt
-from functools import reduce
-from operator import indexOf
 from sys import maxunicode
 from time import time
 import gym
 import gym.spaces
 import numpy
-import random
+
+from envs.custom_env_dir.IntersectionModel import IntersectionModel, loadIntersectionParameters
+from envs.custom_env_dir.IntersectionTopology import TRAINED_LANE_ORDER
 
 '''
 only implementing for four way intersection each with two lanes at the moment.
@@ -150,6 +150,11 @@ The possible green configurations are:
 
 POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION = 4
 
+# lanes of the double lane map of sumo-files the observation stands for, and the green phase of J11 of each configuration,
+# the way traffic.py runs the models on SUMO
+OBSERVED_LANES = TRAINED_LANE_ORDER[("small-map-double-lane", "J11")]
+GREEN_PHASES = [0, 2, 4, 6]
+
 LENGTH_STRAIGHT_IN_METERS = 15
 LENGTH_DIAGONAL_IN_METERS = LENGTH_STRAIGHT_IN_METERS * 1.41
 
@@ -158,9 +163,62 @@ PERCENTAGE_OF_VEHICLE_GOING_DIAGONALLY = 0.2
 PERCENTAGE_OF_VEHICLE_GOING_STRAIGHT = 0.5
 ONE_TRAINING_TIME = 5 * 60 # Train for the equivalent of 5 minutes
 
+# lanes released by each traffic light configuration and the percentage of their vehicles that are allowed to move
+# (first lanes, second lanes, percentage to subtract from first and second lanes)
+LANES_RELEASED_BY_CONFIGURATION = [
+    ([0, 4], [1, 5], [1, 0.5]),
+    ([2, 6], [3, 7], [1, 0.5]),
+    ([0, 4], [1, 5], [0.3, 0.2]),
+    ([2, 6], [3, 7], [0.3, 0.2]),
+]
+
+# parameters which can be changed from a config (dictionary or json file) without editing the constants above
+DEFAULT_INTERSECTION_PARAMETERS = {
+    "lanes_capacity": LANES_CAPACITY,
+    "probability_of_vehicle_occurance_in_lanes_per_second": PROBABILITY_OF_VEHICLE_OCCURANCE_IN_LANES_PER_SECOND,
+    "vehicle_speed_of_lanes": VEHICLE_SPEED_OF_LANES,
+    "min_green_time": MIN_GREEN_TIME,
+    "length_straight_in_meters": LENGTH_STRAIGHT_IN_METERS,
+}
+
+def buildIntersectionModel(config=None):
+    '''
+    Precomputes the discharge tables of the double lane intersection, every lane has a single movement.
+    '''
+    parameters = loadIntersectionParameters(config, DEFAULT_INTERSECTION_PARAMETERS)
+
+    vehicle_speed_of_lanes = parameters["vehicle_speed_of_lanes"]
+    min_green_time = parameters["min_green_time"]
+    length_straight_in_meters = parameters["length_straight_in_meters"]
+    length_diagonal_in_meters = length_straight_in_meters * 1.41
+
+    number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+
+    # maximum number of vehicles which can pass through the intersection from each lane in one green time
+    max_number_of_vehicles_removed_in_each_lane = numpy.zeros(number_of_lanes)
+    for i in range(number_of_lanes):
+        if i % 2 == 0:
+            speed_of_vehicle_removal = 0.35 * vehicle_speed_of_lanes[i] * (10/36) # taking average between straight speed and turning speed
+            time_required_for_one_vehicle_removal = 0.9 * length_straight_in_meters / speed_of_vehicle_removal # taking average between straight distance and turning distance
+        else:
+            speed_of_vehicle_removal = 0.85 * vehicle_speed_of_lanes[i] * (10/36) # taking average between straight speed and diagonal speed
+            time_required_for_one_vehicle_removal = 1.205 * length_diagonal_in_meters / speed_of_vehicle_removal # taking average between straight distance and diagonal distance
+        max_number_of_vehicles_removed_in_each_lane[i] = min_green_time / time_required_for_one_vehicle_removal
+
+    release_fractions = numpy.zeros((POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, number_of_lanes, 1))
+    capacities = numpy.zeros((POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, number_of_lanes, 1))
+    for configuration, (first_lanes, second_lanes, percentage_to_subtract) in enumerate(LANES_RELEASED_BY_CONFIGURATION):
+        for lanes, percentage in ((first_lanes, percentage_to_subtract[0]), (second_lanes, percentage_to_subtract[1])):
+            release_fractions[configuration, lanes, 0] = percentage
+            capacities[configuration, lanes, 0] = max_number_of_vehicles_removed_in_each_lane[lanes]
+
+    vehicles_added_in_each_lane = [int(probability * min_green_time) for probability in parameters["probability_of_vehicle_occurance_in_lanes_per_second"]]
+
+    return IntersectionModel(release_fractions, capacities, vehicles_added_in_each_lane, parameters["lanes_capacity"], min_green_time)
+
 class TrafficIntersectionEnvDoubleLane(gym.Env):
 
-    def __init__(self):
+    def __init__(self, intersection_config=None, seed=None):
 
         # initialising gym stuffs
         
@@ -173,12 +231,42 @@ class TrafficIntersectionEnvDoubleLane(gym.Env):
         # observation space
         # Observation space is the vehicle count in different lanes which need to be observed 
         self.observation_space = gym.spaces.Box(low=0, high=1000, shape=(int(NUMBER_OF_LANES_TO_OBSERVE), ), dtype=numpy.float64)
+        self.observed_lanes = OBSERVED_LANES
+        self.green_phases = GREEN_PHASES
 
         # keeping track of the reward
         self.collected_reward = -1
 
         self.lanes = numpy.zeros(int(NUMBER_OF_LANES_TO_OBSERVE))
 
+        # discharge tables of the intersection, computed once
+        self.model = buildIntersectionModel(intersection_config)
+
+        # buffers reused by every step and reset, no array is allocated while stepping
+        number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+        self.vehicles_removed = numpy.zeros(number_of_lanes)
+        self.discharge_work = numpy.zeros((number_of_lanes, self.model.number_of_movements))
+        self.partial_sums = numpy.zeros(number_of_lanes)
+        self.last_observation = numpy.zeros(number_of_lanes)
+        # lanes at the end of the last episode, the env resets itself before step returns
+        self.terminal_observation = numpy.zeros(number_of_lanes)
+
+        # initial vehicle counts are drawn uniformly in [low, high]
+        self.reset_low = numpy.floor(0.3 * self.model.lanes_capacity)
+        self.reset_span = numpy.floor(self.model.lanes_capacity) + 1 - self.reset_low
+        self.reset_high = self.reset_low + self.reset_span - 1
+
+        # observations are copied to two buffers used in turn and handed out as read only views, so an observation
+        # isn't changed by the next step (only by the one after it) and callers can never change the state
+        self.observation_buffers = [numpy.zeros(number_of_lanes), numpy.zeros(number_of_lanes)]
+        self.observation_views = [buffer.view() for buffer in self.observation_buffers]
+        for view in self.observation_views:
+            view.setflags(write=False)
+        self.next_observation = 0
+
+        # each env has its own generator, parallel envs never share a random stream
+        self.seed(seed)
+
         # Resetting our environment, rather initializing it
         self.reset()
 
@@ -191,25 +279,29 @@ class TrafficIntersectionEnvDoubleLane(gym.Env):
         done = False
         info = {}
 
-        self.remaining_time -= MIN_GREEN_TIME
+        self.remaining_time -= self.model.min_green_time
 
         vehicleThroughIntersection, vehicleRemaining = self.simulateTraffic(action)
+        info["vehicles_passed"] = vehicleThroughIntersection
 
         # copying the observation to use for reward generation. since, observation will be changed after traffic is simulated
-        last_observation_leading_to_predicted_action = self.state.copy()
+        numpy.copyto(self.last_observation, self.state)
 
         if vehicleThroughIntersection==0 or self.remaining_time < 60:
             done = True
-            self.reset()
+            numpy.copyto(self.terminal_observation, self.lanes)
+            self.resetLanes()
         
-        reward = self.calculateReward(vehicleThroughIntersection, vehicleRemaining, last_observation_leading_to_predicted_action)
+        reward = self.calculateReward(vehicleThroughIntersection, vehicleRemaining, self.last_observation)
         self.collected_reward += reward
 
-        obs = self.lanes
         self.state = self.lanes
 
+        # the state is reset without observing it, the step hands out a single observation buffer
         if done==True:
-            self.reset()
+            self.resetLanes()
+
+        obs = self.observe()
 
         '''
         For cumulative reward return self.collected_reward
@@ -221,9 +313,28 @@ class TrafficIntersectionEnvDoubleLane(gym.Env):
         return obs, self.collected_reward, done, info
 
 
-    def reset(self):
-        for i, _ in enumerate(self.lanes):
-            self.lanes[i] = random.randint(int(0.3 * LANES_CAPACITY[i]), LANES_CAPACITY[i])
+    def seed(self, seed=None):
+        self.np_random = numpy.random.default_rng(seed)
+        return [seed]
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        self.resetLanes()
+
+        return self.observe()
+
+    def resetLanes(self):
+        '''
+        New initial state of the episode, no observation is handed out for it
+        '''
+        # random vehicle count in lanes, drawn in place
+        self.np_random.random(out=self.lanes)
+        self.lanes *= self.reset_span
+        self.lanes += self.reset_low
+        numpy.floor(self.lanes, out=self.lanes)
+        numpy.minimum(self.lanes, self.reset_high, out=self.lanes)
 
         self.collected_reward = -1
 
@@ -233,93 +344,38 @@ class TrafficIntersectionEnvDoubleLane(gym.Env):
 
         self.percentageOfVehiclePassingThroughTheIntersectionLastTime = 0
 
-        return self.state
+    def observe(self):
+        '''
+        Read only copy of the lanes, valid until the step after the next one
+        '''
+        observation = self.observation_views[self.next_observation]
+        numpy.copyto(self.observation_buffers[self.next_observation], self.lanes)
+        self.next_observation ^= 1
+
+        return observation
 
     def simulateTraffic(self, action):
 
-        trafficLightConfiguration = action
+        trafficLightConfiguration = int(action)
         vehicleThroughIntersection = 0
-        totalVehicle = reduce(lambda x,y: x+y, self.lanes)
+        # cumsum adds the lanes one after another like a sequential sum, in a preallocated buffer
+        totalVehicle = numpy.cumsum(self.lanes, out=self.partial_sums)[-1]
 
-        # reward calculation based on number of vehicle passed
-        
-        if trafficLightConfiguration==0:
-            first_lanes_to_subtract_certain_percentage_traffic = [0,4]
-            second_lanes_to_subtract_certain_percentage_traffic = [1,5]
-            percentage_to_subtract = [1,0.5]
-
-           
-        elif trafficLightConfiguration==1:
-            first_lanes_to_subtract_certain_percentage_traffic = [2,6]
-            second_lanes_to_subtract_certain_percentage_traffic = [3,7]
-            percentage_to_subtract = [1,0.5]
-
-
-        elif trafficLightConfiguration==2:
-            first_lanes_to_subtract_certain_percentage_traffic = [0,4]
-            second_lanes_to_subtract_certain_percentage_traffic = [1,5]
-            percentage_to_subtract = [0.3,0.2]
-
-            
-        elif trafficLightConfiguration==3:
-            first_lanes_to_subtract_certain_percentage_traffic = [2,6]
-            second_lanes_to_subtract_certain_percentage_traffic = [3,7]
-            percentage_to_subtract = [0.3,0.2]
-        
-        else:
-            first_lanes_to_subtract_certain_percentage_traffic = []
-            second_lanes_to_subtract_certain_percentage_traffic = []
-            percentage_to_subtract = []
-        
-        if (len(first_lanes_to_subtract_certain_percentage_traffic) == 0) or (len(second_lanes_to_subtract_certain_percentage_traffic) == 0) or (len(percentage_to_subtract)==0):
+        if not 0 <= trafficLightConfiguration < self.model.number_of_configurations:
             return 0,0
-        
-        no_of_vehicle_to_remove_in_each_lanes = numpy.zeros(len(self.lanes))
-        lane_arrays = [first_lanes_to_subtract_certain_percentage_traffic, second_lanes_to_subtract_certain_percentage_traffic]
-        for lane_array in lane_arrays:
-            for lane in lane_array:
-                no_of_vehicle_to_remove_in_each_lanes[lane] = percentage_to_subtract[indexOf(lane_arrays, lane_array)] * self.lanes[lane]
-
-        speed_of_vehicle_removal_in_each_lane = numpy.zeros(len(no_of_vehicle_to_remove_in_each_lanes))
-        for i in range(len(speed_of_vehicle_removal_in_each_lane)):
-            if(no_of_vehicle_to_remove_in_each_lanes[i] != 0) and i%2==0:
-                speed_of_vehicle_removal_in_each_lane[i] = 0.35 * VEHICLE_SPEED_OF_LANES[i] * (10/36) # taking average between straight speed and turning speed
-            elif (no_of_vehicle_to_remove_in_each_lanes[i] != 0) and i%2!=0:
-                speed_of_vehicle_removal_in_each_lane[i] = 0.85 * VEHICLE_SPEED_OF_LANES[i] * (10/36) # taking average between straight speed and diagonal speed
-            else:
-                speed_of_vehicle_removal_in_each_lane[i] = 0
-
-        time_required_for_one_vehicle_removal_in_each_lane = numpy.zeros(len(no_of_vehicle_to_remove_in_each_lanes))
-        for i in range(len(speed_of_vehicle_removal_in_each_lane)):
-            if(no_of_vehicle_to_remove_in_each_lanes[i] != 0) and i%2==0:
-                time_required_for_one_vehicle_removal_in_each_lane[i] = 0.9 * LENGTH_STRAIGHT_IN_METERS / speed_of_vehicle_removal_in_each_lane[i] # taking average between straight distance and turning distance
-            elif (no_of_vehicle_to_remove_in_each_lanes[i] != 0) and i%2!=0:
-                time_required_for_one_vehicle_removal_in_each_lane[i] = 1.205 * LENGTH_DIAGONAL_IN_METERS / speed_of_vehicle_removal_in_each_lane[i] # taking average between straight distance and diagonal distance
-            else:
-                time_required_for_one_vehicle_removal_in_each_lane[i] = 0
-
-        max_number_of_vehicles_removed_in_each_lane = numpy.zeros(len(no_of_vehicle_to_remove_in_each_lanes))
-        for i in range(len(time_required_for_one_vehicle_removal_in_each_lane)):
-            if(time_required_for_one_vehicle_removal_in_each_lane[i] != 0):
-                max_number_of_vehicles_removed_in_each_lane[i] = MIN_GREEN_TIME / time_required_for_one_vehicle_removal_in_each_lane[i]
-
-        actual_number_of_vehicle_removed_in_each_lane = numpy.zeros(len(max_number_of_vehicles_removed_in_each_lane))
-        for i in range(len(actual_number_of_vehicle_removed_in_each_lane)):
-            if(no_of_vehicle_to_remove_in_each_lanes[i] != 0):
-                # selecting whichever is the lowest either max possible to remove or maximum available to remove
-                actual_number_of_vehicle_removed_in_each_lane[i] = min(max_number_of_vehicles_removed_in_each_lane[i], no_of_vehicle_to_remove_in_each_lanes[i])
-        
+
+        # selecting whichever is the lowest either max possible to remove or maximum available to remove
+        actual_number_of_vehicle_removed_in_each_lane = self.model.discharge(self.lanes, trafficLightConfiguration, out=self.vehicles_removed, work=self.discharge_work)
+
         # Removing the vehicle from the lanes
-        for laneNo in range(len(self.lanes)):
-            self.lanes[laneNo] -= actual_number_of_vehicle_removed_in_each_lane[laneNo]
+        self.lanes -= actual_number_of_vehicle_removed_in_each_lane
 
-        vehicleThroughIntersection = reduce(lambda x,y: x + y, actual_number_of_vehicle_removed_in_each_lane)
+        vehicleThroughIntersection = numpy.cumsum(actual_number_of_vehicle_removed_in_each_lane, out=self.partial_sums)[-1]
 
         vehicleRemaining = totalVehicle - vehicleThroughIntersection
 
         # adding vehicles to the lanes according to the probability
-        for j,probability in enumerate(PROBABILITY_OF_VEHICLE_OCCURANCE_IN_LANES_PER_SECOND):
-            self.lanes[j] += int(probability * MIN_GREEN_TIME)
+        self.lanes += self.model.vehicles_added_in_each_lane
 
 
         return vehicleThroughIntersection, vehicleRemaining
@@ -329,12 +385,13 @@ class TrafficIntersectionEnvDoubleLane(gym.Env):
         
         percentage_of_vehicle_passing_through_the_intersection = numberOfVehiclePassed/(numberOfVehiclePassed + numberOfVehicleRemaining) * 100
 
-        if numberOfVehiclePassed < min(last_observation_leading_to_predicted_action):
+        if numberOfVehiclePassed < last_observation_leading_to_predicted_action.min():
             reward = (percentage_of_vehicle_passing_through_the_intersection - self.percentageOfVehiclePassingThroughTheIntersectionLastTime) * 100
-        elif numberOfVehiclePassed > max(last_observation_leading_to_predicted_action):
+        elif numberOfVehiclePassed > last_observation_leading_to_predicted_action.max():
             reward = 1000
         else:
-            reward = (1 - (max(last_observation_leading_to_predicted_action) - numberOfVehiclePassed)/max(last_observation_leading_to_predicted_action)) * 200
+            maximum = last_observation_leading_to_predicted_action.max()
+            reward = (1 - (maximum - numberOfVehiclePassed)/maximum) * 200
 
         self.percentageOfVehiclePassingThroughTheIntersectionLastTime = percentage_of_vehicle_passing_through_the_intersection
 
@@ -1,8 +1,9 @@
-from functools import reduce
 import gym
 import gym.spaces
 import numpy
-import random
+
+from envs.custom_env_dir.IntersectionModel import IntersectionModel, loadIntersectionParameters
+from envs.custom_env_dir.IntersectionTopology import TRAINED_LANE_ORDER
 
 
 '''
@@ -128,6 +129,10 @@ The possible green configurations are:
 
 POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION = 4
 
+# lanes of the single lane map of sumo-files the observation stands for, and the green phase of J9 of each configuration
+OBSERVED_LANES = TRAINED_LANE_ORDER[("small-map-single-lane", "J9")]
+GREEN_PHASES = [0, 2, 4, 6]
+
 LENGTH_STRAIGHT_IN_METERS = 15
 LENGTH_DIAGONAL_IN_METERS = LENGTH_STRAIGHT_IN_METERS * 1.41
 
@@ -135,9 +140,49 @@ PERCENTAGE_OF_VEHICLE_GOING_THROUGH_SIDE_LANES = 0.3
 PERCENTAGE_OF_VEHICLE_GOING_DIAGONALLY = 0.2
 ONE_TRAINING_TIME = 5 * 60 # Train for the equivalent of 5 minutes
 
+# parameters which can be changed from a config (dictionary or json file) without editing the constants above
+DEFAULT_INTERSECTION_PARAMETERS = {
+    "lanes_capacity": LANES_CAPACITY,
+    "probability_of_vehicle_occurance_in_lanes_per_second": PROBABILITY_OF_VEHICLE_OCCURANCE_IN_LANES_PER_SECOND,
+    "vehicle_speed_of_lanes": VEHICLE_SPEED_OF_LANES,
+    "min_green_time": MIN_GREEN_TIME,
+    "length_straight_in_meters": LENGTH_STRAIGHT_IN_METERS,
+}
+
+def buildIntersectionModel(config=None):
+    '''
+    Precomputes the discharge tables of the single lane intersection.
+    Configuration i releases lane i, whose vehicles are split into turning, turning diagonally and going straight movements.
+    '''
+    parameters = loadIntersectionParameters(config, DEFAULT_INTERSECTION_PARAMETERS)
+
+    vehicle_speed_of_lanes = parameters["vehicle_speed_of_lanes"]
+    min_green_time = parameters["min_green_time"]
+    length_straight_in_meters = parameters["length_straight_in_meters"]
+    length_diagonal_in_meters = length_straight_in_meters * 1.41
+
+    number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+
+    percentage_of_vehicle_going_straight = 1 - PERCENTAGE_OF_VEHICLE_GOING_THROUGH_SIDE_LANES - PERCENTAGE_OF_VEHICLE_GOING_DIAGONALLY
+
+    release_fractions = numpy.zeros((POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, number_of_lanes, 3))
+    capacities = numpy.zeros((POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, number_of_lanes, 3))
+    for configuration in range(POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION):
+        timeTakenForTurning = 0.1 * length_straight_in_meters / (0.7 * vehicle_speed_of_lanes[configuration] * (10/36))
+        timeTakenForDiagonalTurning = length_diagonal_in_meters / (vehicle_speed_of_lanes[configuration]* (10/36))
+        timeTakenStraight = length_straight_in_meters / (vehicle_speed_of_lanes[configuration]* (10/36))
+
+        release_fractions[configuration, configuration] = [PERCENTAGE_OF_VEHICLE_GOING_THROUGH_SIDE_LANES, PERCENTAGE_OF_VEHICLE_GOING_DIAGONALLY, percentage_of_vehicle_going_straight]
+        capacities[configuration, configuration] = [min_green_time / timeTakenForTurning, min_green_time / timeTakenForDiagonalTurning, min_green_time / timeTakenStraight]
+
+    vehicles_added_in_each_lane = [int(probability * min_green_time) for probability in parameters["probability_of_vehicle_occurance_in_lanes_per_second"]]
+
+    # only whole vehicles pass through the intersection
+    return IntersectionModel(release_fractions, capacities, vehicles_added_in_each_lane, parameters["lanes_capacity"], min_green_time, whole_vehicles=True)
+
 class TrafficIntersectionEnvSingleLane(gym.Env):
 
-    def __init__(self):
+    def __init__(self, intersection_config=None, seed=None):
 
         # initialising gym stuffs
         
@@ -150,12 +195,41 @@ class TrafficIntersectionEnvSingleLane(gym.Env):
         # observation space
         # Observation space is the vehicle count in different lanes which need to be observed 
         self.observation_space = gym.spaces.Box(low=0, high=1000, shape=(int(NUMBER_OF_LANES_TO_OBSERVE), ), dtype=numpy.float64)
+        self.observed_lanes = OBSERVED_LANES
+        self.green_phases = GREEN_PHASES
 
         # keeping track of the reward
         # self.collected_reward = -1
 
         self.lanes = numpy.zeros(int(NUMBER_OF_LANES_TO_OBSERVE))
 
+        # discharge tables of the intersection, computed once
+        self.model = buildIntersectionModel(intersection_config)
+
+        # buffers reused by every step and reset, no array is allocated while stepping
+        number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+        self.vehicles_removed = numpy.zeros(number_of_lanes)
+        self.discharge_work = numpy.zeros((number_of_lanes, self.model.number_of_movements))
+        self.partial_sums = numpy.zeros(number_of_lanes)
+        self.last_observation = numpy.zeros(number_of_lanes)
+        # lanes at the end of the last episode, the env resets itself before step returns
+        self.terminal_observation = numpy.zeros(number_of_lanes)
+
+        # initial vehicle counts are drawn uniformly in [low, high]
+        self.reset_low = numpy.floor(0.1 * self.model.lanes_capacity)
+        self.reset_span = numpy.floor(self.model.lanes_capacity) + 1 - self.reset_low
+        self.reset_high = self.reset_low + self.reset_span - 1
+
+        # observations are copied to two buffers used in turn and handed out as read only views, see TrafficIntersectionEnvDoubleLane
+        self.observation_buffers = [numpy.zeros(number_of_lanes), numpy.zeros(number_of_lanes)]
+        self.observation_views = [buffer.view() for buffer in self.observation_buffers]
+        for view in self.observation_views:
+            view.setflags(write=False)
+        self.next_observation = 0
+
+        # each env has its own generator, parallel envs never share a random stream
+        self.seed(seed)
+
         # initializing our environment
         self.reset()
 
@@ -169,33 +243,54 @@ class TrafficIntersectionEnvSingleLane(gym.Env):
         done = False
         info = {}
 
-        self.remaining_time -= MIN_GREEN_TIME
+        self.remaining_time -= self.model.min_green_time
 
         # copying the observation to use for reward generation. since, observation will be changed after traffic is simulated
-        last_observation_leading_to_predicted_action = self.state.copy()
+        numpy.copyto(self.last_observation, self.state)
 
         vehicleThroughIntersection, vehicleRemaining = self.simulateTraffic(action)
+        info["vehicles_passed"] = vehicleThroughIntersection
 
-        if vehicleThroughIntersection==0 or self.remaining_time < MIN_GREEN_TIME:
+        if vehicleThroughIntersection==0 or self.remaining_time < self.model.min_green_time:
             done = True
         
-        reward = self.calculateReward(vehicleThroughIntersection, vehicleRemaining, last_observation_leading_to_predicted_action)
+        reward = self.calculateReward(vehicleThroughIntersection, vehicleRemaining, self.last_observation)
         #self.collected_reward += reward
 
-        obs = self.lanes
         self.state = self.lanes
 
+        # the state is reset without observing it, the step hands out a single observation buffer
         if done==True:
-            self.reset()
+            numpy.copyto(self.terminal_observation, self.lanes)
+            self.resetLanes()
+
+        obs = self.observe()
 
         return obs, reward, done, info
 
 
-    def reset(self):
+    def seed(self, seed=None):
+        self.np_random = numpy.random.default_rng(seed)
+        return [seed]
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        self.resetLanes()
 
-        # randomising vehicle count in lanes
-        for i in range(int(NUMBER_OF_LANES_TO_OBSERVE)):
-            self.lanes[i] = random.randint(int(0.1 * LANES_CAPACITY[i]), LANES_CAPACITY[i])
+        return self.observe()
+
+    def resetLanes(self):
+        '''
+        New initial state of the episode, no observation is handed out for it
+        '''
+        # randomising vehicle count in lanes, in place
+        self.np_random.random(out=self.lanes)
+        self.lanes *= self.reset_span
+        self.lanes += self.reset_low
+        numpy.floor(self.lanes, out=self.lanes)
+        numpy.minimum(self.lanes, self.reset_high, out=self.lanes)
 
         #self.collected_reward = -1
         self.state = self.lanes
@@ -204,42 +299,37 @@ class TrafficIntersectionEnvSingleLane(gym.Env):
 
         self.remaining_time = ONE_TRAINING_TIME
 
-        return self.state
+    def observe(self):
+        '''
+        Read only copy of the lanes, valid until the step after the next one
+        '''
+        observation = self.observation_views[self.next_observation]
+        numpy.copyto(self.observation_buffers[self.next_observation], self.lanes)
+        self.next_observation ^= 1
+
+        return observation
 
     def simulateTraffic(self, action):
 
-        trafficLightConfiguration = action
+        trafficLightConfiguration = int(action)
         vehicleThroughIntersection = 0
-        totalVehicle = reduce(lambda x,y: x+y, self.lanes)
+        # cumsum adds the lanes one after another like a sequential sum, in a preallocated buffer
+        totalVehicle = numpy.cumsum(self.lanes, out=self.partial_sums)[-1]
 
         # reward calculation based on number of vehicle passed
         
         # since vehicles can move randomly (in the real world), we can set any type of logic here, but keeping it a bit realistic
+        # the share of turning, diagonally turning and straight going vehicles and how many of them can pass are precomputed in the model
 
-        vehiclesTurning = PERCENTAGE_OF_VEHICLE_GOING_THROUGH_SIDE_LANES * self.lanes[trafficLightConfiguration]
-        vehiclesTurningDiagonally = PERCENTAGE_OF_VEHICLE_GOING_DIAGONALLY * self.lanes[trafficLightConfiguration]
-        vehiclesGoingStraight = self.lanes[trafficLightConfiguration] - vehiclesTurning - vehiclesTurningDiagonally
+        vehicles_removed_in_each_lane = self.model.discharge(self.lanes, trafficLightConfiguration, out=self.vehicles_removed, work=self.discharge_work)
 
-        timeTakenForTurning = 0.1 * LENGTH_STRAIGHT_IN_METERS / (0.7 * VEHICLE_SPEED_OF_LANES[trafficLightConfiguration] * (10/36))
-        timeTakenForDiagonalTurning = LENGTH_DIAGONAL_IN_METERS / (VEHICLE_SPEED_OF_LANES[trafficLightConfiguration]* (10/36))
-        timeTakenStraight = LENGTH_STRAIGHT_IN_METERS / (VEHICLE_SPEED_OF_LANES[trafficLightConfiguration]* (10/36))
-
-        maxVehicleTurning = MIN_GREEN_TIME / timeTakenForTurning
-        maxVehicleTurningDiagonally = MIN_GREEN_TIME / timeTakenForDiagonalTurning
-        maxVehicleStraight = MIN_GREEN_TIME / timeTakenStraight
-
-        actualVehicleTurning = min(maxVehicleTurning, vehiclesTurning)
-        actualVehicleTurningDiagonally = min(maxVehicleTurningDiagonally, vehiclesTurningDiagonally)
-        actualVehicleGoingStraight = min(maxVehicleStraight, vehiclesGoingStraight)
-        
-        vehicleThroughIntersection = int(actualVehicleTurning + actualVehicleTurningDiagonally + actualVehicleGoingStraight)
+        vehicleThroughIntersection = int(vehicles_removed_in_each_lane.sum())
 
-        self.lanes[trafficLightConfiguration] -= vehicleThroughIntersection
+        self.lanes -= vehicles_removed_in_each_lane
         vehicleRemaining = totalVehicle - vehicleThroughIntersection
         
         # adding vehicles to the lanes according to the probability
-        for j,probability in enumerate(PROBABILITY_OF_VEHICLE_OCCURANCE_IN_LANES_PER_SECOND):
-            self.lanes[j] += int(probability * MIN_GREEN_TIME)
+        self.lanes += self.model.vehicles_added_in_each_lane
 
 
         return vehicleThroughIntersection, vehicleRemaining
@@ -248,6 +338,6 @@ class TrafficIntersectionEnvSingleLane(gym.Env):
     # this doesn't work
     def calculateReward(self, numberOfVehiclePassed, numberOfVehicleRemaining, last_observation_leading_to_predicted_action):
 
-        reward = numberOfVehiclePassed / max(last_observation_leading_to_predicted_action)
+        reward = numberOfVehiclePassed / last_observation_leading_to_predicted_action.max()
 
         return reward
\ No newline at end of file
@@ -0,0 +1,284 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import gym
+import gym.spaces
+import numpy
+
+from envs.custom_env_dir.IntersectionTopology import IntersectionTopology
+from envs.custom_env_dir.LaneObservationCollector import LaneObservationCollector
+from envs.custom_env_dir.PhaseScheduler import PhaseScheduler
+from envs.custom_env_dir.sumoLibraries import requireSumo, sumolib, traci
+
+'''
+Traffic intersection environment backed by a real SUMO simulation controlled through TraCI.
+
+The observation and the action are the same as the ones of the analytic environments,
+the vehicle count of the incoming lanes and the green configuration of the junction.
+Both come from the topology of the junction read from the network file, so every map is handled the same way.
+Other lane features (halting count, mean speed, waiting time) can be added to the observation,
+they are collected through the same TraCI subscriptions as the vehicle count.
+
+One SUMO process is started on the first reset and kept alive for the whole life of the environment.
+Starting SUMO and parsing the network takes much longer than a short episode, so later resets
+restore the simulation state saved at the beginning of the first episode (or load the next route file
+in the same process when several route files are given) instead of starting a new SUMO.
+'''
+
+SUMO_DIRECTORY = Path(__file__).resolve().parents[3] / "sumo-files"
+
+# controlled junction of each of the maps in sumo-files
+JUNCTION_WITH_LIGHTS = {
+    "single": "J9",
+    "double": "J11",
+    "triple": "J1",
+}
+
+DECISION_INTERVAL = 30      # seconds of simulation between two actions, same as traffic.py
+ONE_TRAINING_TIME = 30 * 60 # Train for the equivalent of 30 minutes
+TIME_TO_TELEPORT = "-1"     # setting time to teleport to -1 will make vehicles not teleport
+
+class TrafficIntersectionEnvSumo(gym.Env):
+
+    def __init__(self, intersection_type="double", net_file=None, junction_id=None, route_files=None, gui=False, label=None, port=None, episode_length=ONE_TRAINING_TIME, decision_interval=DECISION_INTERVAL, observation_features=("vehicle_count", ), all_red_time=0, fast_forward=True, seed=None):
+
+        requireSumo()
+
+        self.intersection_type = intersection_type
+        self.net_file = str(net_file or SUMO_DIRECTORY / "small-map-{}-lane.net.xml".format(intersection_type))
+
+        # observed lanes and green phases of the junction, read from the network file (or its cached index)
+        self.topology = IntersectionTopology.load(self.net_file, junction_id or JUNCTION_WITH_LIGHTS[intersection_type])
+        self.lanes_to_observe = self.topology.incoming_lanes
+        self.junction_with_lights = self.topology.junction_id
+        # same names as the analytic envs, what the observations and the actions are
+        self.observed_lanes = self.topology.incoming_lanes
+        self.green_phases = self.topology.green_phases
+
+        # a single route file or a list of them used one after another in successive episodes
+        if route_files is None:
+            route_files = [SUMO_DIRECTORY / "small-map-{}-lane.rou.xml".format(intersection_type)]
+        elif isinstance(route_files, (str, Path)):
+            route_files = [route_files]
+        self.route_files = [str(route_file) for route_file in route_files]
+        self.next_route_file = 0
+
+        self.sumo_binary = sumolib.checkBinary('sumo-gui' if gui else 'sumo')
+
+        # unique name of the traci connection, so that several environments can live in one process
+        self.label = label or "TrafficIntersectionEnvSumo-{}".format(id(self))
+        # port of the traci server, a free one is picked if not given
+        self.port = port
+        self.connection = None
+        self.collector = None
+        self.scheduler = None
+        self.saved_state = None
+        # private directory of the saved state, the labels of the envs of other processes can be the same
+        self.state_directory = None
+        # seed of the random number generator of SUMO, the default one of SUMO if not given
+        self.sumo_seed = seed
+
+        # number of times the SUMO process died and had to be started again
+        self.number_of_restarts = 0
+
+        self.episode_length = episode_length
+        self.decision_interval = decision_interval
+        self.all_red_time = all_red_time
+        # advancing sumo to the end of the decision interval in one traci call instead of one call per second
+        self.fast_forward = fast_forward
+        self.arrived_vehicles = 0
+
+        # initialising gym stuffs
+
+        '''
+        action space
+        The action which can be performed is changing the current active traffic light configuration
+        '''
+        self.action_space = gym.spaces.Discrete(self.topology.number_of_configurations)
+
+        # vehicle count is always collected for the reward, even if it isn't observed
+        self.observation_features = list(observation_features)
+        self.collected_features = ["vehicle_count"] + [feature for feature in self.observation_features if feature != "vehicle_count"]
+        self.observed_rows = [self.collected_features.index(feature) for feature in self.observation_features]
+
+        # observation space
+        # Observation space is the vehicle count (and other features) in different lanes which need to be observed
+        self.observation_space = gym.spaces.Box(low=0, high=1000, shape=(len(self.observation_features) * len(self.lanes_to_observe), ), dtype=numpy.float64)
+
+        self.lanes = numpy.zeros(len(self.lanes_to_observe))
+
+    def sumoArguments(self, route_file):
+        return ["-n", self.net_file,
+            "-r", route_file,
+            "--time-to-teleport", TIME_TO_TELEPORT,
+            "--no-step-log", "true",
+            "--no-warnings", "true"] + ([] if self.sumo_seed is None else ["--seed", str(self.sumo_seed), "--save-state.rng", "true"])
+
+    def startSumo(self):
+        '''
+        Starts the SUMO process, only done once for the environment
+        '''
+        route_file = self.route_files[self.next_route_file]
+        traci.start([self.sumo_binary] + self.sumoArguments(route_file) + ['--start', '--quit-on-end'], port=self.port, label=self.label)
+        self.connection = traci.getConnection(self.label)
+        self.collector = LaneObservationCollector(self.connection, self.lanes_to_observe, self.junction_with_lights, self.collected_features)
+
+        self.saveEpisodeStart()
+
+    def saveEpisodeStart(self):
+        if len(self.route_files) == 1:
+            # the state at the beginning of the episode (with the state of the random number generators) is restored on every reset
+            if self.state_directory is None:
+                self.state_directory = tempfile.mkdtemp(prefix="{}-".format(self.label))
+            self.saved_state = os.path.join(self.state_directory, "episode-start.state.xml")
+            self.connection.simulation.saveState(self.saved_state)
+
+    def restartSumo(self):
+        '''
+        Starts a new SUMO process after the previous one died
+        '''
+        try:
+            self.connection.close()
+        except (traci.exceptions.FatalTraCIError, OSError):
+            pass
+
+        self.connection = None
+        self.number_of_restarts += 1
+        self.startSumo()
+
+    def restartEpisode(self):
+        '''
+        Brings the running SUMO process back to the beginning of an episode
+        '''
+        if self.saved_state is not None:
+            self.connection.simulation.loadState(self.saved_state)
+        else:
+            # loading the next route file in the same process
+            self.connection.load(self.sumoArguments(self.route_files[self.next_route_file]))
+            self.saveEpisodeStart()
+
+        # subscriptions don't survive reloading the simulation
+        self.collector.subscribe()
+
+    def step(self, action):
+        '''
+        The possible action is to change the traffic light configuration.
+        '''
+
+        info = {}
+
+        try:
+            # the yellow phase of the current configuration runs first when the configuration changes
+            self.scheduler.request([action], self.collector.simulation_time)
+
+            vehicleThroughIntersection = self.simulateTraffic()
+
+            observation = self.observeLanes()
+
+            simulation_time = self.collector.simulation_time
+            done = simulation_time - self.episode_start_time >= self.episode_length or self.collector.min_expected_vehicles == 0
+        except (traci.exceptions.FatalTraCIError, OSError):
+            # SUMO crashed (the socket may fail first, with an OSError), the episode ends here and a new process is started
+            self.restartSumo()
+            info["sumo_restarted"] = True
+            return self.observeLanes(), 0, True, info
+
+        reward = self.calculateReward(vehicleThroughIntersection)
+
+        info["simulation_time"] = simulation_time
+        info["phase"] = self.collector.phase
+        info["vehicles_passed"] = vehicleThroughIntersection
+
+        return observation, reward, done, info
+
+    def seed(self, seed=None):
+        '''
+        The seed is used from the next episode, which starts from a freshly loaded simulation
+        '''
+        self.sumo_seed = seed
+        self.saved_state = None
+        return [seed]
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.seed(seed)
+
+        if self.connection is None:
+            self.startSumo()
+        else:
+            self.next_route_file = (self.next_route_file + 1) % len(self.route_files)
+            try:
+                self.restartEpisode()
+            except (traci.exceptions.FatalTraCIError, OSError):
+                self.restartSumo()
+
+        self.episode_start_time = self.collector.simulation_time
+
+        observation = self.observeLanes()
+
+        if self.fast_forward:
+            self.arrived_vehicles = self.collector.totalArrivedVehicles()
+
+        # the episode starts in the configuration of the phase running in the simulation
+        initial_configuration = self.topology.configurationOfPhase(self.collector.phase)
+        self.scheduler = PhaseScheduler(self.connection, [self.topology], [initial_configuration or 0], all_red_time=self.all_red_time)
+
+        return observation
+
+    def simulateTraffic(self):
+        '''
+        Runs SUMO for one decision interval, returns the number of vehicles which reached their destination
+        '''
+        if self.fast_forward:
+            return self.fastForwardTraffic()
+
+        vehicleThroughIntersection = 0
+        for _ in range(self.decision_interval):
+            self.connection.simulationStep()
+            self.collector.collectSimulation()
+            self.scheduler.update(self.collector.simulation_time)
+            vehicleThroughIntersection += self.collector.arrived_vehicles
+
+        return vehicleThroughIntersection
+
+    def fastForwardTraffic(self):
+        '''
+        Same as simulateTraffic, but sumo only stops at the end of the interval and when a yellow (or all red) phase ends
+        '''
+        decision_time = self.collector.simulation_time + self.decision_interval
+
+        while self.collector.simulation_time < decision_time:
+            self.connection.simulationStep(float(min(decision_time, self.scheduler.next_transition_time)))
+            self.collector.collectSimulation()
+            self.scheduler.update(self.collector.simulation_time)
+
+        arrived_vehicles = self.collector.totalArrivedVehicles()
+        vehicleThroughIntersection = arrived_vehicles - self.arrived_vehicles
+        self.arrived_vehicles = arrived_vehicles
+
+        return vehicleThroughIntersection
+
+    def observeLanes(self):
+        lane_features = self.collector.collect()
+        self.lanes = lane_features[0].copy()
+
+        return lane_features[self.observed_rows].ravel()
+
+    def calculateReward(self, numberOfVehiclePassed):
+
+        # vehicles which passed during the interval, minus the ones still waiting in the observed lanes
+        reward = numberOfVehiclePassed - self.lanes.sum() / len(self.lanes)
+
+        return reward
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+        self.saved_state = None
+        if self.state_directory is not None:
+            shutil.rmtree(self.state_directory, ignore_errors=True)
+            self.state_directory = None
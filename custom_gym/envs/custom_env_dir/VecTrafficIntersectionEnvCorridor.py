@@ -0,0 +1,78 @@
+import gym
+import gym.spaces
+import numpy
+
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from envs.custom_env_dir.TrafficIntersectionEnvCorridor import NUMBER_OF_COLUMNS, NUMBER_OF_ROWS, ONE_TRAINING_TIME, TrafficIntersectionEnvCorridor
+from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import NUMBER_OF_LANES_TO_OBSERVE, POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION
+
+'''
+The junctions of a TrafficIntersectionEnvCorridor seen as the envs of a VecEnv.
+
+Every junction is one env with the observation and the action of TrafficIntersectionEnvDoubleLane and
+its own reward, so stable baselines3 trains one policy shared by all the junctions, and the actions of
+all of them come from one batched forward pass. The junctions still interact through the vehicles they
+send to each other, and all their episodes end together.
+'''
+
+class VecTrafficIntersectionEnvCorridor(VecEnv):
+
+    def __init__(self, rows=NUMBER_OF_ROWS, columns=NUMBER_OF_COLUMNS, intersection_config=None, seed=None, episode_length=ONE_TRAINING_TIME):
+
+        self.corridor = TrafficIntersectionEnvCorridor(rows, columns, intersection_config, seed, episode_length)
+
+        action_space = gym.spaces.Discrete(POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION)
+        observation_space = gym.spaces.Box(low=0, high=1000, shape=(int(NUMBER_OF_LANES_TO_OBSERVE), ), dtype=numpy.float64)
+
+        super().__init__(self.corridor.number_of_junctions, observation_space, action_space)
+
+        self.actions = numpy.zeros(self.num_envs, dtype=numpy.int64)
+
+    def reset(self):
+        return self.corridor.reset()
+
+    def step_async(self, actions):
+        self.actions = numpy.asarray(actions, dtype=numpy.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+        done, _vehicles_left_network = self.corridor.advance(self.actions)
+
+        rewards = self.corridor.junction_rewards.copy()
+        dones = numpy.full(self.num_envs, done)
+        infos = [{"vehicles_passed": vehicles_passed} for vehicles_passed in self.corridor.vehicles_passed.tolist()]
+
+        if done:
+            terminal_observations = self.corridor.lanes.copy()
+            for i, info in enumerate(infos):
+                info["terminal_observation"] = terminal_observations[i]
+            self.corridor.reset()
+
+        return self.corridor.lanes.copy(), rewards, dones, infos
+
+    def seed(self, seed=None):
+        self.corridor.seed(seed)
+
+        return [seed for _ in range(self.num_envs)]
+
+    def close(self):
+        self.corridor.close()
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self.corridor, attr_name)
+        indices = self._get_indices(indices)
+
+        # per junction state is returned row by row
+        if isinstance(value, numpy.ndarray) and value.shape[:1] == (self.num_envs, ):
+            return [value[i] for i in indices]
+
+        return [value for _ in indices]
+
+    def set_attr(self, attr_name, value, indices=None):
+        raise NotImplementedError("The junctions share one corridor, {} can't be set on them".format(attr_name))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise NotImplementedError("The junctions are not separate gym environments, {} can't be called on them".format(method_name))
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,181 @@
+import gym
+import gym.spaces
+import numpy
+
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+
+from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import GREEN_PHASES, NUMBER_OF_LANES_TO_OBSERVE, OBSERVED_LANES, ONE_TRAINING_TIME, POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION, buildIntersectionModel
+
+'''
+Batched version of TrafficIntersectionEnvDoubleLane.
+
+The lane state of N independent intersections is kept in a single (N, 8) array and all of them
+are moved forward together with whole-array numpy operations, so one call to step() simulates
+N intersections. The dynamics and the rewards are the same as the ones of the scalar environment.
+Every intersection draws its random initial vehicle counts from its own generator, the same way as the
+scalar environment, so with the seed s intersection i starts its episodes from the same states as a
+TrafficIntersectionEnvDoubleLane seeded with s + i.
+'''
+
+class VecTrafficIntersectionEnvDoubleLane(VecEnv):
+
+    def __init__(self, num_envs, seed=None, intersection_config=None):
+
+        number_of_lanes = int(NUMBER_OF_LANES_TO_OBSERVE)
+
+        action_space = gym.spaces.Discrete(POSSIBLE_TRAFFIC_LIGHT_CONFIGURATION)
+        observation_space = gym.spaces.Box(low=0, high=1000, shape=(number_of_lanes, ), dtype=numpy.float64)
+
+        super().__init__(num_envs, observation_space, action_space)
+
+        self.observed_lanes = OBSERVED_LANES
+        self.green_phases = GREEN_PHASES
+
+        # discharge tables of the intersection, shared by all the intersections
+        self.model = buildIntersectionModel(intersection_config)
+
+        # state of all the intersections
+        self.lanes = numpy.zeros((num_envs, number_of_lanes))
+        self.remaining_time = numpy.zeros(num_envs)
+        self.collected_reward = numpy.full(num_envs, -1.0)
+        self.percentageOfVehiclePassingThroughTheIntersectionLastTime = numpy.zeros(num_envs)
+
+        self.actions = numpy.zeros(num_envs, dtype=numpy.int64)
+
+        # initial vehicle counts are drawn uniformly in [low, high], same as the scalar env
+        self.reset_low = numpy.floor(0.3 * self.model.lanes_capacity)
+        self.reset_span = numpy.floor(self.model.lanes_capacity) + 1 - self.reset_low
+        self.reset_high = self.reset_low + self.reset_span - 1
+
+        self.seed(seed)
+        self.reset()
+
+    def reset(self):
+        self.resetIntersections(numpy.ones(self.num_envs, dtype=bool))
+
+        return self.lanes.copy()
+
+    def resetIntersections(self, mask, draws=1):
+        '''
+        Resets the intersections selected by the boolean mask, the others are left untouched.
+        Each one draws its vehicle counts draws times from its generator, only the last draw is kept.
+        '''
+        for i in numpy.flatnonzero(mask):
+            lanes = self.lanes[i]
+            for _ in range(draws):
+                self.np_random[i].random(out=lanes)
+            lanes *= self.reset_span
+            lanes += self.reset_low
+            numpy.floor(lanes, out=lanes)
+            numpy.minimum(lanes, self.reset_high, out=lanes)
+
+        self.collected_reward[mask] = -1
+        self.remaining_time[mask] = ONE_TRAINING_TIME
+        self.percentageOfVehiclePassingThroughTheIntersectionLastTime[mask] = 0
+
+    def step_async(self, actions):
+        self.actions = numpy.asarray(actions, dtype=numpy.int64).reshape(self.num_envs)
+
+    def step_wait(self):
+
+        self.remaining_time -= self.model.min_green_time
+
+        vehicleThroughIntersection, vehicleRemaining = self.simulateTraffic(self.actions)
+
+        # same as the scalar env, the observation used for the reward is the one after the traffic is simulated
+        last_observation_leading_to_predicted_action = self.lanes.copy()
+
+        dones = (vehicleThroughIntersection == 0) | (self.remaining_time < 60)
+
+        rewards = self.calculateReward(vehicleThroughIntersection, vehicleRemaining, last_observation_leading_to_predicted_action)
+        self.collected_reward += rewards
+
+        infos = [{"vehicles_passed": vehicles_passed} for vehicles_passed in vehicleThroughIntersection.tolist()]
+        for i in numpy.flatnonzero(dones):
+            infos[i]["terminal_observation"] = last_observation_leading_to_predicted_action[i]
+
+        # finished intersections are reset right away, as the scalar env does (twice, so the random streams stay the same)
+        self.resetIntersections(dones, draws=2)
+
+        # using cumulative reward, same as the scalar env
+        return self.lanes.copy(), self.collected_reward.copy(), dones, infos
+
+    def simulateTraffic(self, actions):
+
+        # cumsum adds the lanes one after another like reduce does in the scalar env, so the totals are the same
+        totalVehicle = numpy.cumsum(self.lanes, axis=1)[:, -1]
+
+        # selecting whichever is the lowest either max possible to remove or maximum available to remove
+        actual_number_of_vehicle_removed_in_each_lane = self.model.discharge(self.lanes, actions)
+
+        # Removing the vehicle from the lanes
+        self.lanes -= actual_number_of_vehicle_removed_in_each_lane
+
+        vehicleThroughIntersection = numpy.cumsum(actual_number_of_vehicle_removed_in_each_lane, axis=1)[:, -1]
+
+        vehicleRemaining = totalVehicle - vehicleThroughIntersection
+
+        # adding vehicles to the lanes according to the probability
+        self.lanes += self.model.vehicles_added_in_each_lane
+
+        return vehicleThroughIntersection, vehicleRemaining
+
+    def calculateReward(self, numberOfVehiclePassed, numberOfVehicleRemaining, last_observation_leading_to_predicted_action):
+
+        percentage_of_vehicle_passing_through_the_intersection = numberOfVehiclePassed/(numberOfVehiclePassed + numberOfVehicleRemaining) * 100
+
+        min_observation = last_observation_leading_to_predicted_action.min(axis=1)
+        max_observation = last_observation_leading_to_predicted_action.max(axis=1)
+
+        reward = numpy.where(
+            numberOfVehiclePassed < min_observation,
+            (percentage_of_vehicle_passing_through_the_intersection - self.percentageOfVehiclePassingThroughTheIntersectionLastTime) * 100,
+            numpy.where(
+                numberOfVehiclePassed > max_observation,
+                1000,
+                (1 - (max_observation - numberOfVehiclePassed)/max_observation) * 200
+            )
+        )
+
+        self.percentageOfVehiclePassingThroughTheIntersectionLastTime = percentage_of_vehicle_passing_through_the_intersection
+
+        return reward
+
+    def seed(self, seed=None):
+        '''
+        Intersection i is seeded with seed + i, like the envs of a DummyVecEnv
+        '''
+        if seed is None:
+            self.np_random = [numpy.random.default_rng() for _ in range(self.num_envs)]
+            return [None for _ in range(self.num_envs)]
+
+        self.np_random = [numpy.random.default_rng(seed + i) for i in range(self.num_envs)]
+
+        return [seed + i for i in range(self.num_envs)]
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        value = getattr(self, attr_name)
+        indices = self._get_indices(indices)
+
+        # per intersection state is returned row by row
+        if isinstance(value, numpy.ndarray) and value.shape[:1] == (self.num_envs, ):
+            return [value[i] for i in indices]
+
+        return [value for _ in indices]
+
+    def set_attr(self, attr_name, value, indices=None):
+        current_value = getattr(self, attr_name)
+
+        if isinstance(current_value, numpy.ndarray) and current_value.shape[:1] == (self.num_envs, ):
+            current_value[list(self._get_indices(indices))] = value
+        else:
+            setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise NotImplementedError("The intersections are not separate gym environments, {} can't be called on them".format(method_name))
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -1,2 +1,19 @@
 from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import TrafficIntersectionEnvDoubleLane
 from envs.custom_env_dir.TrafficIntersectionEnvSingleLane import TrafficIntersectionEnvSingleLane
+from envs.custom_env_dir.TrafficIntersectionEnvSumo import TrafficIntersectionEnvSumo
+from envs.custom_env_dir.TrafficIntersectionEnvCorridor import TrafficIntersectionEnvCorridor
+
+# these need stable baselines3 (and torch), they are only imported when used so that the
+# SUMO controllers can use the rest of the package without loading them
+LAZY_IMPORTS = {
+    "VecTrafficIntersectionEnvDoubleLane": "envs.custom_env_dir.VecTrafficIntersectionEnvDoubleLane",
+    "SumoWorkerPool": "envs.custom_env_dir.SumoWorkerPool",
+    "SharedMemoryVecEnv": "envs.custom_env_dir.SharedMemoryVecEnv",
+    "VecTrafficIntersectionEnvCorridor": "envs.custom_env_dir.VecTrafficIntersectionEnvCorridor",
+}
+
+def __getattr__(name):
+    if name in LAZY_IMPORTS:
+        import importlib
+        return getattr(importlib.import_module(LAZY_IMPORTS[name]), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
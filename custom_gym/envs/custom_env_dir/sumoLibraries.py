@@ -0,0 +1,30 @@
+import os
+import sys
+
+'''
+Imports of the SUMO python libraries shared by the SUMO related modules.
+
+traci and sumolib are found through the SUMO_HOME environment variable, same as traffic.py.
+The analytic envs don't need SUMO, so when the libraries are missing they are set to None
+and the error is raised only when something using SUMO is created.
+'''
+
+# checking for sumo_home variable to find traci and sumolib
+if 'SUMO_HOME' in os.environ:
+    tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
+    if tools not in sys.path:
+        sys.path.append(tools)
+
+try:
+    import traci
+    import traci.constants as tc
+    import sumolib
+except ImportError:
+    traci = None
+    tc = None
+    sumolib = None
+
+
+def requireSumo():
+    if traci is None or sumolib is None:
+        raise ImportError("traci and sumolib couldn't be imported, please declare environment variable 'SUMO_HOME'")
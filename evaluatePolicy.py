@@ -0,0 +1,132 @@
+import json
+import time
+from pathlib import Path
+
+import numpy
+
+import gym
+
+'''
+Evaluation of a policy on many episodes at once.
+
+The episodes are run on a vectorized set of environments (the batched double lane env, or scalar envs
+in a DummyVecEnv or in worker processes), the actions of all the environments are predicted in one
+call and nothing is printed while the episodes run. Every environment runs a fixed share of the
+episodes from a fixed seed, so two evaluations of the same policy give the same results.
+For each episode are kept its return, its length, the vehicles which passed the intersection
+(throughput) and the mean and maximum number of vehicles in the observed lanes (queue).
+'''
+
+NUMBER_OF_EVALUATION_EPISODES = 64
+NUMBER_OF_EVALUATION_ENVS = 16
+EVALUATION_SEED = 1000
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def make_evaluation_env(env_id, num_envs, seed=EVALUATION_SEED, use_subprocesses=False, env_kwargs=None):
+    env_kwargs = env_kwargs or {}
+
+    if env_id == "TrafficIntersectionEnvDoubleLane-v1":
+        from custom_gym.envs.custom_env_dir import VecTrafficIntersectionEnvDoubleLane
+        return VecTrafficIntersectionEnvDoubleLane(num_envs, seed=seed, **env_kwargs)
+
+    from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv
+
+    vec_env_class = SubprocVecEnv if use_subprocesses else DummyVecEnv
+    env = vec_env_class([lambda: gym.make(env_id, **env_kwargs) for _ in range(num_envs)])
+    # env i is seeded with seed + i
+    env.seed(seed)
+
+    return env
+
+
+def evaluate_policy(model, env_id, number_of_episodes=NUMBER_OF_EVALUATION_EPISODES, num_envs=NUMBER_OF_EVALUATION_ENVS, seed=EVALUATION_SEED, use_subprocesses=False, env_kwargs=None):
+    '''
+    model: anything with the predict of stable baselines3, the deterministic actions are evaluated
+    env_kwargs: given to the envs, e.g. the intersection_config the model was trained on
+    Returns the aggregated metrics and the metrics of every episode
+    '''
+    num_envs = min(num_envs, number_of_episodes)
+    env = make_evaluation_env(env_id, num_envs, seed, use_subprocesses, env_kwargs)
+
+    # episodes run by each env
+    quotas = numpy.full(num_envs, number_of_episodes // num_envs)
+    quotas[:number_of_episodes % num_envs] += 1
+    completed = numpy.zeros(num_envs, dtype=numpy.int64)
+
+    episode_return = numpy.zeros(num_envs)
+    episode_length = numpy.zeros(num_envs, dtype=numpy.int64)
+    episode_throughput = numpy.zeros(num_envs)
+    episode_queue = numpy.zeros(num_envs)
+    episode_max_queue = numpy.zeros(num_envs)
+
+    episodes = {"return": [], "length": [], "throughput": [], "mean_queue": [], "max_queue": []}
+
+    start = time.perf_counter()
+    total_steps = 0
+    try:
+        observations = env.reset()
+
+        while (completed < quotas).any():
+            actions, _state = model.predict(observations, deterministic=True)
+
+            # vehicles waiting in the observed lanes when the decision is taken
+            queues = numpy.asarray(observations).reshape(num_envs, -1).sum(axis=1)
+
+            observations, rewards, dones, infos = env.step(actions)
+            total_steps += num_envs
+
+            episode_return += rewards
+            episode_length += 1
+            episode_throughput += [info.get("vehicles_passed", 0) for info in infos]
+            episode_queue += queues
+            numpy.maximum(episode_max_queue, queues, out=episode_max_queue)
+
+            # only the episodes within the share of each env are kept, the extra ones are dropped
+            for i in numpy.flatnonzero(dones & (completed < quotas)):
+                episodes["return"].append(float(episode_return[i]))
+                episodes["length"].append(int(episode_length[i]))
+                episodes["throughput"].append(float(episode_throughput[i]))
+                episodes["mean_queue"].append(float(episode_queue[i] / episode_length[i]))
+                episodes["max_queue"].append(float(episode_max_queue[i]))
+                completed[i] += 1
+
+            episode_return[dones] = 0
+            episode_length[dones] = 0
+            episode_throughput[dones] = 0
+            episode_queue[dones] = 0
+            episode_max_queue[dones] = 0
+    finally:
+        env.close()
+
+    seconds = time.perf_counter() - start
+
+    returns = numpy.array(episodes["return"])
+    lengths = numpy.array(episodes["length"])
+    metrics = {
+        "episodes": len(returns),
+        "mean_return": float(returns.mean()),
+        "std_return": float(returns.std()),
+        "mean_reward_per_step": float(returns.sum() / lengths.sum()),
+        "mean_length": float(lengths.mean()),
+        "mean_throughput": float(numpy.mean(episodes["throughput"])),
+        "mean_queue": float(numpy.mean(episodes["mean_queue"])),
+        "max_queue": float(numpy.max(episodes["max_queue"])),
+        "seconds": seconds,
+        "steps_per_second": total_steps / seconds,
+    }
+    for percentile, value in zip(PERCENTILES, numpy.percentile(returns, PERCENTILES)):
+        metrics["return_p{}".format(percentile)] = float(value)
+
+    return {"env_id": env_id, "seed": seed, "metrics": metrics, "episodes": episodes}
+
+
+def write_results(results, path, **details):
+    '''
+    Appends the results as one json line, details (e.g. the timesteps of the checkpoint) are added to it
+    '''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "a") as results_file:
+        results_file.write(json.dumps(dict(details, **results), separators=(",", ":")) + "\n")
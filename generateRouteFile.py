@@ -1,38 +1,39 @@
 from genericpath import exists
-import random
+import optparse
 import os
+import tempfile
 
 from pathlib import Path
 
-def generate_routefile(routefilePath: str=None) -> str:
+import numpy
 
-    if(routefilePath == None):
-        routefilePath = Path(os.getcwd() + "/sumo-files/").resolve()
+'''
+Generates random route files for the double lane intersection.
 
-        if not exists(routefilePath):
-            os.mkdir(routefilePath)
-        
-    routefile = Path(str(routefilePath) + "/random-route.rou.xml").resolve()
-
-    # random.seed(42)  # make tests reproducible
-    N = 5000  # number of time steps
-    # demand per second from different directions
-    
-    pWN = 1. / 21
-    pWE = 1. / 18
-    pWS = 1. / 9
-    pNE = 1. / 28
-    pNS = 1. / 15
-    pNW = 1. / 14
-    pES = 1. / 13
-    pEW = 1. / 10.5
-    pEN = 1. / 16
-    pSW = 1. / 22
-    pSN = 1. / 7
-    pSE = 1. / 11
-
-    with open(str(routefile), "w") as routes:
-        print("""<routes>
+Departures of all the routes are drawn at once with numpy (one bernoulli or poisson draw per second and route)
+from a seeded generator, and written through a buffered file in chunks of time, so horizons of millions
+of seconds don't need to be kept in memory. Demand can change over time with a demand profile,
+a function giving the demand multiplier for an array of times.
+'''
+
+# demand per second from different directions
+# (route, vehicle type, probability of a vehicle per second, color)
+ROUTES_DEMAND = [
+    ("left_up", "typeWN", 1. / 21, None),
+    ("left_right", "typeWE", 1. / 18, None),
+    ("left_down", "typeWS", 1. / 9, "1,0,0"),
+    ("up_right", "typeNE", 1. / 28, None),
+    ("up_down", "typeNS", 1. / 15, None),
+    ("up_left", "typeNW", 1. / 14, "1,0,0"),
+    ("right_down", "typeES", 1. / 13, None),
+    ("right_left", "typeEW", 1. / 10.5, None),
+    ("right_up", "typeEN", 1. / 16, "1,0,0"),
+    ("down_left", "typeWS", 1. / 22, None),
+    ("down_up", "typeWN", 1. / 7, None),
+    ("down_right", "typeWE", 1. / 11, "1,0,0"),
+]
+
+ROUTES_HEADER = """<routes>
         <vType id="typeWN" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
         <vType id="typeWE" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="3" maxSpeed="16.67" guiShape="passenger"/>
         <vType id="typeWS" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2" maxSpeed="16.67" guiShape="motorcycle"/>
@@ -43,9 +44,9 @@ def generate_routefile(routefilePath: str=None) -> str:
         <vType id="typeEW" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="3" maxSpeed="16.67" guiShape="truck"/>
         <vType id="typeEN" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
         <vType id="typeSW" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
-        <vType id="typeSN" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>   
+        <vType id="typeSN" accel="0.8" decel="4.5" sigma="0.5" length="5" minGap="2.5" maxSpeed="16.67" guiShape="passenger"/>
         <vType id="typeSE" accel="0.8" decel="4.5" sigma="0.5" length="7" minGap="3" maxSpeed="25" guiShape="bus"/>
-        
+
         <route id="left_up" edges="E9 E8" />
         <route id="left_right" edges="E9 E10" />
         <route id="left_down" edges="E9 E11" />
@@ -57,72 +58,132 @@ def generate_routefile(routefilePath: str=None) -> str:
         <route id="right_up" edges="-E10 E8" />
         <route id="down_left" edges="-E11 -E9" />
         <route id="down_up" edges="-E11 E8" />
-        <route id="down_right" edges="-E11 E10" />""", file=routes)
-        lastVeh = 0
+        <route id="down_right" edges="-E11 E10" />
+"""
+
+# route file written by the command line, the same file every run
+DEFAULT_ROUTEFILE_NAME = "random-route.rou.xml"
+
+DEFAULT_NUMBER_OF_TIMESTEPS = 5000    # seconds of departures of a route file
+
+CHUNK_IN_SECONDS = 100000    # seconds of departures drawn and written at once
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def constant_profile(times):
+    return numpy.ones(len(times))
+
+def rush_hour_profile(times, peaks=(8 * 3600, 17 * 3600), width=3600, peak_factor=3.0, day_length=24 * 3600):
+    '''
+    Demand multiplier of 1 outside rush hours rising to peak_factor at the peak times of every day,
+    each rush hour is a gaussian bump with the given width (in seconds)
+    '''
+    time_of_day = numpy.asarray(times) % day_length
+    multiplier = numpy.ones(len(time_of_day))
+    for peak in peaks:
+        # distance to the peak, wrapping around midnight
+        distance = numpy.abs(time_of_day - peak)
+        distance = numpy.minimum(distance, day_length - distance)
+        multiplier += (peak_factor - 1) * numpy.exp(-0.5 * (distance / width) ** 2)
+
+    return multiplier
+
+DEMAND_PROFILES = {
+    "constant": constant_profile,
+    "rush_hour": rush_hour_profile,
+}
+
+
+def vehicle_lines(departures, routes, first_vehicle_number):
+    '''
+    xml lines of the vehicles departing at the given times on the given routes (indices in ROUTES_DEMAND)
+    '''
+    lines = []
+    for vehNr, (depart, route) in enumerate(zip(departures.tolist(), routes.tolist()), start=first_vehicle_number):
+        route_id, vehicle_type, _, color = ROUTES_DEMAND[route]
+        if color is None:
+            lines.append('    <vehicle id="%s_%i" type="%s" route="%s" depart="%i" />\n' % (route_id, vehNr, vehicle_type, route_id, depart))
+        else:
+            lines.append('    <vehicle id="%s_%i" type="%s" route="%s" depart="%i" color="%s"/>\n' % (route_id, vehNr, vehicle_type, route_id, depart, color))
+
+    return lines
+
+
+def generate_routefile(routefilePath: str=None, seed: int=None, number_of_timesteps: int=DEFAULT_NUMBER_OF_TIMESTEPS, demand_profile="constant", distribution: str="bernoulli", routefile_name: str=None, probabilities=None) -> str:
+    '''
+    Writes a route file and returns its path.
+
+    probabilities: demand per second of each route of ROUTES_DEMAND, the default ones are used if not given
+    seed: seed of the numpy generator (or the generator itself, e.g. the np_random of an env), the same seed gives the same route file
+    demand_profile: name of one of DEMAND_PROFILES or a function of the times returning the demand multiplier
+    distribution: "bernoulli" for at most one vehicle per second and route, "poisson" for any number of them
+    routefile_name: name of the file inside routefilePath, a unique name is created if not given
+    so that parallel workers don't overwrite each other's files
+    '''
+
+    if(routefilePath == None):
+        routefilePath = Path(os.getcwd() + "/sumo-files/").resolve()
+
+        if not exists(routefilePath):
+            os.mkdir(routefilePath)
+
+    if routefile_name is None:
+        file_descriptor, routefile = tempfile.mkstemp(prefix="random-route-", suffix=".rou.xml", dir=str(routefilePath))
+        os.close(file_descriptor)
+        routefile = Path(routefile).resolve()
+    else:
+        routefile = Path(str(routefilePath) + "/" + routefile_name).resolve()
+
+    if isinstance(demand_profile, str):
+        demand_profile = DEMAND_PROFILES[demand_profile]
+
+    generator = numpy.random.default_rng(seed)
+    if probabilities is None:
+        probabilities = [probability for _, _, probability, _ in ROUTES_DEMAND]
+    probabilities = numpy.asarray(probabilities, dtype=numpy.float64)
+    if probabilities.shape != (len(ROUTES_DEMAND), ):
+        raise ValueError("{} probabilities given for {} routes".format(probabilities.size, len(ROUTES_DEMAND)))
+
+    with open(str(routefile), "w", buffering=WRITE_BUFFER_SIZE) as routes:
+        routes.write(ROUTES_HEADER)
+
         vehNr = 0
-        for i in range(N):
-            if random.uniform(0, 1) < pWN:
-                print('    <vehicle id="left_up_%i" type="typeWN" route="left_up" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pWE:
-                print('    <vehicle id="left_right_%i" type="typeWE" route="left_right" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pWS:
-                print('    <vehicle id="left_down_%i" type="typeWS" route="left_down" depart="%i" color="1,0,0"/>' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pNE:
-                print('    <vehicle id="up_right_%i" type="typeNE" route="up_right" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pNS:
-                print('    <vehicle id="up_down_%i" type="typeNS" route="up_down" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pNW:
-                print('    <vehicle id="up_left_%i" type="typeNW" route="up_left" depart="%i" color="1,0,0"/>' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pES:
-                print('    <vehicle id="right_down_%i" type="typeES" route="right_down" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pEW:
-                print('    <vehicle id="right_left_%i" type="typeEW" route="right_left" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pEN:
-                print('    <vehicle id="right_up_%i" type="typeEN" route="right_up" depart="%i" color="1,0,0"/>' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pSW:
-                print('    <vehicle id="down_left_%i" type="typeWS" route="down_left" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pSN:
-                print('    <vehicle id="down_up_%i" type="typeWN" route="down_up" depart="%i" />' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-            if random.uniform(0, 1) < pSE:
-                print('    <vehicle id="down_right_%i" type="typeWE" route="down_right" depart="%i" color="1,0,0"/>' % (
-                    vehNr, i), file=routes)
-                vehNr += 1
-                lastVeh = i
-        print("</routes>", file=routes)
+        for chunk_start in range(0, number_of_timesteps, CHUNK_IN_SECONDS):
+            times = numpy.arange(chunk_start, min(chunk_start + CHUNK_IN_SECONDS, number_of_timesteps))
+
+            # demand of every route at every second of the chunk, shape (seconds, routes)
+            demand = numpy.outer(demand_profile(times), probabilities)
+
+            if distribution == "bernoulli":
+                vehicles = (generator.random(demand.shape) < demand).astype(numpy.int64)
+            elif distribution == "poisson":
+                vehicles = generator.poisson(demand)
+            else:
+                raise ValueError("Unknown distribution {}".format(distribution))
+
+            # vehicles sorted by departure time then by route, as sumo expects sorted departures
+            second_indices, routes_indices = numpy.nonzero(vehicles)
+            repeats = vehicles[second_indices, routes_indices]
+            departures = numpy.repeat(times[second_indices], repeats)
+            vehicle_routes = numpy.repeat(routes_indices, repeats)
+
+            routes.writelines(vehicle_lines(departures, vehicle_routes, vehNr))
+            vehNr += len(departures)
+
+        routes.write("</routes>\n")
+
     return routefile
 
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--seed", type="int", default=None, help="seed of the random generator")
+    optParser.add_option("--timesteps", type="int", default=DEFAULT_NUMBER_OF_TIMESTEPS, help="number of seconds of departures")
+    optParser.add_option("--profile", default="constant", choices=list(DEMAND_PROFILES), help="demand profile")
+    optParser.add_option("--distribution", default="bernoulli", choices=["bernoulli", "poisson"], help="distribution of the departures")
+    optParser.add_option("--output", default=DEFAULT_ROUTEFILE_NAME, help="name of the route file in sumo-files, overwritten on every run")
+    options, args = optParser.parse_args()
+    return options
+
 if __name__=="__main__":
-    generate_routefile()
\ No newline at end of file
+    options = get_options()
+    print(generate_routefile(seed=options.seed, number_of_timesteps=options.timesteps, demand_profile=options.profile, distribution=options.distribution, routefile_name=options.output))
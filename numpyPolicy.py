@@ -0,0 +1,152 @@
+import optparse
+
+import numpy
+
+'''
+Forward pass of a trained stable baselines3 MlpPolicy with numpy only.
+
+Choosing a traffic light configuration only needs the deterministic action of the policy, which is a
+few matrix products through the policy network followed by an argmax over the action logits.
+The weights are taken from the torch policy once, after that no torch call is made and a whole batch
+of observations (for example of all the junctions due for a decision) is evaluated with one product per layer.
+
+The weights can be exported to a small .npz file (python numpyPolicy.py --model <model> --output <file>.npz),
+loading it needs neither torch nor stable baselines3, so a controller using it starts in milliseconds.
+The layers are computed in float32 like the torch policy, so the actions are the ones of
+model.predict(..., deterministic=True), the export checks it on random observations.
+'''
+
+ACTIVATIONS = {
+    "Tanh": numpy.tanh,
+    "ReLU": lambda x: numpy.maximum(x, 0),
+    "Identity": lambda x: x,
+}
+
+
+def linear_layers(state_dict, prefix):
+    '''
+    (weight, bias) of the linear layers of a torch Sequential saved under prefix, in order
+    '''
+    indices = sorted({int(key[len(prefix):].split(".")[0]) for key in state_dict if key.startswith(prefix) and key.endswith(".weight")})
+
+    return [(state_dict["{}{}.weight".format(prefix, index)], state_dict["{}{}.bias".format(prefix, index)]) for index in indices]
+
+
+class NumpyPolicy:
+
+    def __init__(self, hidden_layers, action_layer, activation="Tanh"):
+        '''
+        hidden_layers: (weight, bias) of the shared and policy layers, each followed by the activation
+        action_layer: (weight, bias) of the layer giving the action logits
+        '''
+        # stored transposed, so that a batch of observations is multiplied from the left
+        self.hidden_layers = [(numpy.ascontiguousarray(numpy.asarray(weight, dtype=numpy.float32).T), numpy.asarray(bias, dtype=numpy.float32)) for weight, bias in hidden_layers]
+        weight, bias = action_layer
+        self.action_layer = (numpy.ascontiguousarray(numpy.asarray(weight, dtype=numpy.float32).T), numpy.asarray(bias, dtype=numpy.float32))
+        self.activation = activation
+        self.activation_fn = ACTIVATIONS[activation]
+
+    @classmethod
+    def fromModel(cls, model):
+        '''
+        Takes the weights of the policy of a loaded stable baselines3 model (PPO or A2C with MlpPolicy)
+        '''
+        policy = model.policy
+        state_dict = {key: value.detach().cpu().numpy() for key, value in policy.state_dict().items()}
+
+        hidden_layers = linear_layers(state_dict, "mlp_extractor.shared_net.") + linear_layers(state_dict, "mlp_extractor.policy_net.")
+        action_layer = (state_dict["action_net.weight"], state_dict["action_net.bias"])
+
+        return cls(hidden_layers, action_layer, activation=policy.activation_fn.__name__)
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as exported:
+            number_of_hidden_layers = int(exported["number_of_hidden_layers"])
+            hidden_layers = [(exported["hidden_weight_{}".format(index)], exported["hidden_bias_{}".format(index)]) for index in range(number_of_hidden_layers)]
+            action_layer = (exported["action_weight"], exported["action_bias"])
+            activation = str(exported["activation"])
+
+        return cls(hidden_layers, action_layer, activation=activation)
+
+    def save(self, path):
+        '''
+        Weights are saved in the layout of torch (out_features, in_features)
+        '''
+        arrays = {
+            "number_of_hidden_layers": numpy.array(len(self.hidden_layers)),
+            "action_weight": self.action_layer[0].T,
+            "action_bias": self.action_layer[1],
+            "activation": numpy.array(self.activation),
+        }
+        for index, (weight, bias) in enumerate(self.hidden_layers):
+            arrays["hidden_weight_{}".format(index)] = weight.T
+            arrays["hidden_bias_{}".format(index)] = bias
+
+        with open(path, "wb") as exported:
+            numpy.savez(exported, **arrays)
+
+    @property
+    def observation_size(self):
+        if self.hidden_layers:
+            return self.hidden_layers[0][0].shape[0]
+        return self.action_layer[0].shape[0]
+
+    def actionLogits(self, observations):
+        features = numpy.asarray(observations, dtype=numpy.float32).reshape(-1, self.observation_size)
+        for weight, bias in self.hidden_layers:
+            features = self.activation_fn(features @ weight + bias)
+
+        weight, bias = self.action_layer
+        return features @ weight + bias
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        '''
+        Same interface as the predict of stable baselines3, only deterministic actions are supported.
+        A single observation gives a single action, a batch of observations gives a batch of actions.
+        '''
+        observation = numpy.asarray(observation)
+        actions = self.actionLogits(observation).argmax(axis=1)
+
+        if observation.ndim == 1:
+            return actions[0], state
+
+        return actions, state
+
+
+def export_model(model_path, output_path, number_of_checks=10000, seed=0):
+    '''
+    Exports the policy of a saved stable baselines3 model to output_path and returns the number of
+    random observations for which the numpy policy doesn't choose the action of model.predict
+    '''
+    from stable_baselines3 import PPO
+
+    model = PPO.load(model_path)
+    policy = NumpyPolicy.fromModel(model)
+    policy.save(output_path)
+
+    # observations drawn in the observation space, with the infinite bounds replaced by vehicle counts
+    observation_space = model.observation_space
+    low = numpy.nan_to_num(observation_space.low, neginf=0, posinf=0)
+    high = numpy.nan_to_num(observation_space.high, neginf=100, posinf=100)
+    observations = numpy.random.default_rng(seed).uniform(low, high, size=(number_of_checks, ) + observation_space.shape).astype(numpy.float32)
+
+    expected_actions, _ = model.predict(observations, deterministic=True)
+    actions, _ = NumpyPolicy.load(output_path).predict(observations)
+
+    return int((expected_actions != actions).sum())
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--model", help="path of the trained stable baselines3 model")
+    optParser.add_option("--output", help="path of the exported .npz file")
+    optParser.add_option("--checks", type="int", default=10000, help="random observations on which the exported policy is compared with the model")
+    options, args = optParser.parse_args()
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    mismatches = export_model(options.model, options.output, number_of_checks=options.checks)
+    print("exported to {}, {} of {} actions differ from model.predict".format(options.output, mismatches, options.checks))
@@ -0,0 +1,162 @@
+import optparse
+import os
+import threading
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy
+
+'''
+Serves the actions of one trained policy to several SUMO controllers.
+
+The policy is loaded once and converted to a numpy forward pass, then controllers connect through a
+unix socket and send the observations of their junctions due for a decision. All the requests waiting
+when the server wakes up are stacked into one matrix and evaluated with a single forward pass, then
+each controller gets back the actions of its own junctions.
+'''
+
+DEFAULT_ADDRESS = "/tmp/traffic-intersection-policy.sock"
+MAX_BATCH_WAIT_IN_SECONDS = 0.001   # time spent waiting for more requests before evaluating a batch
+
+
+class PolicyServer:
+
+    def __init__(self, policy, address=DEFAULT_ADDRESS):
+        '''
+        policy: anything with the predict of stable baselines3, a NumpyPolicy for the fastest answers
+        '''
+        self.policy = policy
+        self.address = address
+
+        if os.path.exists(address):
+            os.remove(address)
+        self.listener = Listener(address, family="AF_UNIX")
+
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        self.running = False
+
+    def acceptConnections(self):
+        while self.running:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                # listener closed
+                break
+            with self.connections_lock:
+                self.connections.append(connection)
+
+    def serveForever(self):
+        self.running = True
+        threading.Thread(target=self.acceptConnections, daemon=True).start()
+
+        try:
+            while self.running:
+                self.serveBatch(timeout=0.1)
+        finally:
+            self.close()
+
+    def serveBatch(self, timeout=None):
+        '''
+        Answers all the requests waiting (or arriving within MAX_BATCH_WAIT_IN_SECONDS) with one forward pass
+        '''
+        with self.connections_lock:
+            connections = list(self.connections)
+        if not connections:
+            wait([], timeout)
+            return 0
+
+        ready = wait(connections, timeout)
+        if not ready:
+            return 0
+
+        # giving the other controllers a chance to join the batch
+        ready = set(ready) | set(wait([connection for connection in connections if connection not in ready], MAX_BATCH_WAIT_IN_SECONDS))
+
+        requests = []
+        for connection in ready:
+            try:
+                observations = numpy.asarray(connection.recv(), dtype=numpy.float32)
+            except (EOFError, OSError):
+                self.dropConnection(connection)
+                continue
+            requests.append((connection, observations.reshape(-1, observations.shape[-1])))
+
+        if not requests:
+            return 0
+
+        batch = numpy.concatenate([observations for _, observations in requests])
+        actions, _ = self.policy.predict(batch, deterministic=True)
+
+        start = 0
+        for connection, observations in requests:
+            try:
+                connection.send(actions[start:start + len(observations)])
+            except (EOFError, OSError):
+                self.dropConnection(connection)
+            start += len(observations)
+
+        return len(batch)
+
+    def dropConnection(self, connection):
+        with self.connections_lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+        connection.close()
+
+    def close(self):
+        self.running = False
+        self.listener.close()
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class PolicyClient:
+    '''
+    Used by a controller in place of the model, predict has the same interface as the one of stable baselines3
+    '''
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.connection = Client(address, family="AF_UNIX")
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        '''
+        A single observation gives a single action, the observations of several junctions give their actions
+        '''
+        observation = numpy.asarray(observation, dtype=numpy.float32)
+        self.connection.send(observation)
+        actions = self.connection.recv()
+
+        if observation.ndim == 1:
+            return actions[0], state
+
+        return actions, state
+
+    def close(self):
+        self.connection.close()
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--model", help="path of the trained stable baselines3 model, or of its numpy export (.npz)")
+    optParser.add_option("--address", default=DEFAULT_ADDRESS, help="unix socket the controllers connect to")
+    options, args = optParser.parse_args()
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    from numpyPolicy import NumpyPolicy
+
+    if options.model.endswith(".npz"):
+        policy = NumpyPolicy.load(options.model)
+    else:
+        from stable_baselines3 import PPO
+
+        # torch is only used to read the weights, the answers are computed with numpy
+        policy = NumpyPolicy.fromModel(PPO.load(options.model))
+
+    PolicyServer(policy, options.address).serveForever()
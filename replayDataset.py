@@ -0,0 +1,75 @@
+from pathlib import Path
+
+import numpy
+
+from trajectoryStore import TrajectoryReader
+
+'''
+Replay dataset built from recorded trajectories, for pretraining policies offline.
+
+The transitions come from one or more trajectory stores (see trajectoryStore.py), e.g. the decisions
+recorded by traffic.py --record, whose observations are the vehicle counts of the incoming lanes of the
+junction at every decision interval. Iterating over the dataset streams shuffled minibatches of
+(observations, actions): a few chunks at a time are read from the memory maps, in a random order,
+and their transitions are shuffled together, so the dataset never has to fit in memory.
+Every iteration is a new epoch with a new order.
+'''
+
+BATCH_SIZE = 256
+CHUNKS_IN_MEMORY = 4
+
+
+class ReplayDataset:
+
+    def __init__(self, directories, batch_size=BATCH_SIZE, shuffle=True, chunks_in_memory=CHUNKS_IN_MEMORY, seed=None):
+        if isinstance(directories, (str, Path)):
+            directories = [directories]
+
+        self.readers = [TrajectoryReader(directory) for directory in directories]
+
+        observation_sizes = {tuple(reader.schema["columns"]["observation"][1]) for reader in self.readers}
+        if len(observation_sizes) > 1:
+            raise ValueError("The trajectories have observations of different sizes: {}".format(sorted(observation_sizes)))
+        self.observation_shape = observation_sizes.pop() if observation_sizes else None
+
+        # lanes of the observations and green phases of the actions, None if a store doesn't have them
+        self.lanes = self.sameOfAll("lanes")
+        self.green_phases = self.sameOfAll("green_phases")
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.chunks_in_memory = chunks_in_memory
+        self.rng = numpy.random.default_rng(seed)
+
+        # every chunk of every store
+        self.chunks = [(reader, chunk_index) for reader in self.readers for chunk_index in range(len(reader.chunks))]
+
+    def sameOfAll(self, name):
+        values = [getattr(reader, name) for reader in self.readers]
+        if any(value is None for value in values):
+            return None
+        if any(value != values[0] for value in values):
+            raise ValueError("The trajectories have different {}: {}".format(name.replace("_", " "), values))
+        return values[0] if values else None
+
+    def __len__(self):
+        return sum(len(reader) for reader in self.readers)
+
+    def chunkGroups(self, shuffle):
+        '''
+        Groups of chunks loaded and shuffled together
+        '''
+        order = self.rng.permutation(len(self.chunks)) if shuffle else numpy.arange(len(self.chunks))
+        for start in range(0, len(order), self.chunks_in_memory):
+            yield [self.chunks[i] for i in order[start:start + self.chunks_in_memory]]
+
+    def __iter__(self):
+        for group in self.chunkGroups(self.shuffle):
+            # only these chunks are read from the memory maps
+            observations = numpy.concatenate([reader.column(chunk_index, "observation") for reader, chunk_index in group])
+            actions = numpy.concatenate([reader.column(chunk_index, "action") for reader, chunk_index in group])
+
+            order = self.rng.permutation(len(actions)) if self.shuffle else numpy.arange(len(actions))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                yield observations[batch], actions[batch]
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+
+from pathlib import Path
+
+from generateRouteFile import DEFAULT_NUMBER_OF_TIMESTEPS, DEMAND_PROFILES, ROUTES_DEMAND, generate_routefile
+
+'''
+Content addressed cache of generated route files.
+
+A route file only depends on the demand of the routes, the horizon, the seed, the demand profile and
+the distribution of the departures, so their hash is used as the name of the file in the cache directory.
+Only the named demand profiles of generateRouteFile.DEMAND_PROFILES can be cached, a function can't be
+told apart from another one by its name.
+A hit returns the cached file without generating anything, the least recently used files are removed
+when the cache grows over its maximum size.
+'''
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
+
+ROUTE_CACHE_DIRECTORY = ROOT / "sumo-files" / "route-cache"
+MAX_CACHE_SIZE_IN_BYTES = 1 << 30   # 1 GiB
+CACHED_ROUTEFILE_SUFFIX = ".rou.xml"
+
+
+def routefile_key(probabilities, number_of_timesteps, seed, demand_profile, distribution) -> str:
+    '''
+    Hash of everything the generated route file depends on
+    '''
+    if not isinstance(demand_profile, str) or demand_profile not in DEMAND_PROFILES:
+        raise ValueError("Only the demand profiles {} can be cached, got {!r}, generate_routefile takes other ones without caching".format(sorted(DEMAND_PROFILES), demand_profile))
+
+    parameters = {
+        "probabilities": [float(probability) for probability in probabilities],
+        "number_of_timesteps": int(number_of_timesteps),
+        "seed": int(seed),
+        "demand_profile": demand_profile,
+        "distribution": distribution,
+    }
+
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+def cached_routefile(seed: int, number_of_timesteps: int=DEFAULT_NUMBER_OF_TIMESTEPS, demand_profile="constant", distribution: str="bernoulli", probabilities=None, cacheDirectory=None, max_cache_size: int=MAX_CACHE_SIZE_IN_BYTES) -> Path:
+    '''
+    Returns the path of the route file for the given demand, generating it only if it isn't cached yet.
+    A seed is required, without it the route file isn't reproducible and can't be cached.
+    demand_profile: name of one of generateRouteFile.DEMAND_PROFILES
+    '''
+    if seed is None:
+        raise ValueError("Route files can only be cached for a given seed")
+
+    cacheDirectory = Path(cacheDirectory or ROUTE_CACHE_DIRECTORY)
+    cacheDirectory.mkdir(parents=True, exist_ok=True)
+
+    if probabilities is None:
+        probabilities = [probability for _, _, probability, _ in ROUTES_DEMAND]
+
+    routefile = cacheDirectory / (routefile_key(probabilities, number_of_timesteps, seed, demand_profile, distribution) + CACHED_ROUTEFILE_SUFFIX)
+
+    if routefile.exists():
+        try:
+            # marking the file as recently used
+            os.utime(routefile)
+            return routefile
+        except FileNotFoundError:
+            # evicted by another worker in the meantime, generated again below
+            pass
+
+    # generated under a unique name and moved in place, so parallel workers never see a half written file
+    generated_routefile = generate_routefile(routefilePath=cacheDirectory, seed=seed, number_of_timesteps=number_of_timesteps, demand_profile=demand_profile, distribution=distribution, probabilities=probabilities)
+    os.replace(generated_routefile, routefile)
+
+    evict_routefiles(cacheDirectory, max_cache_size, keep=routefile)
+
+    return routefile
+
+
+def evict_routefiles(cacheDirectory, max_cache_size: int=MAX_CACHE_SIZE_IN_BYTES, keep=None):
+    '''
+    Removes the least recently used route files until the cache is smaller than max_cache_size
+    '''
+    cached_routefiles = []
+    for routefile in Path(cacheDirectory).glob("*" + CACHED_ROUTEFILE_SUFFIX):
+        # temporary files of the generation in progress are not part of the cache
+        if routefile.name.startswith("random-route-"):
+            continue
+        try:
+            stat = routefile.stat()
+        except FileNotFoundError:
+            # removed by another worker
+            continue
+        cached_routefiles.append((stat.st_mtime, stat.st_size, routefile))
+
+    cache_size = sum(size for _, size, _ in cached_routefiles)
+
+    for _, size, routefile in sorted(cached_routefiles, key=lambda cached_routefile: cached_routefile[0]):
+        if cache_size <= max_cache_size:
+            break
+        if keep is not None and routefile == Path(keep):
+            continue
+        try:
+            routefile.unlink()
+        except FileNotFoundError:
+            pass
+        cache_size -= size
@@ -0,0 +1,289 @@
+import csv
+import optparse
+from pathlib import Path
+from xml.etree.ElementTree import iterparse
+
+import numpy
+
+'''
+Streaming readers of the SUMO outputs (tripinfo, summary and queue) of the runs of traffic.py.
+
+The outputs are read with iterparse and every element is cleared once read, so whatever the size of the
+file only one chunk of rows is in memory. The rows come as chunks of fixed schema numpy columns
+(see SCHEMAS), read_columns concatenates them when the whole output fits in memory.
+Aggregation is done on the fly: the rows are summed per time bin and per group (the junction of the lane
+for the queue output) and every bin is handed out as soon as the output is past it. The outputs are
+written in time order, so only the current bins are kept in memory, however long the simulation.
+'''
+
+CHUNK_SIZE = 65536
+BIN_SECONDS = 300
+
+# kind: (tag of a row, time column, [(column, dtype, attribute)]), the queue rows take their time from the enclosing data element
+SCHEMAS = {
+    "tripinfo": ("tripinfo", "arrival", [
+        ("id", object, "id"),
+        ("depart", numpy.float64, "depart"),
+        ("arrival", numpy.float64, "arrival"),
+        ("duration", numpy.float64, "duration"),
+        ("route_length", numpy.float64, "routeLength"),
+        ("waiting_time", numpy.float64, "waitingTime"),
+        ("waiting_count", numpy.int64, "waitingCount"),
+        ("time_loss", numpy.float64, "timeLoss"),
+        ("depart_delay", numpy.float64, "departDelay"),
+    ]),
+    "summary": ("step", "time", [
+        ("time", numpy.float64, "time"),
+        ("loaded", numpy.int64, "loaded"),
+        ("inserted", numpy.int64, "inserted"),
+        ("running", numpy.int64, "running"),
+        ("waiting", numpy.int64, "waiting"),
+        ("ended", numpy.int64, "ended"),
+        ("arrived", numpy.int64, "arrived"),
+        ("halting", numpy.int64, "halting"),
+        ("mean_waiting_time", numpy.float64, "meanWaitingTime"),
+        ("mean_travel_time", numpy.float64, "meanTravelTime"),
+        ("mean_speed", numpy.float64, "meanSpeed"),
+    ]),
+    "queue": ("lane", "time", [
+        ("time", numpy.float64, None),
+        ("lane", object, "id"),
+        ("queueing_time", numpy.float64, "queueing_time"),
+        ("queueing_length", numpy.float64, "queueing_length"),
+    ]),
+}
+
+# values summed (and their maximum kept) by the aggregation of each kind
+AGGREGATED_COLUMNS = {
+    "tripinfo": ["duration", "waiting_time", "time_loss", "depart_delay"],
+    "summary": ["running", "halting", "mean_waiting_time", "mean_speed"],
+    "queue": ["queueing_time", "queueing_length"],
+}
+
+
+def empty_chunk(kind, chunk_size):
+    _tag, _time_column, columns = SCHEMAS[kind]
+    return {name: numpy.empty(chunk_size, dtype=dtype) for name, dtype, _attribute in columns}
+
+
+def iter_chunks(path, kind, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the rows of a SUMO output as dicts of numpy columns of at most chunk_size rows
+    '''
+    tag, _time_column, columns = SCHEMAS[kind]
+    numeric_columns = [(name, dtype, attribute) for name, dtype, attribute in columns if dtype is not object and attribute is not None]
+    text_columns = [(name, attribute) for name, dtype, attribute in columns if dtype is object]
+
+    chunk = empty_chunk(kind, chunk_size)
+    rows = 0
+    root = None
+    data_time = numpy.nan
+
+    for event, element in iterparse(str(path), events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            elif element.tag == "data":
+                # time of the lanes of the queue output
+                data_time = float(element.get("timestep", "nan"))
+            continue
+
+        if element.tag != tag:
+            continue
+
+        for name, dtype, attribute in numeric_columns:
+            chunk[name][rows] = float(element.get(attribute, -1))
+        for name, attribute in text_columns:
+            chunk[name][rows] = element.get(attribute)
+        if kind == "queue":
+            chunk["time"][rows] = data_time
+        rows += 1
+        element.clear()
+
+        if rows == chunk_size:
+            yield chunk
+            chunk = empty_chunk(kind, chunk_size)
+            rows = 0
+            # the cleared elements are still children of the root, they are dropped too
+            root.clear()
+
+    if rows:
+        yield {name: column[:rows] for name, column in chunk.items()}
+
+
+def read_columns(path, kind):
+    '''
+    All the rows of the output in memory, as a dict of numpy columns
+    '''
+    chunks = list(iter_chunks(path, kind))
+    if not chunks:
+        return {name: column[:0] for name, column in empty_chunk(kind, 0).items()}
+
+    return {name: numpy.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def read_dataframe(path, kind):
+    import pandas
+
+    return pandas.DataFrame(read_columns(path, kind))
+
+
+def lane_junctions(net_file):
+    '''
+    Junction each lane of the network leads to, read in a streaming way too
+    '''
+    junctions = {}
+    edge_junction = None
+
+    for event, element in iterparse(str(net_file), events=("start", "end")):
+        if element.tag == "edge" and event == "start":
+            # internal edges (inside the junctions) have no destination
+            edge_junction = element.get("to")
+        elif element.tag == "lane" and event == "start" and edge_junction is not None:
+            junctions[element.get("id")] = edge_junction
+        elif event == "end" and element.tag in ("edge", "junction", "connection", "tlLogic"):
+            element.clear()
+
+    return junctions
+
+
+class BinnedAggregate:
+
+    def __init__(self, columns, bin_seconds=BIN_SECONDS):
+        '''
+        Count, sum and maximum of the columns per (time bin, group)
+        '''
+        self.columns = list(columns)
+        self.bin_seconds = bin_seconds
+        # (bin, group): [count, sums, maxima]
+        self.bins = {}
+
+    def add(self, times, groups, values):
+        '''
+        Adds a chunk of rows, returns the rows of the bins the stream is past, as columns
+        '''
+        if len(times) == 0:
+            return self.emit(-numpy.inf)
+
+        bins = numpy.floor(times / self.bin_seconds).astype(numpy.int64)
+        values = numpy.column_stack([values[column] for column in self.columns]).astype(numpy.float64)
+
+        # rows are grouped by (bin, group), then summed in one pass
+        unique_keys, inverse = self._index(list(zip(bins.tolist(), groups)))
+        counts = numpy.bincount(inverse, minlength=len(unique_keys))
+        sums = numpy.zeros((len(unique_keys), len(self.columns)))
+        numpy.add.at(sums, inverse, values)
+        maxima = numpy.full((len(unique_keys), len(self.columns)), -numpy.inf)
+        numpy.maximum.at(maxima, inverse, values)
+
+        for i, key in enumerate(unique_keys):
+            if key in self.bins:
+                accumulated = self.bins[key]
+                accumulated[0] += counts[i]
+                accumulated[1] += sums[i]
+                numpy.maximum(accumulated[2], maxima[i], out=accumulated[2])
+            else:
+                self.bins[key] = [int(counts[i]), sums[i], maxima[i]]
+
+        # the outputs are in time order, the bins before the last one of the chunk are complete
+        return self.emit(int(bins.max()))
+
+    @staticmethod
+    def _index(keys):
+        index = {}
+        inverse = numpy.array([index.setdefault(key, len(index)) for key in keys], dtype=numpy.int64)
+        return list(index), inverse
+
+    def emit(self, before_bin):
+        '''
+        Removes and returns the bins before before_bin
+        '''
+        finished = sorted(key for key in self.bins if key[0] < before_bin)
+
+        table = {"bin_start": [], "group": [], "count": []}
+        for column in self.columns:
+            table["mean_" + column] = []
+            table["max_" + column] = []
+
+        for key in finished:
+            count, sums, maxima = self.bins.pop(key)
+            table["bin_start"].append(key[0] * self.bin_seconds)
+            table["group"].append(key[1])
+            table["count"].append(count)
+            for i, column in enumerate(self.columns):
+                table["mean_" + column].append(sums[i] / count)
+                table["max_" + column].append(maxima[i])
+
+        return {name: numpy.array(values, dtype=object if name == "group" else None) for name, values in table.items()}
+
+    def finish(self):
+        return self.emit(numpy.inf)
+
+
+def iter_aggregates(path, kind, bin_seconds=BIN_SECONDS, lane_junction=None, chunk_size=CHUNK_SIZE):
+    '''
+    Yields tables of finished (time bin, group) aggregates while the output is read.
+    The queue output is grouped by the junction of the lanes (lane_junction, see lane_junctions) or by lane,
+    the other outputs have a single group.
+    '''
+    _tag, time_column, _columns = SCHEMAS[kind]
+    aggregate = BinnedAggregate(AGGREGATED_COLUMNS[kind], bin_seconds)
+
+    for chunk in iter_chunks(path, kind, chunk_size):
+        times = chunk[time_column]
+        if kind == "queue":
+            groups = [lane_junction.get(lane, lane) for lane in chunk["lane"]] if lane_junction is not None else chunk["lane"].tolist()
+        else:
+            groups = ["all"] * len(times)
+
+        # trips which never arrived (written with --tripinfo-output.write-unfinished) have a negative arrival
+        if kind == "tripinfo":
+            arrived = times >= 0
+            times = times[arrived]
+            groups = [group for group, keep in zip(groups, arrived) if keep]
+            chunk = {name: column[arrived] for name, column in chunk.items()}
+
+        table = aggregate.add(times, groups, chunk)
+        if len(table["count"]):
+            yield table
+
+    table = aggregate.finish()
+    if len(table["count"]):
+        yield table
+
+
+def write_aggregates(tables, path):
+    '''
+    Writes the tables of iter_aggregates to a csv file as they come
+    '''
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(path, "w", newline="") as csv_file:
+        writer = None
+        for table in tables:
+            if writer is None:
+                writer = csv.writer(csv_file)
+                writer.writerow(list(table))
+            writer.writerows(zip(*table.values()))
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--input", help="SUMO output file (tripinfo, summary or queue output)")
+    optParser.add_option("--kind", default="tripinfo", help="kind of output: tripinfo, summary or queue")
+    optParser.add_option("--output", default="aggregates.csv", help="csv file of the aggregates")
+    optParser.add_option("--bin-seconds", type="float", default=BIN_SECONDS, help="length of the time bins")
+    optParser.add_option("--net", default=None, help="network of the run, the queue output is aggregated per junction with it (per lane otherwise)")
+    options, args = optParser.parse_args()
+    if options.input is None or options.kind not in SCHEMAS:
+        optParser.error("--input and --kind (one of {}) are required".format(", ".join(SCHEMAS)))
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    lane_junction = lane_junctions(options.net) if options.net is not None else None
+    write_aggregates(iter_aggregates(options.input, options.kind, options.bin_seconds, lane_junction), options.output)
+
+    print("aggregates written to {}".format(options.output))
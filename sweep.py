@@ -0,0 +1,325 @@
+import json
+import math
+import multiprocessing
+import optparse
+import os
+import sqlite3
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+'''
+Hyperparameter sweeps of the PPO training.
+
+A search space (json) gives how to draw the PPO parameters (learning_rate, n_steps, ...), the intersection
+parameters of the env (min_green_time, lanes_capacity, ...) and the training length:
+
+    {
+        "ppo": {"learning_rate": {"log_uniform": [1e-5, 1e-3]}, "n_steps": {"choice": [64, 128, 256]}},
+        "env": {"min_green_time": {"int_uniform": [30, 90]}},
+        "training": {"evaluation_interval": {"choice": [5000, 10000]}}
+    }
+
+Every trial is trained in a process of a local pool, each process pinned to its own core (and torch to
+one thread), so the trials don't compete for the cores. A trial is evaluated every evaluation_interval
+timesteps on seeded episodes (see evaluatePolicy.py), rounded up to whole rollouts (n_steps timesteps of
+every env) since learn() only stops between rollouts. It is pruned when its reward is below the median
+of the rewards the other trials had after a comparable training: their last evaluation within the
+evaluation_interval of the sweep before the timesteps of the trial.
+The parameters, the intermediate rewards and the result of every trial are kept in a SQLite file,
+which the worker processes read and write directly.
+'''
+
+ENV_ID = "TrafficIntersectionEnvDoubleLane-v1"
+NUMBER_OF_INTERSECTIONS = 64        # intersections of the batched double lane env, one env otherwise
+TOTAL_TIMESTEPS = 100000
+EVALUATION_INTERVAL = 10000
+EVALUATION_EPISODES = 32
+EVALUATION_SEED = 1000
+
+# a trial is only pruned after this many evaluations, and when this many other trials were evaluated after a comparable training
+PRUNING_WARMUP_EVALUATIONS = 2
+PRUNING_MIN_TRIALS = 4
+
+# thread pools of numpy and torch, one thread in the workers
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+STORE_PATH = Path(str(ROOT) + "/sweeps/sweeps.sqlite").resolve()
+
+DEFAULT_SEARCH_SPACE = {
+    "ppo": {
+        "learning_rate": {"log_uniform": [1e-5, 1e-3]},
+        # per env, a rollout of the batched env is 64 times longer
+        "n_steps": {"choice": [64, 128, 256]},
+        "batch_size": {"choice": [32, 64, 128]},
+        "gamma": {"uniform": [0.9, 0.999]},
+        "ent_coef": {"log_uniform": [1e-4, 1e-1]},
+    },
+    "env": {
+        "min_green_time": {"choice": [30, 45, 60, 90]},
+    },
+    "training": {},
+}
+
+
+def sample_value(distribution, rng):
+    '''
+    distribution: {"choice": [values]}, {"uniform": [low, high]}, {"log_uniform": [low, high]} or {"int_uniform": [low, high]}
+    '''
+    (kind, values), = distribution.items()
+
+    if kind == "choice":
+        return values[int(rng.integers(len(values)))]
+    if kind == "uniform":
+        return float(rng.uniform(*values))
+    if kind == "log_uniform":
+        return float(math.exp(rng.uniform(math.log(values[0]), math.log(values[1]))))
+    if kind == "int_uniform":
+        return int(rng.integers(values[0], values[1] + 1))
+
+    raise ValueError("Unknown distribution {}, expected choice, uniform, log_uniform or int_uniform".format(kind))
+
+
+def sample_parameters(search_space, rng):
+    return {section: {name: sample_value(distribution, rng) for name, distribution in search_space.get(section, {}).items()} for section in ("ppo", "env", "training")}
+
+
+class SweepStore:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        # several worker processes write at the same time, they wait for each other instead of failing
+        self.connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS trials (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sweep TEXT NOT NULL,
+                parameters TEXT NOT NULL,
+                state TEXT NOT NULL,
+                cpu INTEGER,
+                reward REAL,
+                timesteps INTEGER,
+                error TEXT,
+                created REAL,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS evaluations (
+                trial INTEGER NOT NULL REFERENCES trials(id),
+                step INTEGER NOT NULL,
+                timesteps INTEGER NOT NULL,
+                reward REAL NOT NULL,
+                metrics TEXT,
+                PRIMARY KEY (trial, step)
+            );
+            CREATE INDEX IF NOT EXISTS evaluations_by_step ON evaluations(step);
+            CREATE INDEX IF NOT EXISTS evaluations_by_timesteps ON evaluations(timesteps);
+        """)
+
+    def createTrial(self, sweep, parameters):
+        cursor = self.connection.execute("INSERT INTO trials (sweep, parameters, state, created) VALUES (?, ?, 'pending', ?)", (sweep, json.dumps(parameters), time.time()))
+        return cursor.lastrowid
+
+    def startTrial(self, trial, cpu):
+        self.connection.execute("UPDATE trials SET state = 'running', cpu = ? WHERE id = ?", (cpu, trial))
+
+    def report(self, trial, step, timesteps, reward, metrics=None):
+        self.connection.execute("INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?)", (trial, step, timesteps, reward, json.dumps(metrics)))
+
+    def shouldPrune(self, sweep, trial, step, timesteps, reward, window, warmup_evaluations=PRUNING_WARMUP_EVALUATIONS, min_trials=PRUNING_MIN_TRIALS):
+        '''
+        True if the reward is below the median of the other trials of the sweep evaluated after a comparable training,
+        the last evaluation of each of them in (timesteps - window, timesteps]
+        '''
+        if step + 1 < warmup_evaluations:
+            return False
+
+        # the reward of the row of MAX(timesteps) is the one returned by sqlite
+        rows = self.connection.execute(
+            "SELECT evaluations.reward, MAX(evaluations.timesteps) FROM evaluations JOIN trials ON trials.id = evaluations.trial "
+            "WHERE trials.sweep = ? AND evaluations.trial != ? AND evaluations.timesteps > ? AND evaluations.timesteps <= ? GROUP BY evaluations.trial",
+            (sweep, trial, timesteps - window, timesteps)).fetchall()
+        if len(rows) < min_trials:
+            return False
+
+        return reward < float(numpy.median([row[0] for row in rows]))
+
+    def finishTrial(self, trial, state, reward=None, timesteps=None, error=None):
+        self.connection.execute("UPDATE trials SET state = ?, reward = ?, timesteps = ?, error = ?, finished = ? WHERE id = ?", (state, reward, timesteps, error, time.time(), trial))
+
+    def bestTrials(self, sweep, number_of_trials=5):
+        rows = self.connection.execute(
+            "SELECT id, parameters, state, reward, timesteps FROM trials WHERE sweep = ? AND state = 'complete' ORDER BY reward DESC LIMIT ?",
+            (sweep, number_of_trials)).fetchall()
+        return [{"trial": row[0], "parameters": json.loads(row[1]), "state": row[2], "reward": row[3], "timesteps": row[4]} for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+# core the process of the pool is pinned to
+worker_cpu = None
+
+def pin_worker(cpus):
+    '''
+    Initializer of the processes of the pool, each one takes a core of its own
+    '''
+    global worker_cpu
+    worker_cpu = cpus.get()
+
+    if worker_cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {worker_cpu})
+
+
+def make_training_env(env_id, num_envs, seed, env_kwargs):
+    if env_id == "TrafficIntersectionEnvDoubleLane-v1":
+        from custom_gym.envs.custom_env_dir import VecTrafficIntersectionEnvDoubleLane
+        return VecTrafficIntersectionEnvDoubleLane(num_envs, seed=seed, **env_kwargs)
+
+    import gym
+    from stable_baselines3.common.vec_env import DummyVecEnv
+
+    env = DummyVecEnv([lambda: gym.make(env_id, **env_kwargs)])
+    env.seed(seed)
+    return env
+
+
+def run_trial(store_path, sweep, trial, parameters, env_id, total_timesteps, evaluation_interval, seed):
+    '''
+    Trains and evaluates one trial in a process of the pool, returns its state and last reward
+    evaluation_interval: the one of the sweep, the width of the windows of comparable trainings when pruning
+    '''
+    store = SweepStore(store_path)
+    store.startTrial(trial, worker_cpu)
+
+    training = dict({"total_timesteps": total_timesteps, "evaluation_interval": evaluation_interval}, **parameters["training"])
+    env_kwargs = {"intersection_config": parameters["env"]} if parameters["env"] else {}
+
+    state, reward, timesteps = "complete", None, 0
+    training_env = None
+    try:
+        # torch is only imported in the workers, after they limited their threads
+        import torch
+        from stable_baselines3 import PPO
+
+        import custom_gym.envs  # registers the environments
+        from evaluatePolicy import evaluate_policy
+
+        torch.set_num_threads(1)
+
+        training_env = make_training_env(env_id, NUMBER_OF_INTERSECTIONS, seed, env_kwargs)
+        model = PPO("MlpPolicy", training_env, seed=seed, verbose=0, **parameters["ppo"])
+
+        # whole rollouts between two evaluations, every trial is evaluated after about the same timesteps whatever its n_steps
+        rollout_size = model.n_steps * training_env.num_envs
+        trial_interval = -(-training["evaluation_interval"] // rollout_size) * rollout_size
+
+        step = 0
+        while model.num_timesteps < training["total_timesteps"]:
+            model.learn(total_timesteps=trial_interval, reset_num_timesteps=False)
+            timesteps = model.num_timesteps
+
+            evaluation = evaluate_policy(model, env_id, number_of_episodes=EVALUATION_EPISODES, seed=EVALUATION_SEED, env_kwargs=env_kwargs)
+            reward = evaluation["metrics"]["mean_return"]
+            store.report(trial, step, timesteps, reward, evaluation["metrics"])
+
+            if store.shouldPrune(sweep, trial, step, timesteps, reward, max(evaluation_interval, trial_interval)):
+                state = "pruned"
+                break
+            step += 1
+
+        store.finishTrial(trial, state, reward, timesteps)
+    except Exception:
+        state = "failed"
+        store.finishTrial(trial, state, reward, timesteps, error=traceback.format_exc())
+    finally:
+        if training_env is not None:
+            training_env.close()
+        store.close()
+
+    return trial, state, reward
+
+
+def run_sweep(sweep, search_space, number_of_trials, number_of_workers=None, store_path=STORE_PATH, env_id=ENV_ID, total_timesteps=TOTAL_TIMESTEPS, evaluation_interval=EVALUATION_INTERVAL, seed=0):
+    '''
+    Draws number_of_trials parameter sets and trains them on a pool of number_of_workers processes (one per core by default)
+    '''
+    rng = numpy.random.default_rng(seed)
+
+    store = SweepStore(store_path)
+    trials = []
+    for _ in range(number_of_trials):
+        parameters = sample_parameters(search_space, rng)
+        trials.append((store.createTrial(sweep, parameters), parameters))
+
+    # the cores the workers are pinned to, the ones this process may run on
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    number_of_workers = min(number_of_workers or len(cpus), number_of_trials)
+
+    context = multiprocessing.get_context("spawn")
+    cpu_queue = context.Queue()
+    for worker in range(number_of_workers):
+        cpu_queue.put(cpus[worker % len(cpus)] if number_of_workers <= len(cpus) else None)
+
+    # the trials already run in parallel, torch and numpy must not start a thread per core each. The spawned workers
+    # import numpy before their initializer runs, the limits must be in the environment they inherit
+    thread_variables = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: "1" for name in THREAD_VARIABLES})
+    try:
+        with ProcessPoolExecutor(number_of_workers, mp_context=context, initializer=pin_worker, initargs=(cpu_queue, )) as pool:
+            futures = [pool.submit(run_trial, str(store_path), sweep, trial, parameters, env_id, total_timesteps, evaluation_interval, seed + trial) for trial, parameters in trials]
+
+            for future in as_completed(futures):
+                trial, state, reward = future.result()
+                print("trial {}: {}, reward {}".format(trial, state, reward))
+    finally:
+        for name, value in thread_variables.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    best_trials = store.bestTrials(sweep)
+    store.close()
+
+    return best_trials
+
+
+def get_options():
+    optParser = optparse.OptionParser()
+    optParser.add_option("--name", default="sweep", help="name of the sweep, its trials are stored under it")
+    optParser.add_option("--space", default=None, help="json file of the search space, the default one if not given")
+    optParser.add_option("--trials", type="int", default=16, help="number of trials")
+    optParser.add_option("--workers", type="int", default=None, help="processes training trials at the same time, one per core if not given")
+    optParser.add_option("--store", default=str(STORE_PATH), help="SQLite file of the results")
+    optParser.add_option("--env-id", default=ENV_ID, help="environment the trials are trained on")
+    optParser.add_option("--timesteps", type="int", default=TOTAL_TIMESTEPS, help="timesteps of a trial which isn't pruned")
+    optParser.add_option("--evaluation-interval", type="int", default=EVALUATION_INTERVAL, help="timesteps between two evaluations of a trial")
+    optParser.add_option("--seed", type="int", default=0, help="seed of the parameter sampling and of the trials")
+    options, args = optParser.parse_args()
+    return options
+
+if __name__ == "__main__":
+    options = get_options()
+
+    search_space = DEFAULT_SEARCH_SPACE
+    if options.space is not None:
+        with open(options.space) as space_file:
+            search_space = json.load(space_file)
+
+    best_trials = run_sweep(options.name, search_space, options.trials, options.workers, options.store, options.env_id, options.timesteps, options.evaluation_interval, options.seed)
+
+    for best_trial in best_trials:
+        print("trial {}: reward {} after {} timesteps, {}".format(best_trial["trial"], best_trial["reward"], best_trial["timesteps"], json.dumps(best_trial["parameters"])))
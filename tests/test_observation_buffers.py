@@ -0,0 +1,86 @@
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]  # traffic-intersection-rl-environment-cli root directory
+if str(ROOT / "custom_gym") not in sys.path:
+    sys.path.append(str(ROOT / "custom_gym"))
+
+from envs.custom_env_dir.TrafficIntersectionEnvDoubleLane import TrafficIntersectionEnvDoubleLane
+from envs.custom_env_dir.TrafficIntersectionEnvSingleLane import TrafficIntersectionEnvSingleLane
+
+'''
+The analytic envs hand out their observations from two buffers used in turn, an observation must not
+change during the next step, including the steps ending an episode (which reset the env).
+Once their buffers exist, stepping them allocates no array and keeps no new block.
+'''
+
+NUMBER_OF_STEPS = 2000
+WARMUP_STEPS = 200
+
+# tracemalloc domain numpy registers the buffers of its arrays with
+NUMPY_TRACEMALLOC_DOMAIN = 389047
+ENV_DIRECTORY = ROOT / "custom_gym" / "envs" / "custom_env_dir"
+
+
+@pytest.mark.parametrize("env_class", [TrafficIntersectionEnvDoubleLane, TrafficIntersectionEnvSingleLane])
+def test_observation_unchanged_by_next_step(env_class):
+    env = env_class(seed=0)
+    actions = numpy.random.default_rng(1).integers(env.action_space.n, size=NUMBER_OF_STEPS)
+
+    observation = env.reset()
+    expected = observation.copy()
+    number_of_dones = 0
+
+    for action in actions:
+        next_observation, _reward, done, _info = env.step(action)
+
+        assert numpy.array_equal(observation, expected)
+        assert numpy.array_equal(next_observation, env.lanes)
+
+        number_of_dones += done
+        observation, expected = next_observation, next_observation.copy()
+
+    # the terminal steps are covered too
+    assert number_of_dones > 0
+
+
+@pytest.mark.parametrize("env_class", [TrafficIntersectionEnvDoubleLane, TrafficIntersectionEnvSingleLane])
+def test_observation_read_only(env_class):
+    env = env_class(seed=0)
+    observation, _reward, _done, _info = env.step(0)
+
+    with pytest.raises(ValueError):
+        observation[0] = -1
+
+
+@pytest.mark.parametrize("env_class", [TrafficIntersectionEnvDoubleLane, TrafficIntersectionEnvSingleLane])
+def test_no_allocation_in_steady_state(env_class):
+    env = env_class(seed=0)
+    actions = numpy.random.default_rng(1).integers(env.action_space.n, size=WARMUP_STEPS + NUMBER_OF_STEPS).tolist()
+
+    env.reset()
+    for action in actions[:WARMUP_STEPS]:
+        env.step(action)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for action in actions[WARMUP_STEPS:]:
+            env.step(action)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # the buffers of numpy arrays are traced in their own domain, and the blocks allocated by the env modules with their file
+    array_filter = [tracemalloc.DomainFilter(True, NUMPY_TRACEMALLOC_DOMAIN)]
+    env_filter = [tracemalloc.Filter(True, str(ENV_DIRECTORY / "*.py"))]
+
+    new_arrays = [stat for stat in after.filter_traces(array_filter).compare_to(before.filter_traces(array_filter), "traceback") if stat.count_diff > 0]
+    new_blocks = [stat for stat in after.filter_traces(env_filter).compare_to(before.filter_traces(env_filter), "lineno") if stat.count_diff > 0]
+
+    assert new_arrays == []
+    assert new_blocks == []
@@ -6,7 +6,7 @@ import os
 import sys
 import optparse
 from pathlib import Path
-from generateRouteFile import generate_routefile
+from routeFileCache import cached_routefile
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
@@ -16,7 +16,11 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 TRAFFIC_INTERSECTION_TYPE="double"
 TOTAL_TIMESTEPS=50000
+DECISION_INTERVAL=30        # seconds of simulation between two traffic light decisions
+INITIAL_CONFIGURATION=2     # traffic light configuration set at the start of the simulation
+ALL_RED_TIME=0              # seconds of all red between the yellow phase and the next green, no all red if 0
 GENERATE_CUSTOM_ROUTE=True
+ROUTE_SEED=42               # same seed gives the same route file, which is then taken from the route file cache
 time_to_teleport="-1"       # setting time to teleport to -1 will make vehicles not teleport
 
 # sumo stuffs
@@ -36,99 +40,149 @@ import sumo
 import sumo.tools.sumolib as sumolib
 from sumo.tools import traci
 
-import gym
-from custom_gym.envs.custom_env_dir import TrafficIntersectionEnvSingleLane
-from stable_baselines3 import PPO
-
-env = gym.make('TrafficIntersectionEnv{}Lane-v1'.format(TRAFFIC_INTERSECTION_TYPE.capitalize()))
+from custom_gym.envs.custom_env_dir.LaneObservationCollector import LaneObservationCollector
+from custom_gym.envs.custom_env_dir.PhaseScheduler import PhaseScheduler
+from custom_gym.envs.custom_env_dir.IntersectionTopology import IntersectionTopology
+from custom_gym.envs.custom_env_dir.TrafficIntersectionEnvSumo import JUNCTION_WITH_LIGHTS
 
 # Here, formatting is done as to create error if wrong model is selected
 # as, there won't be same model trained at exact same time and upto same timesteps
 models = Path(str(ROOT) + "/models").resolve()
-model = PPO.load(Path(str(models) + "/2022-10-08 14:55:51.640820-TrafficIntersection-{}Lane-ppo-150000".format(TRAFFIC_INTERSECTION_TYPE.capitalize())).resolve())
-
-def run():
-    step = 0
-    
-    while step < TOTAL_TIMESTEPS:
-
-        if step == 0: # setting the initial configuration
-            if TRAFFIC_INTERSECTION_TYPE == "single":
-                traci.trafficlight.setPhase("J9", 4)
-            elif TRAFFIC_INTERSECTION_TYPE == "double":
-                traci.trafficlight.setPhase("J11", 4)
-
-            traci.simulationStep()
-            step += 1
-            continue
-
-        # Selection traffic configuration once every 30 timesteps
-        
-        simulation_time = traci.simulation.getTime()
-        if  simulation_time % 30 == 0:
-
-            if TRAFFIC_INTERSECTION_TYPE == "single":
-
-                junction_with_lights = "J9"
-
-                current_state = traci.trafficlight.getPhase(junction_with_lights)
-
-                # starting from left-upper lane, skipping one lane
-                vehicle_count_lane_0 = traci.lane.getLastStepVehicleNumber("-E8_0")
-                vehicle_count_lane_1 = traci.lane.getLastStepVehicleNumber("-E9_0")
-                vehicle_count_lane_2 = traci.lane.getLastStepVehicleNumber("-E10_0")
-                vehicle_count_lane_3 = traci.lane.getLastStepVehicleNumber("E7_0")
-
-                lanes_observation = [vehicle_count_lane_0, vehicle_count_lane_1, vehicle_count_lane_2, vehicle_count_lane_3]
-
-                lane_to_have_next_green_light, _state = model.predict(lanes_observation, deterministic=True)
-
-                if lane_to_have_next_green_light == current_state / 2: # dividing by 2 as green phases is 0, 2, 4, 6
-                    traci.trafficlight.setPhase(junction_with_lights, current_state)
-                else:
-                    # Trying to turn on yellow light
-                    # This doesn't work for now, we need to figure out a way to send the next traffic light configuration after turning on yellow light
-                    traci.trafficlight.setPhase(junction_with_lights, current_state + 1)
-
-                    # changing phase here makes the above phase change obsolete
-                    traci.trafficlight.setPhase(junction_with_lights, lane_to_have_next_green_light * 2)
-
-            elif TRAFFIC_INTERSECTION_TYPE == "double":
-
-                junction_with_lights = "J11"
-
-                current_state = traci.trafficlight.getPhase(junction_with_lights)
-
-                vehicle_count_lane_0 = traci.lane.getLastStepVehicleNumber("E9_0")
-                vehicle_count_lane_1 = traci.lane.getLastStepVehicleNumber("E9_1")
-                vehicle_count_lane_2 = traci.lane.getLastStepVehicleNumber("E8_0")
-                vehicle_count_lane_3 = traci.lane.getLastStepVehicleNumber("E8_1")
-                vehicle_count_lane_4 = traci.lane.getLastStepVehicleNumber("-E10_0")
-                vehicle_count_lane_5 = traci.lane.getLastStepVehicleNumber("-E10_1")
-                vehicle_count_lane_6 = traci.lane.getLastStepVehicleNumber("-E11_0")
-                vehicle_count_lane_7 = traci.lane.getLastStepVehicleNumber("-E11_1")
-
-                lanes_observation = [vehicle_count_lane_0, vehicle_count_lane_1, vehicle_count_lane_2, vehicle_count_lane_3, vehicle_count_lane_4, vehicle_count_lane_5, vehicle_count_lane_6, vehicle_count_lane_7]
-                next_configuration, _state = model.predict(lanes_observation, deterministic=True)
-
-                if next_configuration == current_state / 2: # dividing by 2 as green phases is 0, 2, 4, 6
-                    traci.trafficlight.setPhase(junction_with_lights, current_state)
-                    
-                else:
-                    # Trying to turn on yellow light
-                    # This doesn't work for now, we need to figure out a way to send the next traffic light configuration after turning on yellow light
-                    traci.trafficlight.setPhase(junction_with_lights, current_state + 1)
-
-                    # changing phase here makes the above phase change obsolete
-                    traci.trafficlight.setPhase(junction_with_lights, next_configuration * 2)
-
-        traci.simulationStep()
-        step += 1
+model_path = Path(str(models) + "/2022-10-08 14:55:51.640820-TrafficIntersection-{}Lane-ppo-150000".format(TRAFFIC_INTERSECTION_TYPE.capitalize())).resolve()
+
+def load_model(policy_server=None, numpy_policy=None):
+    '''
+    The policy is loaded in this process, or the one already loaded by a policy server (see policyServer.py) is used.
+    A numpy export of the policy (see numpyPolicy.py) is loaded without importing torch and stable baselines3.
+    '''
+    if policy_server is not None:
+        from policyServer import PolicyClient
+        return PolicyClient(policy_server)
+
+    if numpy_policy is not None:
+        from numpyPolicy import NumpyPolicy
+        return NumpyPolicy.load(numpy_policy)
+
+    from stable_baselines3 import PPO
+    return PPO.load(model_path)
+
+def record_decision(writer, decision, arrived_vehicles, lanes_observation, done=False):
+    '''
+    Appends a decision to the trajectory store once its interval is over, with the reward of TrafficIntersectionEnvSumo:
+    the vehicles which arrived during the interval minus the mean vehicle count of the lanes at its end
+    '''
+    observation, configuration, phase, simulation_time, arrived_vehicles_before = decision
+    reward = (arrived_vehicles - arrived_vehicles_before) - lanes_observation.sum() / len(lanes_observation)
+
+    writer.append(
+        observation=[observation],
+        action=[int(configuration)],
+        reward=[reward],
+        done=[done],
+        phase=[phase],
+        simulation_time=[simulation_time],
+        env=[0],
+        episode=[0],
+    )
+
+def run(model, fast_forward=False, decision_interval=DECISION_INTERVAL, writer=None, connection=traci, topology=None, total_timesteps=TOTAL_TIMESTEPS, until_empty=False):
+    '''
+    Controls the junction until total_timesteps seconds are simulated, or with until_empty until every vehicle
+    of the routes arrived (when sooner).
+    With fast_forward, sumo is advanced to the next decision time in one call instead of one call per second,
+    only stopping earlier when a yellow (or all red) phase ends.
+    With a writer (trajectoryStore.TrajectoryWriter), every decision is recorded.
+    connection is the traci connection of the simulation (the default one of traci if not given) and topology
+    the one of its controlled junction (the junction of net_file if not given), see batchScenarios.py.
+    '''
+
+    # incoming lanes and green/yellow phases of the junction, read from the network (or its cached index)
+    if topology is None:
+        topology = IntersectionTopology.load(net_file, JUNCTION_WITH_LIGHTS[TRAFFIC_INTERSECTION_TYPE])
+    junction_with_lights = topology.junction_id
+
+    # the lanes, the traffic light and the simulation time are subscribed once, their values come with every simulation step
+    collector = LaneObservationCollector(connection, topology.incoming_lanes, junction_with_lights)
+
+    # setting the initial configuration
+    scheduler = PhaseScheduler(connection, [topology], [INITIAL_CONFIGURATION % topology.number_of_configurations], all_red_time=ALL_RED_TIME)
+
+    connection.simulationStep()
+    collector.collectSimulation()
+
+    # the last decision is recorded at the next one, when the reward of its interval is known
+    decision = None
+
+    while collector.simulation_time < total_timesteps:
+
+        simulation_time = collector.simulation_time
+
+        # finishing the yellow (and all red) phases which are over
+        scheduler.update(simulation_time)
+
+        # Selection traffic configuration once every decision interval
+        if  simulation_time % decision_interval == 0:
+
+            # vehicle count of the incoming lanes
+            lanes_observation = collector.collect()[0].copy()
+
+            next_configuration, _state = model.predict(lanes_observation, deterministic=True)
+
+            if writer is not None:
+                arrived_vehicles = collector.totalArrivedVehicles()
+                if decision is not None:
+                    record_decision(writer, decision, arrived_vehicles, lanes_observation)
+                decision = (lanes_observation, next_configuration, collector.phase, simulation_time, arrived_vehicles)
+
+            # if the configuration changes, the yellow phase of the current one runs first and the scheduler sets the new green when it is over
+            scheduler.request([next_configuration], simulation_time)
+
+        if fast_forward:
+            next_decision_time = (simulation_time // decision_interval + 1) * decision_interval
+            connection.simulationStep(float(min(next_decision_time, scheduler.next_transition_time)))
+        else:
+            connection.simulationStep()
+
+        collector.collectSimulation()
+
+        # subscribed with the simulation time, no extra traci call
+        if until_empty and collector.min_expected_vehicles == 0:
+            break
+
+    if decision is not None:
+        record_decision(writer, decision, collector.totalArrivedVehicles(), collector.collect()[0].copy(), done=True)
+
+def sumo_outputs(directory):
+    '''
+    Options of the sumo outputs written to directory, read with sumoOutputs.py
+    '''
+    if directory is None:
+        return []
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    return ["--tripinfo-output", str(directory / "tripinfo.xml"),
+        "--tripinfo-output.write-unfinished", "true",
+        "--summary-output", str(directory / "summary.xml"),
+        "--queue-output", str(directory / "queue.xml")]
 
 def get_options():
     optParser = optparse.OptionParser()
     optParser.add_option("--nogui", action="store_true",
                          default=False, help="run the commandline version of sumo")
+    optParser.add_option("--fast-forward", action="store_true",
+                         default=False, help="advance sumo by a whole decision interval per traci call")
+    optParser.add_option("--decision-interval", type="int",
+                         default=DECISION_INTERVAL, help="seconds of simulation between two decisions")
+    optParser.add_option("--policy-server", default=None,
+                         help="unix socket of a running policy server, the policy is loaded in this process if not given")
+    optParser.add_option("--numpy-policy", default=None,
+                         help="numpy export (.npz) of the policy, used instead of the stable baselines3 model")
+    optParser.add_option("--record", default=None,
+                         help="directory of a trajectory store (see trajectoryStore.py) to which every decision is appended")
+    optParser.add_option("--outputs", default=None,
+                         help="directory to which sumo writes its tripinfo, summary and queue outputs (see sumoOutputs.py)")
     options, args = optParser.parse_args()
     return options
 
@@ -144,9 +198,9 @@ if __name__ == "__main__":
     else:
         sumoBinary = sumolib.checkBinary('sumo-gui')
 
-    # Generating custom route file
+    # Generating custom route file, or reusing the cached one generated for the same demand
     if GENERATE_CUSTOM_ROUTE and TRAFFIC_INTERSECTION_TYPE == "double":
-        route_file = generate_routefile(routefilePath=route_file.parents[0])
+        route_file = cached_routefile(seed=ROUTE_SEED)
 
     # this is the normal way of using traci. sumo is started as a
     # subprocess and then the python script connects and runs
@@ -155,8 +209,20 @@ if __name__ == "__main__":
     "-n", net_file,
     "-r", route_file,
     '--start', '--quit-on-end',
-    "--time-to-teleport", time_to_teleport])
+    "--time-to-teleport", time_to_teleport] + sumo_outputs(options.outputs))
+
+    model = load_model(options.policy_server, options.numpy_policy)
+
+    writer = None
+    if options.record is not None:
+        from trajectoryStore import TrajectoryWriter
+        # one vehicle count per incoming lane of the junction
+        topology = IntersectionTopology.load(net_file, JUNCTION_WITH_LIGHTS[TRAFFIC_INTERSECTION_TYPE])
+        writer = TrajectoryWriter(options.record, len(topology.incoming_lanes), lanes=topology.incoming_lanes, green_phases=topology.green_phases)
+
+    run(model, fast_forward=options.fast_forward, decision_interval=options.decision_interval, writer=writer)
 
-    run()
+    traci.close()
 
-    traci.close()
\ No newline at end of file
+    if writer is not None:
+        writer.close()
\ No newline at end of file
@@ -12,7 +12,13 @@ from pathlib import Path
 
 from datetime import date, datetime
 
-from custom_gym.envs.custom_env_dir import TafficIntersectionEnvDoubleLane
+from custom_gym.envs.custom_env_dir import SharedMemoryVecEnv, SumoWorkerPool, VecTrafficIntersectionEnvDoubleLane
+from trainingProfiler import TimedVecEnv, TimingCallback, instrumentEnv
+from checkpointManager import CheckpointManager
+from evaluatePolicy import evaluate_policy, write_results
+from trajectoryRecorder import RecordingVecEnv
+from replayDataset import ReplayDataset
+from behaviorCloning import pretrain_policy
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # traffic-intersection-rl-environment-cli root directory
@@ -26,41 +32,112 @@ startTime = datetime.now()
 TRAFFIC_INTERSECTION_TYPE = "double"
 TIMESTEP=10000
 
+# number of intersections simulated together by the batched environment (only for the double lane intersection)
+USE_BATCHED_ENV = True
+NUMBER_OF_INTERSECTIONS = 64
+
+# the other analytic envs (the single lane one) are stepped by worker processes over shared memory, NUMBER_OF_INTERSECTIONS of them
+USE_SHARED_MEMORY_ENV = True
+
+# steps of each env per rollout (2048 by default in PPO). With many envs one default rollout is far longer than TIMESTEP,
+# it is shortened so that a rollout of all the envs is about TIMESTEP timesteps and every learn() call trains TIMESTEP timesteps
+MAX_ROLLOUT_STEPS = 2048
+
+# training on real SUMO simulations, one headless SUMO per worker process
+USE_SUMO = False
+NUMBER_OF_SUMO_WORKERS = os.cpu_count()
+
+# times of the env, of the policy and of the gradient updates are always logged to tensorboard (timing/),
+# the training is also run under cProfile with a dump for every TIMESTEP timesteps if enabled
+PROFILE_TRAINING = False
+
+# the checkpoints are written in the background, only the last ones and the best ones (by evaluation reward) are kept
+TOTAL_TRAINING_TIMESTEPS = 29 * TIMESTEP
+KEEP_LAST_CHECKPOINTS = 3
+KEEP_BEST_CHECKPOINTS = 3
+
+# the policy is evaluated on seeded episodes run on vectorized envs, the results of each evaluation are one line of evaluations.jsonl
+EVALUATION_EPISODES = 64
+FINAL_EVALUATION_EPISODES = 256
+EVALUATION_SEED = 1000
+
+# every transition of the training is appended to a trajectory store (see trajectoryStore.py) for offline analysis and behavior cloning
+RECORD_TRAJECTORIES = False
+
+# a new model is first trained by behavior cloning on recorded trajectories (e.g. recorded with traffic.py --record), none if empty
+PRETRAIN_TRAJECTORIES = []
+PRETRAIN_EPOCHS = 5
+
 # stable_baselines3.common.env_checker.check_env(env, warn=True, skip_render_check=True)
 
 modelType = "ppo"
 models_path = Path(str(ROOT) + "/models").resolve()
 log_path = Path(str(ROOT) + "/logs/{}-trafficintersection-{}-lane-{}/".format(modelType, TRAFFIC_INTERSECTION_TYPE, "CLI")).resolve()
-
-env = gym.make('TrafficIntersectionEnv{}Lane-v1'.format(TRAFFIC_INTERSECTION_TYPE.capitalize()))
-
-model = PPO("MlpPolicy", env, verbose=1, tensorboard_log=log_path)
-
-# model = PPO.load("./models/2022-08-12 22:31:22.631886-TrafficIntersection-DoubleLane-{}-1140000".format(modelType), env=env)
-
-count = 1
-while count < 30:
-    model.learn(total_timesteps=TIMESTEP, reset_num_timesteps=False, tb_log_name=f"{modelType}-{startTime}")
-    save_dir = Path(str(models_path) + "/{}-TrafficIntersection-{}Lane-{}-{}".format(startTime, TRAFFIC_INTERSECTION_TYPE.capitalize(), modelType, count * TIMESTEP))
-    model.save(str(save_dir))
-    count += 1
-
-for i in range(3):
-    obs = env.reset()
-    
-    net_reward = 0
-    total_steps = 0
-    done = False
-
-    while not done:
-        action, _state = model.predict(obs, deterministic=True)
-        obs, reward, done, info = env.step(action)
-        net_reward += reward
-        total_steps += 1
-        print("Observation: {} \n Action: {} \nReward: {} \nDone: {}".format(obs,action,reward,done))
-        print("\n")
-    
-    Mean_Reward = net_reward/total_steps
-
-    print("Mean Reward: {}".format(Mean_Reward))
-    print("\n")
\ No newline at end of file
+checkpoint_path = Path(str(models_path) + "/{}-TrafficIntersection-{}Lane-checkpoints".format(modelType, TRAFFIC_INTERSECTION_TYPE.capitalize())).resolve()
+evaluation_results_path = Path(str(checkpoint_path) + "/evaluations.jsonl")
+trajectory_path = Path(str(models_path) + "/{}-TrafficIntersection-{}Lane-trajectories".format(modelType, TRAFFIC_INTERSECTION_TYPE.capitalize())).resolve()
+profile_path = Path(str(ROOT) + "/profiles/{}-trafficintersection-{}-lane-{}/".format(modelType, TRAFFIC_INTERSECTION_TYPE, startTime)).resolve()
+
+env_id = 'TrafficIntersectionEnv{}Lane-v1'.format(TRAFFIC_INTERSECTION_TYPE.capitalize())
+env = gym.make(env_id)
+
+# the policy is evaluated on the env it is trained on, the SUMO envs run in their own processes like the workers
+if USE_SUMO:
+    evaluation_options = {"env_id": "TrafficIntersectionEnvSumo-v1", "num_envs": NUMBER_OF_SUMO_WORKERS, "use_subprocesses": True, "env_kwargs": {"intersection_type": TRAFFIC_INTERSECTION_TYPE}}
+else:
+    evaluation_options = {"env_id": env_id}
+
+# all the intersections are stepped in one call by the batched environment
+if USE_SUMO:
+    training_env = SumoWorkerPool(NUMBER_OF_SUMO_WORKERS, intersection_type=TRAFFIC_INTERSECTION_TYPE, wrapper_class=instrumentEnv)
+elif USE_BATCHED_ENV and TRAFFIC_INTERSECTION_TYPE == "double":
+    training_env = VecTrafficIntersectionEnvDoubleLane(NUMBER_OF_INTERSECTIONS)
+elif USE_SHARED_MEMORY_ENV:
+    training_env = SharedMemoryVecEnv(NUMBER_OF_INTERSECTIONS, env_class=type(env.unwrapped))
+else:
+    training_env = DummyVecEnv([lambda: env])
+
+# lanes of the observations and green phases of the actions, the recorded trajectories are checked against them
+if USE_SUMO:
+    observed_lanes, green_phases = training_env.get_attr("observed_lanes", 0)[0], training_env.get_attr("green_phases", 0)[0]
+else:
+    observed_lanes, green_phases = env.unwrapped.observed_lanes, env.unwrapped.green_phases
+
+# rounded up, learn() stops at the first rollout reaching TIMESTEP
+rollout_steps = min(MAX_ROLLOUT_STEPS, -(-TIMESTEP // training_env.num_envs))
+
+training_env = TimedVecEnv(training_env, workers_instrumented=USE_SUMO)
+if RECORD_TRAJECTORIES:
+    training_env = RecordingVecEnv(training_env, trajectory_path, lanes=observed_lanes, green_phases=green_phases)
+timing_callback = TimingCallback(profile_directory=profile_path if PROFILE_TRAINING else None, profile_interval=TIMESTEP)
+
+checkpoints = CheckpointManager(checkpoint_path, keep_last=KEEP_LAST_CHECKPOINTS, keep_best=KEEP_BEST_CHECKPOINTS)
+
+# resuming from the last checkpoint, with the optimizer state and the timestep counter
+latest_checkpoint = checkpoints.latest()
+if latest_checkpoint is not None:
+    print("Resuming from {}".format(latest_checkpoint))
+    model = PPO.load(latest_checkpoint, env=training_env, tensorboard_log=log_path)
+else:
+    model = PPO("MlpPolicy", training_env, n_steps=rollout_steps, verbose=1, tensorboard_log=log_path)
+
+    if PRETRAIN_TRAJECTORIES:
+        pretrain_policy(model, ReplayDataset(PRETRAIN_TRAJECTORIES), epochs=PRETRAIN_EPOCHS, lanes=observed_lanes, green_phases=green_phases)
+
+while model.num_timesteps < TOTAL_TRAINING_TIMESTEPS:
+    model.learn(total_timesteps=TIMESTEP, reset_num_timesteps=False, tb_log_name=f"{modelType}-{startTime}", callback=timing_callback)
+
+    # every checkpoint is evaluated on the same seeded episodes
+    evaluation = evaluate_policy(model, number_of_episodes=EVALUATION_EPISODES, seed=EVALUATION_SEED, **evaluation_options)
+    write_results(evaluation, evaluation_results_path, timesteps=model.num_timesteps)
+    checkpoints.save(model, reward=evaluation["metrics"]["mean_return"])
+
+checkpoints.close()
+# the recorded transitions still in memory are written when the env is closed
+training_env.close()
+
+evaluation = evaluate_policy(model, number_of_episodes=FINAL_EVALUATION_EPISODES, seed=EVALUATION_SEED, **evaluation_options)
+write_results(evaluation, evaluation_results_path, timesteps=model.num_timesteps, final=True)
+
+for name, value in evaluation["metrics"].items():
+    print("{}: {}".format(name, value))
@@ -0,0 +1,232 @@
+import cProfile
+import time
+from functools import wraps
+from pathlib import Path
+
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnvWrapper
+
+'''
+Where the wall time of the training goes.
+
+TimedVecEnv wraps the training env and times reset and step, the envs living in this process
+(and the SUMO workers of a SumoWorkerPool created with wrapper_class=instrumentEnv) also time
+simulateTraffic and the traci simulation steps. TimingCallback times the forward passes of the policy
+during the rollouts and the gradient updates, and records all the times of the last iteration under
+timing/ in the logger of the model, so they end up in tensorboard next to the rollout and train values.
+With a profile directory, the training is also run under cProfile and the profile is dumped every
+profile_interval timesteps (profile-<timesteps>.prof, readable with pstats or snakeviz).
+'''
+
+
+class TimingStats:
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def merge(self, other):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+
+
+def timed(function, stats, name):
+    @wraps(function)
+    def timedFunction(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stats.add(name, time.perf_counter() - start)
+
+    return timedFunction
+
+
+def instrumentEnv(env):
+    '''
+    Times simulateTraffic and, for the SUMO env, the traci simulation steps of an env.
+    The times are kept in env.unwrapped.timing_stats. Returns the env, so that it can be given
+    as wrapper_class to SumoWorkerPool and the workers are instrumented in their own process.
+    '''
+    unwrapped = getattr(env, "unwrapped", env)
+    if hasattr(unwrapped, "timing_stats"):
+        return env
+
+    stats = TimingStats()
+    unwrapped.timing_stats = stats
+
+    if hasattr(unwrapped, "simulateTraffic"):
+        unwrapped.simulateTraffic = timed(unwrapped.simulateTraffic, stats, "simulate_traffic")
+
+    if hasattr(unwrapped, "startSumo"):
+        # a new connection is made every time SUMO is (re)started
+        def instrumentConnection():
+            unwrapped.connection.simulationStep = timed(unwrapped.connection.simulationStep, stats, "traci_simulation_step")
+
+        startSumo = unwrapped.startSumo
+        def startInstrumentedSumo():
+            startSumo()
+            instrumentConnection()
+
+        unwrapped.startSumo = startInstrumentedSumo
+        if unwrapped.connection is not None:
+            instrumentConnection()
+
+    return env
+
+
+class TimedVecEnv(VecEnvWrapper):
+
+    def __init__(self, venv, workers_instrumented=False):
+        '''
+        workers_instrumented: the envs of a SubprocVecEnv were created with instrumentEnv,
+        their times are then read from the workers
+        '''
+        super().__init__(venv)
+        self.timing_stats = TimingStats()
+        self.workers_instrumented = workers_instrumented
+        self.worker_totals = TimingStats()
+
+        # envs in this process are instrumented here, the ones in worker processes can't be
+        if isinstance(venv, SubprocVecEnv):
+            self.local_envs = []
+        elif isinstance(venv, DummyVecEnv):
+            self.local_envs = list(venv.envs)
+        else:
+            self.local_envs = [venv]
+
+        for env in self.local_envs:
+            instrumentEnv(env)
+
+        self.step_start = None
+
+    def reset(self):
+        start = time.perf_counter()
+        observation = self.venv.reset()
+        self.timing_stats.add("env_reset", time.perf_counter() - start)
+        return observation
+
+    def step_async(self, actions):
+        self.step_start = time.perf_counter()
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        result = self.venv.step_wait()
+        self.timing_stats.add("env_step", time.perf_counter() - self.step_start)
+        return result
+
+    def collectTimings(self):
+        '''
+        Times since the last call, the times of the envs are summed over the envs
+        '''
+        stats = TimingStats()
+        stats.merge(self.timing_stats)
+        self.timing_stats.reset()
+
+        for env in self.local_envs:
+            env_stats = getattr(env, "unwrapped", env).timing_stats
+            stats.merge(env_stats)
+            env_stats.reset()
+
+        if self.workers_instrumented:
+            # the workers keep their totals, only the increase since the last call is taken
+            totals = TimingStats()
+            for worker_stats in self.venv.get_attr("timing_stats"):
+                totals.merge(worker_stats)
+
+            for name, seconds in totals.seconds.items():
+                stats.seconds[name] = stats.seconds.get(name, 0.0) + seconds - self.worker_totals.seconds.get(name, 0.0)
+                stats.calls[name] = stats.calls.get(name, 0) + totals.calls[name] - self.worker_totals.calls.get(name, 0)
+            self.worker_totals = totals
+
+        return stats
+
+
+class TimingCallback(BaseCallback):
+
+    def __init__(self, profile_directory=None, profile_interval=None, verbose=0):
+        '''
+        profile_directory: where the cProfile dumps are written, no profiling if not given
+        profile_interval: timesteps between two dumps, one dump at the end of each learn if not given
+        '''
+        super().__init__(verbose)
+        self.timing_stats = TimingStats()
+        self.rollout_start = None
+
+        self.profile_directory = None if profile_directory is None else Path(profile_directory)
+        self.profile_interval = profile_interval
+        self.profiler = None
+        self.last_profile_dump = 0
+
+    def timedEnv(self):
+        env = self.training_env
+        while env is not None and not isinstance(env, TimedVecEnv):
+            env = getattr(env, "venv", None)
+        return env
+
+    def _on_training_start(self):
+        # the timed methods are instance attributes, removed at the end of the training so that they are never saved with the model
+        policy = self.model.policy
+        policy.forward = timed(policy.forward, self.timing_stats, "policy_forward")
+        self.model.train = timed(self.model.train, self.timing_stats, "gradient_update")
+
+        if self.profile_directory is not None:
+            self.profile_directory.mkdir(parents=True, exist_ok=True)
+            if self.profiler is None:
+                self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def _on_rollout_start(self):
+        self.rollout_start = time.perf_counter()
+
+    def _on_rollout_end(self):
+        '''
+        Recorded before the logger dumps the values of the iteration, the gradient update is the one of the previous iteration
+        '''
+        stats = TimingStats()
+        stats.merge(self.timing_stats)
+        self.timing_stats.reset()
+
+        timed_env = self.timedEnv()
+        if timed_env is not None:
+            stats.merge(timed_env.collectTimings())
+
+        self.logger.record("timing/rollout_seconds", time.perf_counter() - self.rollout_start)
+        for name, seconds in stats.seconds.items():
+            self.logger.record("timing/{}_seconds".format(name), seconds)
+            self.logger.record("timing/{}_calls".format(name), stats.calls[name])
+
+    def _on_step(self):
+        if self.profiler is not None and self.profile_interval is not None and self.num_timesteps - self.last_profile_dump >= self.profile_interval:
+            self.dumpProfile()
+
+        return True
+
+    def _on_training_end(self):
+        del self.model.policy.forward
+        del self.model.train
+
+        if self.profiler is None:
+            return
+
+        if self.profile_interval is None:
+            self.dumpProfile()
+        self.profiler.disable()
+
+    def dumpProfile(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(str(self.profile_directory / "profile-{}.prof".format(self.num_timesteps)))
+        self.last_profile_dump = self.num_timesteps
+
+        # the next dump only has the calls of the next interval
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
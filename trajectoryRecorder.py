@@ -0,0 +1,75 @@
+import numpy
+
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+from trajectoryStore import CHUNK_SIZE, TrajectoryWriter
+
+'''
+Records every transition of a vectorized env to a trajectory store (see trajectoryStore.py).
+
+Each step appends one row per env: the observation the action was taken from, the action,
+the reward, done, the phase and the simulation time the action was taken at, the index of the env
+and the number of the episode of that env, like the decisions recorded by traffic.py.
+The phase and the simulation time are the ones of the infos of the previous step (the SUMO env gives them),
+-1 and nan at the start of an episode since reset doesn't give infos.
+'''
+
+
+class RecordingVecEnv(VecEnvWrapper):
+
+    def __init__(self, venv, directory, chunk_size=CHUNK_SIZE, lanes=None, green_phases=None):
+        '''
+        lanes, green_phases: what the observations and the actions of the env are, kept in the schema of the store
+        '''
+        super().__init__(venv)
+
+        observation_size = int(numpy.prod(self.observation_space.shape))
+        self.writer = TrajectoryWriter(directory, observation_size, chunk_size, lanes=lanes, green_phases=green_phases)
+
+        # the observations are copied, some vectorized envs hand out buffers they write again
+        self.observations = numpy.zeros((self.num_envs, observation_size), dtype=numpy.float32)
+        self.actions = numpy.zeros(self.num_envs, dtype=numpy.int64)
+        self.env_indices = numpy.arange(self.num_envs, dtype=numpy.int32)
+        self.episodes = numpy.zeros(self.num_envs, dtype=numpy.int64)
+        self.phases = numpy.full(self.num_envs, -1, dtype=numpy.int32)
+        self.simulation_times = numpy.full(self.num_envs, numpy.nan)
+
+    def reset(self):
+        observations = self.venv.reset()
+        self.observations[:] = numpy.asarray(observations).reshape(self.num_envs, -1)
+        self.phases.fill(-1)
+        self.simulation_times.fill(numpy.nan)
+
+        return observations
+
+    def step_async(self, actions):
+        self.actions[:] = numpy.asarray(actions).reshape(self.num_envs)
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        observations, rewards, dones, infos = self.venv.step_wait()
+
+        self.writer.append(
+            observation=self.observations,
+            action=self.actions,
+            reward=rewards,
+            done=dones,
+            phase=self.phases,
+            simulation_time=self.simulation_times,
+            env=self.env_indices,
+            episode=self.episodes,
+        )
+
+        self.episodes += dones
+        self.observations[:] = numpy.asarray(observations).reshape(self.num_envs, -1)
+
+        # the state the next actions are taken at, unknown for the envs which started a new episode
+        for i, info in enumerate(infos):
+            self.phases[i] = -1 if dones[i] else info.get("phase", -1)
+            self.simulation_times[i] = numpy.nan if dones[i] else info.get("simulation_time", numpy.nan)
+
+        return observations, rewards, dones, infos
+
+    def close(self):
+        self.writer.close()
+        self.venv.close()
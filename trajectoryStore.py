@@ -0,0 +1,281 @@
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+
+import numpy
+from numpy.lib.format import open_memmap
+
+'''
+Transitions stored in memory-mapped columns, for offline analysis and behavior cloning.
+
+The transitions are appended to chunks of chunk_size rows, every column of a chunk is a .npy file
+(chunk-000000/observation.npy, chunk-000000/action.npy, ...) opened as a memory map, so appending
+only copies the rows into the page cache. When a chunk is full a background thread flushes it to disk
+and adds it to schema.json, which holds the columns and the number of rows of every finished chunk.
+A chunk which isn't listed there (the one being written when a run was killed) is ignored by the reader.
+The schema can also hold the lanes the observation is made of and the green phase of every action, in order,
+so that the transitions are only used with a policy whose observations and actions mean the same.
+The reader opens the chunks as read only memory maps, any transition can be indexed and the whole
+store streamed in batches without loading it in memory.
+'''
+
+SCHEMA_NAME = "schema.json"
+CHUNK_SIZE = 65536
+MAX_PENDING_CHUNKS = 4      # append() blocks when the disk is this many chunks behind
+
+
+def trajectoryColumns(observation_size):
+    '''
+    Columns of a transition: the observation the action was taken from, the action, the reward and done
+    returned by the step, the phase and the simulation time the action was taken at (SUMO only, -1 and nan otherwise),
+    the env of a vectorized env and the episode of that env
+    '''
+    # name: [dtype, shape of a row], lists so that they compare equal to the ones read back from schema.json
+    return {
+        "observation": ["float32", [observation_size]],
+        "action": ["int64", []],
+        "reward": ["float32", []],
+        "done": ["bool", []],
+        "phase": ["int32", []],
+        "simulation_time": ["float64", []],
+        "env": ["int32", []],
+        "episode": ["int64", []],
+    }
+
+
+def chunkName(index):
+    return "chunk-{:06d}".format(index)
+
+
+def writeSchema(directory, schema):
+    path = Path(directory) / SCHEMA_NAME
+    temporary_path = path.with_name("{}.tmp-{}".format(path.name, os.getpid()))
+
+    with open(temporary_path, "w") as schema_file:
+        json.dump(schema, schema_file, indent=4)
+        schema_file.flush()
+        os.fsync(schema_file.fileno())
+
+    os.replace(temporary_path, path)
+
+
+class TrajectoryWriter:
+
+    def __init__(self, directory, observation_size, chunk_size=CHUNK_SIZE, columns=None, lanes=None, green_phases=None):
+        '''
+        Appends to the store in directory if there is one with the same columns, lanes and green phases
+        lanes: ids of the lanes of the observation, in order
+        green_phases: green phase (in the program of the junction) of each action
+        '''
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        columns = columns or trajectoryColumns(observation_size)
+        lanes = None if lanes is None else list(lanes)
+        green_phases = None if green_phases is None else [int(phase) for phase in green_phases]
+
+        schema_path = self.directory / SCHEMA_NAME
+        if schema_path.exists():
+            with open(schema_path) as schema_file:
+                self.schema = json.load(schema_file)
+            if self.schema["columns"] != columns:
+                raise ValueError("{} holds transitions with other columns: {}".format(self.directory, self.schema["columns"]))
+            if self.schema.get("lanes") != lanes or self.schema.get("green_phases") != green_phases:
+                raise ValueError("{} holds transitions of the lanes {} and green phases {}".format(self.directory, self.schema.get("lanes"), self.schema.get("green_phases")))
+        else:
+            self.schema = {"columns": columns, "lanes": lanes, "green_phases": green_phases, "chunk_size": chunk_size, "chunks": []}
+            writeSchema(self.directory, self.schema)
+
+        self.chunk_size = self.schema["chunk_size"]
+        self.next_chunk = len(self.schema["chunks"])
+
+        # memory maps of the chunk being filled
+        self.chunk = None
+        self.rows = 0
+
+        self.pending = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
+        self.error = None
+        self.flusher = threading.Thread(target=self.flushChunks, daemon=True)
+        self.flusher.start()
+
+    def openChunk(self):
+        chunk_directory = self.directory / chunkName(self.next_chunk)
+        chunk_directory.mkdir(exist_ok=True)
+
+        self.chunk = {
+            name: open_memmap(chunk_directory / "{}.npy".format(name), mode="w+", dtype=numpy.dtype(dtype), shape=(self.chunk_size, *shape))
+            for name, (dtype, shape) in self.schema["columns"].items()
+        }
+        self.rows = 0
+
+    def append(self, **columns):
+        '''
+        Appends a batch of transitions, every column of the schema is given with one row per transition
+        '''
+        self.raiseFlushError()
+
+        missing = self.schema["columns"].keys() - columns.keys()
+        if missing:
+            raise ValueError("Missing columns: {}".format(sorted(missing)))
+
+        number_of_rows = len(columns["action"])
+        start = 0
+        while start < number_of_rows:
+            if self.chunk is None:
+                self.openChunk()
+
+            stop = min(number_of_rows, start + self.chunk_size - self.rows)
+            for name, column in self.chunk.items():
+                column[self.rows:self.rows + stop - start] = columns[name][start:stop]
+            self.rows += stop - start
+            start = stop
+
+            if self.rows == self.chunk_size:
+                self.finishChunk()
+
+    def finishChunk(self):
+        '''
+        Hands the chunk to the background thread, the next append opens a new one
+        '''
+        if self.chunk is None or self.rows == 0:
+            return
+
+        self.pending.put((chunkName(self.next_chunk), self.chunk, self.rows))
+        self.next_chunk += 1
+        self.chunk = None
+        self.rows = 0
+
+    def flushChunks(self):
+        while True:
+            item = self.pending.get()
+            try:
+                if item is None:
+                    return
+
+                name, chunk, rows = item
+                for column in chunk.values():
+                    column.flush()
+                del chunk
+
+                # the chunk is only listed once its columns are on disk
+                self.schema["chunks"].append({"name": name, "rows": rows})
+                writeSchema(self.directory, self.schema)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        '''
+        Writes the partially filled chunk too and blocks until everything appended is on disk
+        '''
+        self.finishChunk()
+        self.pending.join()
+        self.raiseFlushError()
+
+    def raiseFlushError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.flush()
+        self.pending.put(None)
+        self.flusher.join()
+
+
+class TrajectoryReader:
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+        with open(self.directory / SCHEMA_NAME) as schema_file:
+            self.schema = json.load(schema_file)
+
+        self.columns = list(self.schema["columns"])
+        # None for the stores which don't say what their observations and actions are
+        self.lanes = self.schema.get("lanes")
+        self.green_phases = self.schema.get("green_phases")
+        self.chunks = self.schema["chunks"]
+        # index of the first transition of every chunk, and the total at the end
+        self.offsets = numpy.concatenate([[0], numpy.cumsum([chunk["rows"] for chunk in self.chunks], dtype=numpy.int64)])
+        self.memory_maps = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def column(self, chunk_index, name):
+        '''
+        Read only memory map of a column of a chunk, opened on first use
+        '''
+        key = (chunk_index, name)
+        if key not in self.memory_maps:
+            chunk = self.chunks[chunk_index]
+            self.memory_maps[key] = numpy.load(self.directory / chunk["name"] / "{}.npy".format(name), mmap_mode="r")[:chunk["rows"]]
+
+        return self.memory_maps[key]
+
+    def chunk(self, chunk_index, columns=None):
+        return {name: self.column(chunk_index, name) for name in columns or self.columns}
+
+    def __getitem__(self, index):
+        '''
+        Transitions at index (an integer, a slice or an array of indices), as a dict of columns
+        '''
+        if isinstance(index, slice):
+            index = numpy.arange(*index.indices(len(self)))
+        return self.take(index)
+
+    def take(self, indices, columns=None):
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        scalar = indices.ndim == 0
+        indices = numpy.atleast_1d(indices)
+
+        indices = numpy.where(indices < 0, indices + len(self), indices)
+        if indices.size and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError("Transition index out of range for {} transitions".format(len(self)))
+
+        chunk_indices = numpy.searchsorted(self.offsets, indices, side="right") - 1
+
+        result = {}
+        for name in columns or self.columns:
+            dtype, shape = self.schema["columns"][name]
+            values = numpy.empty((len(indices), *shape), dtype=dtype)
+            for chunk_index in numpy.unique(chunk_indices):
+                selected = chunk_indices == chunk_index
+                values[selected] = self.column(chunk_index, name)[indices[selected] - self.offsets[chunk_index]]
+            result[name] = values[0] if scalar else values
+
+        return result
+
+    def iterBatches(self, batch_size, columns=None, shuffle=False, seed=None):
+        '''
+        Streams the whole store, the batches don't span chunks.
+        Without shuffle the batches are views of the memory maps, in order.
+        With shuffle the chunks and the transitions within a chunk are visited in a random order,
+        so only one chunk at a time is read from disk.
+        '''
+        rng = numpy.random.default_rng(seed)
+        chunk_order = rng.permutation(len(self.chunks)) if shuffle else range(len(self.chunks))
+
+        for chunk_index in chunk_order:
+            chunk = self.chunk(chunk_index, columns)
+            rows = self.chunks[chunk_index]["rows"]
+
+            if shuffle:
+                order = rng.permutation(rows)
+                for start in range(0, rows, batch_size):
+                    batch = numpy.sort(order[start:start + batch_size])
+                    yield {name: column[batch] for name, column in chunk.items()}
+            else:
+                for start in range(0, rows, batch_size):
+                    yield {name: column[start:start + batch_size] for name, column in chunk.items()}
+
+    def sample(self, batch_size, rng=None, columns=None):
+        '''
+        Random transitions drawn uniformly over the whole store
+        '''
+        rng = rng if rng is not None else numpy.random.default_rng()
+        return self.take(rng.integers(len(self), size=batch_size), columns)